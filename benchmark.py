@@ -0,0 +1,474 @@
+#!/usr/bin/env python3
+"""
+YouTube Video Downloader - Offline Benchmarks
+Measure the download pipeline without touching the real network
+
+A local HTTP server serves synthetic media of configurable size and latency,
+and stand-ins for the yt-dlp executable and the yt_dlp module fetch from it.
+Results are written as JSON so runs can be compared for regressions.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import threading
+import statistics
+import subprocess
+from pathlib import Path
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+ROOT = Path(__file__).resolve().parent
+
+# Stand-in for the yt-dlp executable. It understands the options the
+# downloader passes, fetches the media from the benchmark server and prints
+# progress in yt-dlp's --newline format.
+FAKE_YT_DLP = r'''#!/usr/bin/env python3
+import os, re, sys, json, time, http.client
+
+args = sys.argv[1:]
+if '--version' in args:
+    print('0000.00.00-benchmark')
+    sys.exit(0)
+
+def option(name):
+    return [args[i + 1] for i, a in enumerate(args[:-1]) if a == name]
+
+def info_for(video_id):
+    size = int(os.environ['BENCH_SIZE'])
+    url = 'http://' + os.environ['BENCH_MEDIA'] + '/media/' + video_id + '?size=' + str(size) + '&latency=' + os.environ['BENCH_LATENCY']
+    return {
+        'id': video_id, 'title': 'Benchmark ' + video_id, 'duration': 60, 'ext': 'mp4',
+        'formats': [
+            {'format_id': '140', 'ext': 'm4a', 'vcodec': 'none', 'acodec': 'mp4a.40.2', 'filesize': size // 10},
+            {'format_id': '22', 'ext': 'mp4', 'vcodec': 'avc1', 'acodec': 'mp4a.40.2', 'height': 1080,
+             'filesize': size, 'url': url, 'protocol': 'http'},
+        ],
+    }
+
+if '--load-info-json' in args:
+    with open(option('--load-info-json')[0]) as f:
+        video_id = json.load(f)['id']
+else:
+    video_id = re.search(r'v=([\w-]{11})', args[-1]).group(1)
+info = info_for(video_id)
+
+if '--dump-json' in args:
+    print(json.dumps(info))
+    sys.exit(0)
+
+templates = option('-o')
+main_template = next(t for t in templates if not t.startswith('infojson:'))
+if '--write-info-json' in args:
+    for t in templates:
+        if t.startswith('infojson:'):
+            with open(t[len('infojson:'):].replace('%(id)s', video_id).replace('.%(ext)s', '.info.json'), 'w') as f:
+                json.dump(info, f)
+
+target = main_template.replace('%(title)s', info['title']).replace('%(id)s', video_id).replace('%(ext)s', 'mp4')
+media = os.environ['BENCH_MEDIA']
+conn = http.client.HTTPConnection(media)
+conn.request('GET', '/media/' + video_id + '?size=' + os.environ['BENCH_SIZE'] + '&latency=' + os.environ['BENCH_LATENCY'])
+response = conn.getresponse()
+total = int(response.headers['Content-Length'])
+done = 0
+start = time.monotonic()
+print('[download] Destination: ' + target, flush=True)
+with open(target, 'wb') as f:
+    while True:
+        chunk = response.read(256 * 1024)
+        if not chunk:
+            break
+        f.write(chunk)
+        done += len(chunk)
+        speed = done / max(time.monotonic() - start, 1e-6) / 1048576
+        print('[download] %5.1f%% of %8.2fMiB at %8.2fMiB/s ETA 00:00 [bench] t=%.6f'
+              % (done * 100 / total, total / 1048576, speed, time.time()), flush=True)
+sys.exit(0)
+'''
+
+# Stand-in for the yt_dlp module, used by the in-process backend. It keeps
+# one HTTP connection per YoutubeDL instance like the real session does.
+FAKE_YT_DLP_MODULE = r'''
+import os, time, json, http.client
+
+from . import utils
+
+
+class YoutubeDL:
+    def __init__(self, params=None):
+        self.params = params or {}
+        self._progress_hooks = []
+        self._postprocessor_hooks = []
+        self._post_hooks = []
+        self._conn = None
+    
+    def add_progress_hook(self, hook):
+        self._progress_hooks.append(hook)
+    
+    def add_postprocessor_hook(self, hook):
+        self._postprocessor_hooks.append(hook)
+    
+    def add_post_hook(self, hook):
+        self._post_hooks.append(hook)
+    
+    def sanitize_info(self, info, remove_private_keys=False):
+        return info
+    
+    def _info(self, url):
+        video_id = url.split('v=')[1][:11]
+        size = int(os.environ['BENCH_SIZE'])
+        media_url = ('http://' + os.environ['BENCH_MEDIA'] + '/media/' + video_id + '?size=' + str(size)
+                     + '&latency=' + os.environ['BENCH_LATENCY'])
+        return {
+            'id': video_id, 'title': 'Benchmark ' + video_id, 'duration': 60, 'ext': 'mp4',
+            'formats': [
+                {'format_id': '140', 'ext': 'm4a', 'vcodec': 'none', 'acodec': 'mp4a.40.2', 'filesize': size // 10},
+                {'format_id': '22', 'ext': 'mp4', 'vcodec': 'avc1', 'acodec': 'mp4a.40.2', 'height': 1080,
+                 'filesize': size, 'url': media_url, 'protocol': 'http'},
+            ],
+        }
+    
+    def extract_info(self, url, download=True, **kwargs):
+        info = self._info(url)
+        if download:
+            self._fetch(info)
+        return info
+    
+    def download_with_info_file(self, path):
+        with open(path) as f:
+            self._fetch(json.load(f))
+        return 0
+    
+    def download(self, urls):
+        for url in urls:
+            self._fetch(self._info(url))
+        return 0
+    
+    def _fetch(self, info):
+        if self._conn is None:
+            self._conn = http.client.HTTPConnection(os.environ['BENCH_MEDIA'])
+        self._conn.request('GET', '/media/' + info['id'] + '?size=' + os.environ['BENCH_SIZE']
+                           + '&latency=' + os.environ['BENCH_LATENCY'])
+        response = self._conn.getresponse()
+        total = int(response.headers['Content-Length'])
+        target = self.params['outtmpl'].replace('%(title)s', info['title']).replace('%(id)s', info['id']).replace('%(ext)s', 'mp4')
+        done = 0
+        with open(target, 'wb') as f:
+            while True:
+                chunk = response.read(256 * 1024)
+                if not chunk:
+                    break
+                f.write(chunk)
+                done += len(chunk)
+                status = {'status': 'downloading', 'downloaded_bytes': done, 'total_bytes': total,
+                          'filename': target, 'speed': None, 'eta': 0}
+                for hook in self._progress_hooks:
+                    hook(status)
+        for hook in self._progress_hooks:
+            hook({'status': 'finished', 'downloaded_bytes': done, 'total_bytes': total, 'filename': target})
+        info['requested_downloads'] = [{'filepath': target}]
+        for hook in self._post_hooks:
+            hook(target)
+'''
+
+FAKE_YT_DLP_UTILS = '''
+class DownloadError(Exception):
+    pass
+
+
+class DownloadCancelled(Exception):
+    pass
+'''
+
+
+class MediaHandler(BaseHTTPRequestHandler):
+    """Serves /media/<id>?size=<bytes>&latency=<ms> as zero-filled data, honouring Range"""
+    protocol_version = 'HTTP/1.1'
+    block = bytes(256 * 1024)
+    
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        size = int(query.get('size', ['1048576'])[0])
+        latency = float(query.get('latency', ['0'])[0]) / 1000
+        if latency:
+            time.sleep(latency)
+        match = re.match(r'bytes=(\d+)-(\d*)$', self.headers.get('Range', ''))
+        if match:
+            start = int(match.group(1))
+            end = min(int(match.group(2) or size - 1), size - 1)
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+            size = end - start + 1
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', 'video/mp4')
+        self.send_header('Content-Length', str(size))
+        self.end_headers()
+        remaining = size
+        try:
+            while remaining > 0:
+                chunk = self.block[:min(remaining, len(self.block))]
+                self.wfile.write(chunk)
+                remaining -= len(chunk)
+        except (BrokenPipeError, ConnectionResetError):
+            # Stopped downloads hang up mid-transfer
+            self.close_connection = True
+    
+    def log_message(self, format, *args):
+        pass
+
+
+class BenchEnvironment:
+    """Temporary media server, fake yt-dlp and scratch folders for one run"""
+    def __init__(self, size, latency_ms, connections=1):
+        self.connections = connections
+        self.tmp = Path(tempfile.mkdtemp(prefix='ytdl-bench-'))
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), MediaHandler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        
+        bin_dir = self.tmp / 'bin'
+        bin_dir.mkdir()
+        fake = bin_dir / 'yt-dlp'
+        fake.write_text(FAKE_YT_DLP.replace('#!/usr/bin/env python3', f'#!{sys.executable}', 1))
+        fake.chmod(0o755)
+        module_dir = self.tmp / 'modules' / 'yt_dlp'
+        module_dir.mkdir(parents=True)
+        (module_dir / '__init__.py').write_text(FAKE_YT_DLP_MODULE)
+        (module_dir / 'utils.py').write_text(FAKE_YT_DLP_UTILS)
+        
+        # Runs never read the user's config.json or touch ~/.cache
+        self.config_file = self.tmp / 'config.json'
+        self.config_file.write_text(json.dumps({'cache_dir': str(self.tmp / 'cache')}))
+        
+        self.saved_env = dict(os.environ)
+        os.environ['PATH'] = f"{bin_dir}{os.pathsep}{os.environ.get('PATH', '')}"
+        os.environ['BENCH_MEDIA'] = f"127.0.0.1:{self.server.server_address[1]}"
+        self.configure(size, latency_ms)
+        sys.path.insert(0, str(self.tmp / 'modules'))
+    
+    def configure(self, size, latency_ms):
+        os.environ['BENCH_SIZE'] = str(int(size))
+        os.environ['BENCH_LATENCY'] = str(latency_ms)
+    
+    def downloader(self, backend, workers=1):
+        """A YouTubeDownloader writing into a fresh folder with a private cache"""
+        from downloader import YouTubeDownloader, MetadataCache
+        out = Path(tempfile.mkdtemp(dir=self.tmp, prefix='out-'))
+        downloader = YouTubeDownloader(output_dir=out, config_file=self.config_file)
+        downloader.output_dir = out
+        downloader.quality = '1080p'
+        downloader.concurrent_downloads = workers
+        downloader.max_per_host = workers
+        downloader.connections = self.connections
+        downloader.governor.set_limit(None)
+        downloader.metadata_cache = MetadataCache(out / '.cache')
+        downloader.select_backend(backend)
+        return downloader
+    
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+        os.environ.clear()
+        os.environ.update(self.saved_env)
+        sys.path.remove(str(self.tmp / 'modules'))
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+
+def bench_urls(count, offset=0):
+    return [f"https://www.youtube.com/watch?v=bench{offset + i:06d}" for i in range(count)]
+
+
+def summarize(samples):
+    return {
+        'runs': len(samples),
+        'mean_s': statistics.mean(samples),
+        'median_s': statistics.median(samples),
+        'min_s': min(samples),
+        'max_s': max(samples),
+    }
+
+
+def bench_overhead(env, backend, count):
+    """Seconds per URL spent outside the transfer, measured on 1-byte downloads"""
+    env.configure(1, 0)
+    downloader = env.downloader(backend)
+    samples = []
+    for url in bench_urls(count):
+        start = time.perf_counter()
+        result = downloader.download(url, on_line=lambda line: None)
+        samples.append(time.perf_counter() - start)
+        if not result:
+            raise RuntimeError(f"{backend} download failed: {result.error}")
+    return summarize(samples)
+
+
+def bench_throughput(env, backend, count, size, latency_ms, workers):
+    """Items/s and MB/s of a bulk run through run_bulk"""
+    env.configure(size, latency_ms)
+    downloader = env.downloader(backend, workers)
+    start = time.perf_counter()
+    summary = downloader.run_bulk(
+        iter(bench_urls(count, offset=100000)),
+        lambda url: downloader.download(url, on_line=lambda line: None),
+        log=lambda message: None,
+    )
+    elapsed = time.perf_counter() - start
+    return {
+        'items': summary.total,
+        'failed': len(summary.failed_urls),
+        'workers': workers,
+        'item_bytes': size,
+        'latency_ms': latency_ms,
+        'elapsed_s': elapsed,
+        'items_per_s': summary.total / elapsed,
+        'mb_per_s': summary.success_count * size / (1024 * 1024) / elapsed,
+    }
+
+
+def bench_startup(runs):
+    """Wall time of cold interpreter starts of the front ends"""
+    commands = {
+        'downloader_help': [sys.executable, str(ROOT / 'downloader.py'), '--help'],
+        'import_downloader': [sys.executable, '-c', 'import downloader'],
+        'import_gui': [sys.executable, '-c', 'import gui'],
+    }
+    results = {}
+    for name, cmd in commands.items():
+        samples = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            completed = subprocess.run(cmd, cwd=ROOT, capture_output=True)
+            samples.append(time.perf_counter() - start)
+        results[name] = summarize(samples) if completed.returncode == 0 else {
+            'error': completed.stderr.decode(errors='replace').strip().splitlines()[-1:]
+        }
+    return results
+
+
+def bench_log_latency(env, size):
+    """Delay between yt-dlp printing a progress line and the callbacks seeing it"""
+    from downloader import ProgressEvent
+    env.configure(size, 0)
+    downloader = env.downloader('subprocess')
+    downloader.progress_interval = 0
+    downloader.connections = 1
+    line_delays = []
+    event_delays = []
+    pending = {}
+    
+    def on_line(line):
+        marker = line.rfind('[bench] t=')
+        if marker != -1:
+            sent = float(line[marker + len('[bench] t='):])
+            line_delays.append(time.time() - sent)
+            pending['sent'] = sent
+    
+    def on_progress(event):
+        if event.phase == ProgressEvent.PHASE_DOWNLOAD and 'sent' in pending:
+            event_delays.append(time.time() - pending.pop('sent'))
+    
+    for url in bench_urls(3, offset=200000):
+        downloader.download(url, on_line=on_line, on_progress=on_progress)
+    results = {
+        'line_callback': summarize(line_delays) if line_delays else None,
+        'progress_event': summarize(event_delays) if event_delays else None,
+    }
+    results['gui_render'] = bench_gui_render()
+    return results
+
+
+def bench_gui_render(lines=5000):
+    """Time for DownloaderGUI to render a burst of log lines, if a display is available"""
+    try:
+        import tkinter as tk
+        root = tk.Tk()
+    except Exception as e:
+        return {'skipped': f"No display: {e}"}
+    try:
+        root.withdraw()
+        from gui import DownloaderGUI
+        app = DownloaderGUI(root)
+        start = time.perf_counter()
+        for i in range(lines):
+            app.log(f"[download] {i % 100:5.1f}% of 10.00MiB", key=i % 8)
+            app.log(f"line {i}")
+        app.render_log()
+        root.update_idletasks()
+        elapsed = time.perf_counter() - start
+        return {'lines': lines * 2, 'elapsed_s': elapsed, 'lines_per_s': lines * 2 / elapsed}
+    finally:
+        root.destroy()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Offline benchmarks for the downloader pipeline',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  Quick run with defaults:
+    python benchmark.py
+  
+  Larger bulk run saved for later comparison:
+    python benchmark.py --items 200 --size 5M --latency 50 --workers 8 --output bench.json
+        """
+    )
+    parser.add_argument('--items', type=int, default=40, help='URLs in the bulk throughput run (default: 40)')
+    parser.add_argument('--size', default='2M', help='Bytes per synthetic video, e.g. 500K or 5M (default: 2M)')
+    parser.add_argument('--latency', type=float, default=20, help='Server latency per request in ms (default: 20)')
+    parser.add_argument('--workers', type=int, default=4, help='Parallel downloads for the bulk run (default: 4)')
+    parser.add_argument('--overhead-runs', type=int, default=10, help='Downloads per backend for the overhead run (default: 10)')
+    parser.add_argument('--startup-runs', type=int, default=5, help='Cold starts per front end (default: 5)')
+    parser.add_argument('--connections', type=int, default=1,
+                        help='Parallel connections per video; above 1 exercises range downloads (default: 1)')
+    parser.add_argument('--backend', action='append', choices=['subprocess', 'inprocess'],
+                        help='Backend(s) to measure (default: both)')
+    parser.add_argument('--output', help='Write the JSON results to this file as well as stdout')
+    args = parser.parse_args()
+    
+    sys.path.insert(0, str(ROOT))
+    from downloader import parse_rate
+    size = int(parse_rate(args.size))
+    backends = args.backend or ['subprocess', 'inprocess']
+    
+    results = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': vars(args),
+        'overhead': {},
+        'throughput': {},
+    }
+    env = BenchEnvironment(size, args.latency, args.connections)
+    try:
+        for backend in backends:
+            print(f"⏱️  {backend}: per-URL overhead", file=sys.stderr)
+            results['overhead'][backend] = bench_overhead(env, backend, args.overhead_runs)
+            print(f"⏱️  {backend}: bulk throughput", file=sys.stderr)
+            results['throughput'][backend] = bench_throughput(
+                env, backend, args.items, size, args.latency, args.workers
+            )
+        print("⏱️  log pipeline latency", file=sys.stderr)
+        results['log_latency'] = bench_log_latency(env, size)
+    finally:
+        env.close()
+    print("⏱️  startup time", file=sys.stderr)
+    results['startup'] = bench_startup(args.startup_runs)
+    
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        Path(args.output).write_text(output + '\n')
+        print(f"💾 Results saved to: {args.output}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
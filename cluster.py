@@ -0,0 +1,428 @@
+#!/usr/bin/env python3
+"""
+YouTube Video Downloader - Cluster Mode
+Spread one bulk download over several machines
+
+A coordinator reads the URL list and leases one URL at a time to any number
+of workers over a line-based JSON protocol on TCP. Workers download with the
+normal YouTubeDownloader and report back. A lease that is not renewed in
+time (worker crashed or lost its network) goes back into the queue.
+"""
+
+import sys
+import json
+import time
+import heapq
+import uuid
+import queue
+import socket
+import argparse
+import threading
+import socketserver
+from collections import deque
+from pathlib import Path
+
+from downloader import (
+    YouTubeDownloader, UrlDeduplicator, BulkSummary, TRANSIENT, iter_url_lines, classify_failure, retry_delay,
+)
+
+DEFAULT_PORT = 8765
+# Seconds an idle worker waits before asking for work again
+POLL_INTERVAL = 5
+# URLs listed ahead of the workers; the listing pauses when this many wait
+FEED_AHEAD = 100
+
+
+class Coordinator:
+    """Hands out URLs from a bulk list as time-limited leases
+    
+    A URL is leased at most max_attempts times: again after its lease
+    expired, or after a transient failure once the retry backoff of
+    config.json has passed. Permanent failures are final.
+    """
+    def __init__(self, file_path, output_dir, quality="1080p", audio_only=False,
+                 lease_timeout=600, max_attempts=3):
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.quality = quality
+        self.audio_only = audio_only
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+        self.dedupe = UrlDeduplicator()
+        # Lists playlists and channels of the file into their videos
+        self.lister = YouTubeDownloader(output_dir=self.output_dir, quality=quality)
+        # Listing playlists takes yt-dlp calls, so a feeder thread expands
+        # the file into this queue and leases only pop from it
+        self.source = queue.Queue(maxsize=FEED_AHEAD)
+        self.source_done = False
+        self.requeued = deque()
+        # (due, url) of transiently failed URLs waiting for their backoff
+        self.retries = []
+        self.retried = set()
+        self.leases = {}
+        self.attempts = {}
+        self.summary = BulkSummary()
+        self.summary.count_in_background(file_path)
+        self.errors = {}
+        self.finished = threading.Event()
+        threading.Thread(target=self._feed, args=(file_path,), daemon=True).start()
+    
+    def _feed(self, file_path):
+        """Expand the URL file into the source queue, ending it with None"""
+        try:
+            urls = self.lister.expand_urls(iter_url_lines(file_path), on_error=self._listing_failed)
+            for url in self.dedupe.filter(urls):
+                self.source.put(url)
+        finally:
+            self.source.put(None)
+    
+    def _listing_failed(self, url, error):
+        """Record a playlist or channel that could not be listed"""
+        with self.lock:
+            self.errors[url] = error
+            self.summary.added()
+            self.summary.record(url, False)
+        print(f"❌ Could not list {url}: {error}")
+    
+    def _drained(self):
+        """True once every URL has a final result (lock held)"""
+        return self.source_done and not self.requeued and not self.retries and not self.leases
+    
+    def _next_url(self):
+        """Next URL to lease, or None when there is none right now (lock held)"""
+        if self.requeued:
+            return self.requeued.popleft()
+        if self.retries and self.retries[0][0] <= time.monotonic():
+            return heapq.heappop(self.retries)[1]
+        if self.source_done:
+            return None
+        try:
+            url = self.source.get_nowait()
+        except queue.Empty:
+            # Still listing
+            return None
+        if url is None:
+            self.source_done = True
+            self.summary.ingest_done = True
+        else:
+            self.summary.added()
+        return url
+    
+    def lease(self, worker):
+        """Return the next lease for worker, or a wait/done message"""
+        with self.lock:
+            self._expire_leases()
+            url = self._next_url()
+            if url is None:
+                if self._drained():
+                    self.finished.set()
+                    return {'done': True}
+                # Still listing, or leases still running may come back: ask the worker to poll
+                wait = min(POLL_INTERVAL, self.lease_timeout)
+                if self.retries:
+                    wait = max(0.1, min(wait, self.retries[0][0] - time.monotonic()))
+                return {'wait': wait}
+            lease_id = uuid.uuid4().hex
+            self.attempts[url] = self.attempts.get(url, 0) + 1
+            self.leases[lease_id] = {
+                'url': url,
+                'worker': worker,
+                'expires': time.monotonic() + self.lease_timeout,
+            }
+        print(f"📤 {worker}: {url}")
+        return {
+            'lease_id': lease_id,
+            'url': url,
+            'quality': self.quality,
+            'audio_only': self.audio_only,
+            'lease_timeout': self.lease_timeout,
+        }
+    
+    def heartbeat(self, lease_id):
+        """Extend a running lease"""
+        with self.lock:
+            lease = self.leases.get(lease_id)
+            if not lease:
+                return {'ok': False, 'error': 'Unknown or expired lease'}
+            lease['expires'] = time.monotonic() + self.lease_timeout
+        return {'ok': True}
+    
+    def result(self, lease_id, ok, error=None):
+        """Record the outcome of a lease"""
+        with self.lock:
+            lease = self.leases.pop(lease_id, None)
+            if not lease:
+                # The lease expired and the URL was handed to someone else
+                return {'ok': False, 'error': 'Unknown or expired lease'}
+            url = lease['url']
+            reason = delay = None
+            if not ok:
+                if error:
+                    self.errors[url] = error
+                reason, kind = classify_failure(error)
+                if kind == TRANSIENT and self.attempts.get(url, 0) < self.max_attempts:
+                    delay = retry_delay(self.attempts[url], self.lister.retry_backoff, self.lister.retry_backoff_max)
+                    heapq.heappush(self.retries, (time.monotonic() + delay, url))
+                    self.retried.add(url)
+                    self.summary.retried = len(self.retried)
+            if delay is None:
+                done = self.summary.record(url, ok, reason)
+            if self._drained():
+                self.finished.set()
+        if delay is not None:
+            print(f"⏳ {lease['worker']}: {reason}, retrying in {delay:.0f}s: {url}")
+        else:
+            print(f"[{self.summary.progress(done)}] {'✅' if ok else '❌'} {lease['worker']}: {url}")
+        return {'ok': True}
+    
+    def _expire_leases(self):
+        """Requeue leases whose worker stopped renewing them (lock held)"""
+        now = time.monotonic()
+        for lease_id, lease in list(self.leases.items()):
+            if lease['expires'] > now:
+                continue
+            del self.leases[lease_id]
+            url = lease['url']
+            if self.attempts.get(url, 0) >= self.max_attempts:
+                self.errors[url] = 'Lease expired too often'
+                self.summary.record(url, False, 'lease_expired')
+                print(f"❌ Giving up on {url}: lease expired {self.max_attempts} times")
+            else:
+                self.requeued.append(url)
+                print(f"⏰ Lease of {lease['worker']} expired, requeued: {url}")
+        if self._drained():
+            self.finished.set()
+    
+    def reap(self):
+        """Periodically requeue expired leases until the run is over"""
+        while not self.finished.wait(min(POLL_INTERVAL, self.lease_timeout)):
+            with self.lock:
+                self._expire_leases()
+    
+    def handle(self, message):
+        op = message.get('op')
+        if op == 'lease':
+            return self.lease(message.get('worker', 'unknown'))
+        if op == 'heartbeat':
+            return self.heartbeat(message.get('lease_id'))
+        if op == 'result':
+            return self.result(message.get('lease_id'), bool(message.get('ok')), message.get('error'))
+        return {'ok': False, 'error': f"Unknown op: {op}"}
+    
+    def print_summary(self):
+        summary = self.summary
+        print(f"\n{'='*60}")
+        print(f"📊 CLUSTER DOWNLOAD SUMMARY")
+        print(f"{'='*60}")
+        print(f"✅ Successful: {summary.success_count}/{summary.total}")
+        print(f"❌ Failed: {len(summary.failed_urls)}/{summary.total}")
+        if summary.retried:
+            print(f"🔁 Retried after transient errors: {summary.retried}")
+        if self.dedupe.duplicates:
+            print(f"♻️  Duplicate downloads saved: {self.dedupe.duplicates}")
+        
+        if summary.failed_urls:
+            print(f"\n❌ Failed URLs:")
+            for url in summary.failed_urls:
+                print(f"  - {url}" + (f" ({self.errors[url]})" if url in self.errors else ""))
+            failed_file = self.output_dir / 'failed_urls.txt'
+            summary.save_failed(failed_file)
+            print(f"\n💾 Failed URLs saved to: {failed_file}")
+
+
+class CoordinatorHandler(socketserver.StreamRequestHandler):
+    """One worker connection: a JSON request per line, a JSON reply per line"""
+    def handle(self):
+        for line in self.rfile:
+            try:
+                reply = self.server.coordinator.handle(json.loads(line))
+            except ValueError:
+                reply = {'ok': False, 'error': 'Invalid JSON'}
+            self.wfile.write(json.dumps(reply).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+
+class CoordinatorServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    
+    def __init__(self, address, coordinator):
+        super().__init__(address, CoordinatorHandler)
+        self.coordinator = coordinator
+
+
+def run_coordinator(coordinator, host, port):
+    """Serve leases until every URL has a result"""
+    server = CoordinatorServer((host, port), coordinator)
+    print(f"🛰️  Coordinator listening on {host}:{server.server_address[1]}")
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    threading.Thread(target=coordinator.reap, daemon=True).start()
+    try:
+        coordinator.finished.wait()
+        # Keep answering until every polling worker has received 'done'
+        time.sleep(POLL_INTERVAL + 1)
+    except KeyboardInterrupt:
+        print("\n⚠️  Coordinator stopped by user")
+    finally:
+        server.shutdown()
+        server.server_close()
+    coordinator.print_summary()
+
+
+class CoordinatorClient:
+    """A worker thread's connection to the coordinator"""
+    def __init__(self, host, port, timeout=30):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.file = self.sock.makefile('rwb')
+        self.lock = threading.Lock()
+    
+    def call(self, **message):
+        with self.lock:
+            self.file.write(json.dumps(message).encode('utf-8') + b'\n')
+            self.file.flush()
+            line = self.file.readline()
+        if not line:
+            raise ConnectionError('Coordinator closed the connection')
+        return json.loads(line)
+    
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+
+def work(downloader, host, port, name, stop):
+    """Lease, download and report URLs until the coordinator says done"""
+    client = None
+    failures = 0
+    while not stop.is_set():
+        try:
+            if client is None:
+                client = CoordinatorClient(host, port)
+            lease = client.call(op='lease', worker=name)
+            failures = 0
+        except OSError as e:
+            if client:
+                client.close()
+                client = None
+            failures += 1
+            if failures > 5:
+                print(f"❌ {name}: coordinator unreachable ({e})")
+                return
+            time.sleep(min(POLL_INTERVAL * 2, 2 ** failures))
+            continue
+        
+        if lease.get('done'):
+            break
+        if 'wait' in lease:
+            time.sleep(lease['wait'])
+            continue
+        
+        # Keep the lease alive while the download runs
+        finished = threading.Event()
+        
+        def heartbeat(lease_id=lease['lease_id'], interval=max(1, lease['lease_timeout'] / 3)):
+            while not finished.wait(interval):
+                try:
+                    client.call(op='heartbeat', lease_id=lease_id)
+                except OSError:
+                    return
+        
+        threading.Thread(target=heartbeat, daemon=True).start()
+        downloader.quality = lease['quality']
+        try:
+            result = downloader.download_single(lease['url'], lease['audio_only'], quiet=True)
+        finally:
+            finished.set()
+        
+        try:
+            client.call(op='result', lease_id=lease['lease_id'], ok=bool(result),
+                        error=getattr(result, 'error', None))
+        except OSError:
+            # The lease will expire and the URL will be retried elsewhere
+            client.close()
+            client = None
+    if client:
+        client.close()
+
+
+def run_worker(downloader, host, port, slots):
+    """Run slots parallel lease loops against the coordinator"""
+    base = f"{socket.gethostname()}-{uuid.uuid4().hex[:6]}"
+    stop = threading.Event()
+    threads = [
+        threading.Thread(target=work, args=(downloader, host, port, f"{base}/{i}", stop), daemon=True)
+        for i in range(1, slots + 1)
+    ]
+    print(f"🔧 Worker {base} connecting to {host}:{port} with {slots} download slots")
+    for thread in threads:
+        thread.start()
+    try:
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(0.5)
+    except KeyboardInterrupt:
+        print("\n⚠️  Worker stopped by user")
+        stop.set()
+    print(f"👋 Worker {base} finished")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Distributed bulk downloads: one coordinator, many workers',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  Start the coordinator on the machine holding the URL list:
+    python cluster.py coordinator --file urls.txt --port 8765
+  
+  Start a worker on each download machine:
+    python cluster.py worker --connect 192.168.1.10:8765 --workers 4
+        """
+    )
+    sub = parser.add_subparsers(dest='role', required=True)
+    
+    coord = sub.add_parser('coordinator', help='Serve a URL list to workers')
+    coord.add_argument('--file', required=True, help='Text file with URLs (one per line), or - to read stdin')
+    coord.add_argument('--host', default='0.0.0.0', help='Address to listen on (default: 0.0.0.0)')
+    coord.add_argument('--port', type=int, default=DEFAULT_PORT, help=f'Port to listen on (default: {DEFAULT_PORT})')
+    coord.add_argument('--quality', choices=['360p', '480p', '720p', '1080p', '1440p', '2160p'],
+                       default='1080p', help='Video quality for all workers (default: 1080p)')
+    coord.add_argument('--audio-only', action='store_true', help='Download audio only (MP3)')
+    coord.add_argument('--output', default='./downloads', help='Where to save failed_urls.txt (default: ./downloads)')
+    coord.add_argument('--lease-timeout', type=int, default=600,
+                       help='Seconds a worker may go silent before its URL is requeued (default: 600)')
+    coord.add_argument('--max-attempts', type=int, default=3, help='Leases per URL before giving up (default: 3)')
+    
+    worker = sub.add_parser('worker', help='Download URLs leased from a coordinator')
+    worker.add_argument('--connect', required=True, help='Coordinator address as host:port')
+    worker.add_argument('--workers', type=int, help='Parallel downloads on this machine (default: concurrent_downloads in config.json)')
+    worker.add_argument('--output', default='./downloads', help='Output directory (default: ./downloads)')
+    
+    args = parser.parse_args()
+    
+    if args.role == 'coordinator':
+        if args.file != '-' and not Path(args.file).exists():
+            print(f"❌ File not found: {args.file}")
+            sys.exit(1)
+        coordinator = Coordinator(
+            args.file, args.output,
+            quality=args.quality,
+            audio_only=args.audio_only,
+            lease_timeout=args.lease_timeout,
+            max_attempts=args.max_attempts,
+        )
+        run_coordinator(coordinator, args.host, args.port)
+    else:
+        host, _, port = args.connect.rpartition(':')
+        downloader = YouTubeDownloader(output_dir=args.output)
+        # --output wins over download_folder in config.json
+        downloader.output_dir = Path(args.output)
+        downloader.output_dir.mkdir(parents=True, exist_ok=True)
+        # Each slot's yt-dlp process gets an equal part of bandwidth_limit
+        downloader.concurrent_downloads = args.workers or downloader.concurrent_downloads
+        run_worker(downloader, host or 'localhost', int(port or DEFAULT_PORT), downloader.concurrent_downloads)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,780 @@
+#!/usr/bin/env python3
+"""
+YouTube Video Downloader - Daemon Mode
+Keep one warm downloader running and hand it jobs over a local HTTP API
+
+The daemon loads config.json, probes yt-dlp and opens the metadata cache
+once, then runs a fixed pool of download workers shared by every job. The
+CLI and the GUI submit to it when it is reachable, so starting a download
+costs one localhost request instead of a cold start.
+
+API (JSON, 127.0.0.1 only):
+  POST   /jobs       submit {"url" | "urls" | "file" | "stream", "audio_only", "quality", "output"}
+  POST   /jobs/<id>/urls  add {"urls", "done"} to a list submitted with "stream": true
+  GET    /jobs       list submitted jobs (?state=running, ?all=1 includes list entries)
+  GET    /jobs/<id>  status of one job (?since=N children, ?lines=N output lines)
+  DELETE /jobs/<id>  cancel a job and, for lists, all of its videos
+  GET    /metrics    Prometheus metrics of the shared downloader
+  GET    /limit      the bandwidth limit shared by all jobs, in bytes/s (null: unlimited)
+  POST   /limit      change it for all jobs: {"limit": "5M"} or {"limit": null}
+"""
+
+import sys
+import json
+import time
+import uuid
+import queue
+import shutil
+import argparse
+import threading
+import subprocess
+import http.client
+from collections import OrderedDict, deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from pathlib import Path
+from urllib.parse import urlparse, parse_qs
+
+from downloader import (
+    YouTubeDownloader, UrlDeduplicator, BulkSummary, PostProcessPool, SubprocessBackend,
+    QUALITY_HEIGHTS, TRANSIENT, iter_url_lines, is_collection_url, classify_failure, retry_delay,
+)
+
+DEFAULT_PORT = 8766
+# Seconds between status polls of a following client
+POLL_INTERVAL = 0.5
+# Output lines kept per job for clients that follow it
+MAX_JOB_LINES = 200
+# Most URLs a client sends per request while streaming stdin
+STREAM_CHUNK = 100
+
+
+def configured_port():
+    """daemon_port from config.json, without building a downloader"""
+    try:
+        with open('config.json', 'r') as f:
+            return int(json.load(f).get('daemon_port') or DEFAULT_PORT)
+    except (OSError, ValueError):
+        return DEFAULT_PORT
+
+
+class Job:
+    """One submitted video, or a URL list whose videos become child jobs"""
+    QUEUED = 'queued'
+    LISTING = 'listing'
+    RUNNING = 'running'
+    POSTPROCESSING = 'postprocessing'
+    DONE = 'done'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+    FINISHED = (DONE, FAILED, CANCELLED)
+    
+    def __init__(self, kind, source, audio_only, quality, output, parent=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.url = source
+        self.audio_only = audio_only
+        self.quality = quality
+        self.output = output
+        self.parent = parent
+        self.state = Job.LISTING if kind == 'list' else Job.QUEUED
+        self.error = None
+        self.reason = None
+        self.attempts = 0
+        self.progress = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.cancelled = threading.Event()
+        self.lines = deque(maxlen=MAX_JOB_LINES)
+        self.line_count = 0
+        self.children = []
+        self.summary = BulkSummary()
+        # URLs still to come for a streamed list; None once it is complete
+        self.feed = None
+    
+    def add_line(self, line):
+        self.lines.append(line)
+        self.line_count += 1
+    
+    def set_progress(self, event):
+        self.progress = event.as_dict()
+    
+    def as_dict(self, since=None, lines=None):
+        """JSON view; since and lines select the children and output lines to include"""
+        data = {
+            'id': self.id,
+            'kind': self.kind,
+            'url': self.url,
+            'state': self.state,
+            'audio_only': self.audio_only,
+            'quality': self.quality,
+            'output': self.output,
+            'error': self.error,
+            'reason': self.reason,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+        }
+        if self.kind == 'list':
+            data['total'] = self.summary.total
+            data['succeeded'] = self.summary.success_count
+            data['failed'] = len(self.summary.failed_urls)
+            data['estimated_total'] = self.summary.estimated_total
+            data['listing_done'] = self.summary.ingest_done
+            if since is not None:
+                data['children'] = [child.as_dict() for child in self.children[since:]]
+        else:
+            data['progress'] = self.progress
+            if self.parent:
+                data['parent'] = self.parent.id
+            if lines is not None:
+                skip = max(0, lines - (self.line_count - len(self.lines)))
+                data['lines'] = list(self.lines)[skip:]
+                data['line_count'] = self.line_count
+        return data
+
+
+class DownloadDaemon:
+    """Job table and shared worker pool in front of warm YouTubeDownloaders"""
+    def __init__(self, downloader, workers=None, keep_finished=1000):
+        self.base = downloader
+        self.workers = max(1, workers or downloader.concurrent_downloads)
+        self.keep_finished = keep_finished
+        self.lock = threading.Lock()
+        self.jobs = OrderedDict()
+        self.finished_jobs = deque()
+        self.downloaders = {}
+        self.queue = queue.Queue()
+        self.postprocessor = None
+        if downloader.pipeline_postprocessing and shutil.which('ffmpeg'):
+            self.postprocessor = PostProcessPool(downloader.postprocess_workers, downloader.postprocess_queue,
+                                                 downloader.metrics)
+        self.threads = [threading.Thread(target=self._worker, daemon=True) for _ in range(self.workers)]
+        for thread in self.threads:
+            thread.start()
+    
+    def downloader_for(self, output, quality):
+        """Warm downloader for an output folder and quality
+        
+        Every instance shares the base downloader's metadata cache, bandwidth
+        governor, per-host limits and metrics, so concurrent jobs with
+        different settings still respect one set of limits.
+        """
+        key = (output, quality)
+        with self.lock:
+            downloader = self.downloaders.get(key)
+            if downloader is None:
+                base = self.base
+                downloader = YouTubeDownloader(output_dir=output, quality=quality)
+                downloader.output_dir = Path(output)
+                downloader.output_dir.mkdir(parents=True, exist_ok=True)
+                downloader.quality = quality
+                # The worker pool, not config.json, decides how many yt-dlp processes share the bandwidth
+                downloader.concurrent_downloads = self.workers
+                downloader.metadata_cache = base.metadata_cache
+                downloader.governor = base.governor
+                downloader.metrics = base.metrics
+                downloader._host_slots = base._host_slots
+                downloader._host_slots_lock = base._host_slots_lock
+                for other in self.downloaders.values():
+                    if other.output_dir == downloader.output_dir:
+                        # One archive per folder, whatever the quality
+                        downloader._archive = other.archive
+                        break
+                self.downloaders[key] = downloader
+            return downloader
+    
+    def submit(self, request):
+        """Create a job from a POST /jobs body; raises ValueError for bad requests"""
+        audio_only = bool(request.get('audio_only', False))
+        quality = request.get('quality') or self.base.quality
+        if quality not in QUALITY_HEIGHTS:
+            raise ValueError(f"Unknown quality: {quality}")
+        output = str(Path(request.get('output') or self.base.output_dir).expanduser().resolve())
+        try:
+            Path(output).mkdir(parents=True, exist_ok=True)
+        except OSError as e:
+            raise ValueError(f"Cannot use output folder {output}: {e}")
+        
+        if request.get('file'):
+            file_path = Path(request['file']).expanduser()
+            if not file_path.exists():
+                raise ValueError(f"File not found: {file_path}")
+            job = Job('list', str(file_path), audio_only, quality, output)
+            lines = iter_url_lines(file_path)
+            job.summary.count_in_background(file_path)
+        elif request.get('urls'):
+            urls = request['urls']
+            if not isinstance(urls, list):
+                raise ValueError("urls must be a list")
+            job = Job('list', f"{len(urls)} URLs", audio_only, quality, output)
+            lines = urls
+        elif request.get('stream'):
+            # URLs follow through add_urls() while the list already runs
+            job = Job('list', 'streamed URLs', audio_only, quality, output)
+            job.feed = queue.Queue()
+            lines = iter(job.feed.get, None)
+        elif request.get('url'):
+            url = request['url'].strip()
+            if is_collection_url(url):
+                job = Job('list', url, audio_only, quality, output)
+                lines = [url]
+            else:
+                job = Job('video', url, audio_only, quality, output)
+                lines = None
+        else:
+            raise ValueError("Give one of url, urls or file")
+        
+        with self.lock:
+            self.jobs[job.id] = job
+        if lines is None:
+            self.queue.put(job)
+        else:
+            job.started = time.time()
+            threading.Thread(target=self._list, args=(job, lines), daemon=True).start()
+        print(f"📥 Job {job.id}: {job.url}")
+        return job
+    
+    def add_urls(self, job, urls, done=False):
+        """Queue more URLs for a streamed list job; done ends its listing"""
+        if not isinstance(urls, list):
+            raise ValueError("urls must be a list")
+        with self.lock:
+            if job.feed is None:
+                raise ValueError("Job does not take more URLs")
+            for url in urls:
+                job.feed.put(url)
+            if done:
+                job.feed.put(None)
+                job.feed = None
+    
+    def _list(self, job, lines):
+        """Turn a URL list into child jobs without running ahead of the workers"""
+        def listing_failed(url, error):
+            child = self._child(job, url)
+            child.error = f"Could not list: {error}"
+            self._finish(child, Job.FAILED)
+        
+        try:
+            dedupe = UrlDeduplicator()
+            downloader = self.downloader_for(job.output, job.quality)
+            urls = dedupe.filter(downloader.expand_urls(lines, on_error=listing_failed))
+            urls = downloader.schedule(downloader.skip_archived(urls, job.audio_only), job.audio_only,
+                                       dedupe.priorities)
+            for url in urls:
+                while self.queue.qsize() >= self.workers * 2 and not job.cancelled.is_set():
+                    time.sleep(0.1)
+                if job.cancelled.is_set():
+                    break
+                self.queue.put(self._child(job, url))
+        except Exception as e:
+            # Ends the listing; the videos queued so far still run
+            job.error = str(e) or type(e).__name__
+        with self.lock:
+            job.summary.ingest_done = True
+            if job.state == Job.LISTING:
+                job.state = Job.RUNNING
+        self._check_list(job)
+    
+    def _child(self, job, url):
+        child = Job('video', url, job.audio_only, job.quality, job.output, parent=job)
+        with self.lock:
+            job.children.append(child)
+            job.summary.added()
+            self.jobs[child.id] = child
+        return child
+    
+    def _worker(self):
+        while True:
+            job = self.queue.get()
+            try:
+                self._run(job)
+            except Exception as e:
+                # Fail the job, never the worker: the pool must stay at full size
+                job.error = str(e) or type(e).__name__
+                job.reason = classify_failure(job.error)[0]
+                self._finish(job, Job.FAILED)
+    
+    def _run(self, job):
+        """Download one video job on the calling worker"""
+        if job.cancelled.is_set():
+            self._finish(job, Job.CANCELLED)
+            return
+        downloader = self.downloader_for(job.output, job.quality)
+        path = downloader.archived_path(job.url, job.audio_only)
+        if path:
+            job.add_line(f"📚 Already downloaded: {path}")
+            self._finish(job, Job.DONE)
+            return
+        with downloader.host_slot(job.url):
+            job.state = Job.RUNNING
+            job.started = time.time()
+            result = downloader.download(
+                job.url, job.audio_only,
+                on_line=job.add_line,
+                should_stop=job.cancelled.is_set,
+                on_progress=job.set_progress,
+                defer_postprocess=self.postprocessor is not None,
+            )
+        if result and result.postprocess:
+            job.state = Job.POSTPROCESSING
+            self.postprocessor.submit(result.postprocess, lambda result, job=job: self._done(job, result))
+            return
+        self._done(job, result)
+    
+    def _done(self, job, result):
+        if result:
+            self._finish(job, Job.DONE)
+        elif job.cancelled.is_set():
+            self._finish(job, Job.CANCELLED)
+        else:
+            job.error = result.error
+            job.reason, kind = classify_failure(result.error)
+            base = self.base
+            if kind == TRANSIENT and job.attempts < base.retry_attempts:
+                # Back off without holding a worker; other jobs keep running meanwhile
+                job.attempts += 1
+                delay = retry_delay(job.attempts, base.retry_backoff, base.retry_backoff_max)
+                job.state = Job.QUEUED
+                job.add_line(f"⏳ {job.reason}, retrying in {delay:.0f}s")
+                timer = threading.Timer(delay, self.queue.put, (job,))
+                timer.daemon = True
+                timer.start()
+                return
+            self._finish(job, Job.FAILED)
+    
+    def _finish(self, job, state):
+        with self.lock:
+            if job.state in Job.FINISHED:
+                return
+            job.state = state
+            job.finished = time.time()
+            if job.parent is None:
+                self._retire(job)
+        parent = job.parent
+        if parent:
+            parent.summary.record(job.url, state == Job.DONE, job.reason if state == Job.FAILED else state)
+            self._check_list(parent)
+        print(f"{'✅' if state == Job.DONE else '❌'} Job {job.id} {state}: {job.url}")
+    
+    def _check_list(self, job):
+        """Finish a list job once it is fully listed and every video finished"""
+        summary = job.summary
+        if not summary.ingest_done or summary.success_count + len(summary.failed_urls) < summary.total:
+            return
+        if job.cancelled.is_set():
+            state = Job.CANCELLED
+        elif summary.failed_urls or job.error or not summary.total:
+            state = Job.FAILED
+            job.error = job.error or (None if summary.total else 'No valid URLs found')
+        else:
+            state = Job.DONE
+        self._finish(job, state)
+    
+    def _retire(self, job):
+        """Forget the oldest finished jobs beyond keep_finished (lock held)"""
+        self.finished_jobs.append(job.id)
+        while len(self.finished_jobs) > self.keep_finished:
+            old = self.jobs.pop(self.finished_jobs.popleft(), None)
+            for child in getattr(old, 'children', ()):
+                self.jobs.pop(child.id, None)
+    
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+    
+    def list_jobs(self, state=None, include_children=False):
+        with self.lock:
+            jobs = list(self.jobs.values())
+        return [
+            job for job in jobs
+            if (include_children or job.parent is None) and (state is None or job.state == state)
+        ]
+    
+    def cancel(self, job):
+        """Stop a job; running downloads are interrupted, queued ones never start"""
+        job.cancelled.set()
+        with self.lock:
+            children = list(job.children)
+            if job.feed is not None:
+                # Let the listing of a streamed list end
+                job.feed.put(None)
+                job.feed = None
+        for child in children:
+            child.cancelled.set()
+        if job.kind == 'video' and job.state == Job.QUEUED:
+            # Still in the queue: the worker that picks it up only discards it
+            self._finish(job, Job.CANCELLED)
+        elif job.kind == 'list':
+            for child in children:
+                if child.state == Job.QUEUED:
+                    self._finish(child, Job.CANCELLED)
+            self._check_list(job)
+
+
+class DaemonHandler(BaseHTTPRequestHandler):
+    def _reply(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+    
+    def _route(self):
+        parsed = urlparse(self.path)
+        parts = [part for part in parsed.path.split('/') if part]
+        query = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+        return parts, query
+    
+    def _host_allowed(self):
+        """Reject requests whose Host is not this daemon's own address
+        
+        A web page can point its own host name at 127.0.0.1 (DNS
+        rebinding); its requests then carry that name as Host.
+        """
+        port = self.server.server_address[1]
+        if self.headers.get('Host', '').lower() in (f'127.0.0.1:{port}', f'localhost:{port}'):
+            return True
+        self._reply(403, {'error': 'Unexpected Host header'})
+        return False
+    
+    def _job(self, parts):
+        job = self.server.daemon.get(parts[1]) if len(parts) == 2 else None
+        if job is None:
+            self._reply(404, {'error': 'Unknown job'})
+        return job
+    
+    def do_GET(self):
+        if not self._host_allowed():
+            return
+        daemon = self.server.daemon
+        parts, query = self._route()
+        if parts == ['health']:
+            self._reply(200, {'ok': True, 'backend': daemon.base.backend.name, 'workers': daemon.workers})
+        elif parts == ['metrics']:
+            body = daemon.base.metrics.prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        elif parts == ['limit']:
+            self._reply(200, {'limit': daemon.base.governor.limit})
+        elif parts == ['jobs']:
+            jobs = daemon.list_jobs(query.get('state'), query.get('all') == '1')
+            self._reply(200, {'jobs': [job.as_dict() for job in jobs]})
+        elif parts[:1] == ['jobs']:
+            job = self._job(parts)
+            if job:
+                try:
+                    since = int(query['since']) if 'since' in query else None
+                    lines = int(query['lines']) if 'lines' in query else None
+                except ValueError:
+                    self._reply(400, {'error': 'since and lines must be integers'})
+                    return
+                self._reply(200, job.as_dict(since=since, lines=lines))
+        else:
+            self._reply(404, {'error': 'Not found'})
+    
+    def do_POST(self):
+        if not self._host_allowed():
+            return
+        parts, _ = self._route()
+        job = None
+        if parts == ['limit']:
+            pass
+        elif len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'urls':
+            job = self._job(parts[:2])
+            if not job:
+                return
+        elif parts != ['jobs']:
+            self._reply(404, {'error': 'Not found'})
+            return
+        # Browsers cannot send this content type cross-origin without a
+        # preflight the daemon never answers, so web pages cannot submit jobs
+        if self.headers.get('Content-Type', '').split(';')[0].strip() != 'application/json':
+            self._reply(415, {'error': 'Expected application/json'})
+            return
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            request = json.loads(self.rfile.read(length) or b'{}')
+            if not isinstance(request, dict):
+                raise ValueError("Expected a JSON object")
+            if parts == ['limit']:
+                governor = self.server.daemon.base.governor
+                governor.set_limit(request.get('limit'))
+                print(f"🚦 Speed limit set to {request.get('limit') or 'unlimited'}")
+                self._reply(200, {'limit': governor.limit})
+                return
+            if job:
+                self.server.daemon.add_urls(job, request.get('urls') or [], bool(request.get('done')))
+                self._reply(200, job.as_dict())
+                return
+            job = self.server.daemon.submit(request)
+        except ValueError as e:
+            self._reply(400, {'error': str(e)})
+            return
+        self._reply(201, job.as_dict())
+    
+    def do_DELETE(self):
+        if not self._host_allowed():
+            return
+        parts, _ = self._route()
+        job = self._job(parts) if parts[:1] == ['jobs'] else None
+        if job:
+            self.server.daemon.cancel(job)
+            self._reply(200, job.as_dict())
+        elif parts[:1] != ['jobs']:
+            self._reply(404, {'error': 'Not found'})
+    
+    def log_message(self, format, *args):
+        pass
+
+
+class DaemonServer(ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    
+    def __init__(self, address, daemon):
+        super().__init__(address, DaemonHandler)
+        self.daemon = daemon
+
+
+class DaemonClient:
+    """Talks to a running daemon; every call is one short-lived localhost request"""
+    def __init__(self, port=None, host='127.0.0.1', timeout=10):
+        self.host = host
+        self.port = port or configured_port()
+        self.timeout = timeout
+    
+    @classmethod
+    def connect(cls, port=None, timeout=0.5):
+        """Return a client when a daemon answers on port, else None"""
+        client = cls(port, timeout=timeout)
+        try:
+            client.request('GET', '/health')
+        except (OSError, RuntimeError, ValueError):
+            return None
+        client.timeout = 10
+        return client
+    
+    def request(self, method, path, body=None):
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        try:
+            headers = {}
+            data = None
+            if body is not None:
+                data = json.dumps(body).encode('utf-8')
+                headers['Content-Type'] = 'application/json'
+            connection.request(method, path, data, headers)
+            response = connection.getresponse()
+            reply = json.loads(response.read() or b'{}')
+        finally:
+            connection.close()
+        if response.status >= 400:
+            raise RuntimeError(reply.get('error') or f"HTTP {response.status}")
+        return reply
+    
+    def submit(self, url=None, urls=None, file=None, stream=False, audio_only=False, quality=None, output=None):
+        return self.request('POST', '/jobs', {
+            'url': url, 'urls': urls, 'file': file, 'stream': stream,
+            'audio_only': audio_only, 'quality': quality, 'output': output,
+        })
+    
+    def set_limit(self, limit):
+        """Change the daemon's bandwidth limit, e.g. '5M'; None removes it"""
+        return self.request('POST', '/limit', {'limit': limit})
+    
+    def add_urls(self, job_id, urls, done=False):
+        return self.request('POST', f"/jobs/{job_id}/urls", {'urls': urls, 'done': done})
+    
+    def job(self, job_id, since=None, lines=None):
+        query = '&'.join(f"{key}={value}" for key, value in (('since', since), ('lines', lines)) if value is not None)
+        return self.request('GET', f"/jobs/{job_id}" + (f"?{query}" if query else ''))
+    
+    def jobs(self, state=None):
+        return self.request('GET', '/jobs' + (f"?state={state}" if state else ''))['jobs']
+    
+    def cancel(self, job_id):
+        return self.request('DELETE', f"/jobs/{job_id}")
+    
+    def follow(self, job, log=print, should_stop=None, on_progress=None, summary=None):
+        """Poll job until it finished, logging like a local run
+        
+        Video jobs stream their yt-dlp output to log and their progress to
+        on_progress; list jobs log one line per finished video and tally
+        them in summary (a BulkSummary). should_stop() true cancels the job.
+        Returns the final job state.
+        """
+        summary = summary or BulkSummary()
+        since = 0
+        lines = 0
+        reported = set()
+        cancelled = False
+        while True:
+            if should_stop and not cancelled and should_stop():
+                self.cancel(job['id'])
+                cancelled = True
+            if job['kind'] == 'list':
+                job = self.job(job['id'], since=since)
+                summary.total = job['total']
+                summary.estimated_total = job['estimated_total']
+                summary.ingest_done = job['listing_done']
+                for child in job['children']:
+                    if child['state'] not in Job.FINISHED or child['id'] in reported:
+                        continue
+                    reported.add(child['id'])
+                    ok = child['state'] == Job.DONE
+                    done = summary.record(child['url'], ok, child['reason'])
+                    reason = '' if ok else f" ({child['reason'] or child['error'] or child['state']})"
+                    log(f"[{summary.progress(done)}] {'✅' if ok else '❌'} {child['url']}{reason}")
+                # Only children after the first unfinished one can still change
+                for child in job['children']:
+                    if child['state'] not in Job.FINISHED:
+                        break
+                    since += 1
+            else:
+                job = self.job(job['id'], lines=lines)
+                for line in job['lines']:
+                    log(line)
+                lines = job['line_count']
+                if on_progress and job['progress']:
+                    on_progress(job['progress'])
+            if job['state'] in Job.FINISHED:
+                return job
+            time.sleep(POLL_INTERVAL)
+
+
+def stream_stdin(client, job_id, chunk_size=STREAM_CHUNK):
+    """Send the URLs on stdin to a streamed list job as they are read
+    
+    Lines that arrive while a request is out are sent together, up to
+    chunk_size at a time, so a fast pipe does not cost a request per line.
+    """
+    lines = queue.Queue()
+    
+    def read():
+        for line in sys.stdin:
+            if line.strip():
+                lines.put(line.strip())
+        lines.put(None)
+    
+    threading.Thread(target=read, daemon=True).start()
+    done = False
+    while not done:
+        urls = [lines.get()]
+        while urls[-1] is not None and len(urls) < chunk_size:
+            try:
+                urls.append(lines.get_nowait())
+            except queue.Empty:
+                break
+        if urls[-1] is None:
+            urls.pop()
+            done = True
+        try:
+            client.add_urls(job_id, urls, done)
+        except (OSError, RuntimeError) as e:
+            # Cancelled, or the daemon went away; following the job reports it
+            print(f"❌ Could not send more URLs: {e}")
+            return
+
+
+def run_client(client, url=None, file=None, audio_only=False, quality=None, output='./downloads'):
+    """Submit a CLI download to the daemon and follow it to the end"""
+    output_dir = Path(output).expanduser().resolve()
+    request = {'audio_only': audio_only, 'quality': quality, 'output': str(output_dir)}
+    if url:
+        request['url'] = url
+    elif file == '-':
+        request['stream'] = True
+    else:
+        request['file'] = str(Path(file).resolve())
+    
+    try:
+        job = client.submit(**request)
+    except RuntimeError as e:
+        print(f"❌ {e}")
+        return False
+    print(f"🛰️  Submitted to the downloader daemon as job {job['id']}")
+    if request.get('stream'):
+        threading.Thread(target=stream_stdin, args=(client, job['id']), daemon=True).start()
+    print(f"Quality: {quality if not audio_only else 'Audio Only'}")
+    print(f"Output: {output_dir}")
+    
+    summary = BulkSummary()
+    try:
+        job = client.follow(job, summary=summary)
+    except KeyboardInterrupt:
+        client.cancel(job['id'])
+        print(f"\n⚠️  Job {job['id']} cancelled")
+        return False
+    
+    if job['kind'] == 'video':
+        if job['state'] == Job.DONE:
+            print("✅ Download completed!")
+        else:
+            print(f"❌ Download failed: {job['error'] or job['state']}" + (f" ({job['reason']})" if job['reason'] else ""))
+        return job['state'] == Job.DONE
+    
+    print(f"\n{'='*50}")
+    print(f"📊 DOWNLOAD SUMMARY")
+    print(f"{'='*50}")
+    print(f"✅ Successful: {summary.success_count}/{summary.total}")
+    print(f"❌ Failed: {len(summary.failed_urls)}/{summary.total}")
+    if summary.failed_urls:
+        output_dir.mkdir(parents=True, exist_ok=True)
+        failed_file = output_dir / 'failed_urls.txt'
+        summary.save_failed(failed_file)
+        print(f"\n💾 Failed URLs saved to: {failed_file}")
+    return job['state'] == Job.DONE
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Run a persistent downloader that the CLI and GUI submit jobs to',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=f"""
+Examples:
+  Start the daemon (downloader.py and gui.py use it automatically):
+    python daemon.py
+  
+  Submit a job by hand:
+    curl -X POST -H 'Content-Type: application/json' \\
+         -d '{{"url": "VIDEO_URL"}}' http://127.0.0.1:{DEFAULT_PORT}/jobs
+        """
+    )
+    parser.add_argument('--port', type=int, help=f'Port to listen on (default: daemon_port in config.json or {DEFAULT_PORT})')
+    parser.add_argument('--workers', type=int, help='Parallel downloads shared by all jobs (default: concurrent_downloads in config.json)')
+    parser.add_argument('--output', default='./downloads', help='Output directory for jobs that do not name one (default: ./downloads)')
+    args = parser.parse_args()
+    
+    downloader = YouTubeDownloader(output_dir=args.output)
+    if downloader.backend.name == SubprocessBackend.name:
+        try:
+            subprocess.run(['yt-dlp', '--version'], capture_output=True, check=True)
+        except (subprocess.CalledProcessError, FileNotFoundError):
+            print("❌ yt-dlp is not installed!")
+            sys.exit(1)
+    
+    daemon = DownloadDaemon(downloader, args.workers)
+    port = args.port or configured_port()
+    try:
+        server = DaemonServer(('127.0.0.1', port), daemon)
+    except OSError as e:
+        print(f"❌ Could not listen on port {port}: {e}")
+        sys.exit(1)
+    print(f"🛰️  Downloader daemon on http://127.0.0.1:{port} "
+          f"({daemon.workers} workers, {downloader.backend.name} backend)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n👋 Daemon stopped")
+    finally:
+        server.server_close()
+        if daemon.postprocessor:
+            daemon.postprocessor.close()
+
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
@@ -7,24 +7,2526 @@ Main downloader script using yt-dlp
 import os
 import sys
 import json
+import errno
 import argparse
 from pathlib import Path
 import subprocess
+import http.client
+import urllib.request
+import threading
+import asyncio
+import queue
+import re
+import sqlite3
+import hashlib
+import heapq
+import random
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, urlencode, parse_qsl, urlunparse
+
+QUALITY_HEIGHTS = {
+    '2160p': 2160,
+    '1440p': 1440,
+    '1080p': 1080,
+    '720p': 720,
+    '480p': 480,
+    '360p': 360,
+}
+
+YOUTUBE_ID_RE = re.compile(
+    r'(?:youtube\.com/(?:watch\?(?:.*&)?v=|shorts/|embed/|live/|v/)|youtu\.be/)([A-Za-z0-9_-]{11})'
+)
+
+
+YOUTUBE_LIST_RE = re.compile(r'[?&]list=([A-Za-z0-9_-]+)')
+
+# Channel pages, optionally one of their tabs
+YOUTUBE_CHANNEL_PATH_RE = re.compile(
+    r'^/(?:@[^/]+|channel/[^/]+|c/[^/]+|user/[^/]+)(?:/(?:videos|shorts|streams|playlists|featured))?/?$'
+)
+
+# Optional scheduling tag after the URL on a line of a URL list, e.g. "URL priority:5"
+PRIORITY_RE = re.compile(r'\spriority[:=](-?\d+)\b')
+
+# Query parameters that only track where a link was shared from
+TRACKING_PARAMS = {
+    'si', 'feature', 'pp', 'fbclid', 'gclid', 'igshid', 'ref', 'ref_src',
+    'utm_source', 'utm_medium', 'utm_campaign', 'utm_term', 'utm_content',
+}
+
+
+def video_id_from_url(url):
+    """Extract the YouTube video ID from url, or None if it has none"""
+    match = YOUTUBE_ID_RE.search(url)
+    return match.group(1) if match else None
+
+
+def canonicalize_url(line):
+    """Return (key, url) for a line of a URL list, or None if it holds no URL
+    
+    Every spelling of a YouTube video (youtu.be, m./music. hosts, shorts,
+    embed, extra t=/si= parameters) maps to the video ID as key and a plain
+    watch URL. Other URLs lose their fragment and tracking parameters and
+    use the cleaned URL as key.
+    """
+    url = line.strip()
+    if not url.startswith('http'):
+        return None
+    url = url.split(None, 1)[0]
+    
+    video_id = video_id_from_url(url)
+    if video_id:
+        return video_id, f'https://www.youtube.com/watch?v={video_id}'
+    
+    parts = urlparse(url)
+    host = (parts.hostname or '').lower()
+    if host_key(url) == 'youtube.com':
+        match = YOUTUBE_LIST_RE.search(url)
+        if match and parts.path in ('/playlist', '/watch'):
+            return f'list:{match.group(1)}', f'https://www.youtube.com/playlist?list={match.group(1)}'
+        host = 'www.youtube.com'
+    
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+             if k not in TRACKING_PARAMS]
+    netloc = host if not parts.port else f'{host}:{parts.port}'
+    url = urlunparse((parts.scheme.lower(), netloc, parts.path or '/', parts.params, urlencode(query), ''))
+    return url, url
+
+
+class UrlDeduplicator:
+    """Filters URL list lines down to unique canonical URLs
+    
+    Keys are kept in a set, so each line costs one regex match and one
+    hash lookup no matter how long the list is. priority:N tags found on
+    the lines are kept in priorities, by canonical URL.
+    """
+    def __init__(self):
+        self.seen = set()
+        self.duplicates = 0
+        self.priorities = {}
+    
+    def filter(self, lines):
+        """Yield the canonical URL of each line not seen before"""
+        seen = self.seen
+        for line in lines:
+            canonical = canonicalize_url(line)
+            if canonical is None:
+                continue
+            key, url = canonical
+            if 'priority' in line:
+                match = PRIORITY_RE.search(line)
+                if match:
+                    priority = int(match.group(1))
+                    self.priorities[url] = max(priority, self.priorities.get(url, priority))
+            if key in seen:
+                self.duplicates += 1
+                continue
+            seen.add(key)
+            yield url
+
+
+def is_collection_url(url):
+    """True for YouTube playlist and channel URLs, which expand into many videos"""
+    if host_key(url) != 'youtube.com' or video_id_from_url(url):
+        return False
+    path = urlparse(url).path
+    return path == '/playlist' or bool(YOUTUBE_CHANNEL_PATH_RE.match(path))
+
+
+def is_newest_first(url):
+    """True for collections YouTube lists newest first: channel video tabs and uploads playlists"""
+    if not is_collection_url(url):
+        return False
+    match = YOUTUBE_LIST_RE.search(url)
+    if match:
+        # UU... is the automatic playlist of a channel's uploads
+        return match.group(1).startswith('UU')
+    return not urlparse(url).path.rstrip('/').endswith('/playlists')
+
+
+def host_key(url):
+    """Return the host a URL is served from, folding mirrors of the same site"""
+    host = (urlparse(url).hostname or '').lower()
+    for prefix in ('www.', 'm.', 'music.'):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+    if host == 'youtu.be':
+        host = 'youtube.com'
+    return host
+
+
+def format_size(num_bytes):
+    """Human readable size in MB or GB"""
+    size_mb = num_bytes / (1024 * 1024)
+    if size_mb >= 1024:
+        return f"{size_mb / 1024:.2f} GB"
+    return f"{size_mb:.2f} MB"
+
+
+def format_duration(seconds):
+    seconds = int(seconds or 0)
+    if seconds >= 3600:
+        return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+    return f"{seconds // 60}:{seconds % 60:02d}"
+
+
+def format_filesize(fmt, duration=None):
+    """Exact or approximate byte size of a yt-dlp format, or None"""
+    size = fmt.get('filesize') or fmt.get('filesize_approx')
+    if not size and fmt.get('tbr') and duration:
+        size = fmt['tbr'] * 1000 / 8 * duration
+    return int(size) if size else None
+
+
+def select_formats(info, quality, audio_only=False):
+    """Mirror get_format_string's selection on an info dict
+    
+    yt-dlp lists formats from worst to best, so the best match for each
+    alternative of the format string is the last one that qualifies.
+    """
+    formats = [fmt for fmt in info.get('formats') or [] if fmt.get('format_id')]
+    if not formats:
+        return [info] if info.get('url') else []
+    
+    def best(predicate):
+        for fmt in reversed(formats):
+            if predicate(fmt):
+                return fmt
+        return None
+    
+    def has_video(fmt):
+        return fmt.get('vcodec') not in (None, 'none')
+    
+    def has_audio(fmt):
+        return fmt.get('acodec') not in (None, 'none')
+    
+    if audio_only:
+        # bestaudio/best
+        chosen = best(lambda f: has_audio(f) and not has_video(f)) or best(lambda f: True)
+        return [chosen]
+    
+    # bestvideo[height<=H]+bestaudio/best[height<=H]/best
+    height = QUALITY_HEIGHTS.get(quality, QUALITY_HEIGHTS['1080p'])
+    fits = lambda f: (f.get('height') or 0) <= height
+    video = best(lambda f: has_video(f) and not has_audio(f) and fits(f))
+    audio = best(lambda f: has_audio(f) and not has_video(f))
+    if video and audio:
+        return [video, audio]
+    combined = best(lambda f: has_video(f) and has_audio(f) and fits(f))
+    return [combined or best(lambda f: True)]
+
+
+def estimate_download_size(info, quality, audio_only=False):
+    """Expected bytes for info at quality, or None if yt-dlp reports no sizes"""
+    sizes = [format_filesize(fmt, info.get('duration')) for fmt in select_formats(info, quality, audio_only)]
+    if not sizes or None in sizes:
+        return None
+    return sum(sizes)
+
+
+class PreflightItem:
+    """Metadata check result for one URL of a bulk run
+    
+    error is why the URL will not be downloaded: the video is unavailable
+    (info is None) or does not fit on disk.
+    """
+    def __init__(self, url, info=None, size=None, error=None):
+        self.url = url
+        self.info = info
+        self.size = size
+        self.error = error
+    
+    @property
+    def rejected(self):
+        return self.error is not None
+
+
+SCHEDULE_POLICIES = ('fifo', 'shortest', 'largest', 'priority', 'mixed')
+
+
+class BulkScheduler:
+    """Orders the URLs of a bulk run by a scheduling policy
+    
+    fifo keeps list order and never looks ahead. The other policies read
+    window URLs at a time, resolve their metadata concurrently (through
+    the metadata cache, so the downloads do not extract them again) and
+    queue each window sorted: shortest and largest by estimated size,
+    mixed alternating large and small videos so the parallel slots finish
+    together, priority by the priority:N tags of the list alone. Tags
+    also rank first in the size policies; untagged URLs have priority 0.
+    """
+    def __init__(self, downloader, policy='fifo', window=100, audio_only=False, priorities=None):
+        if policy not in SCHEDULE_POLICIES:
+            raise ValueError(f"Unknown scheduling policy: {policy}")
+        self.downloader = downloader
+        self.policy = policy
+        self.window = max(1, int(window))
+        self.audio_only = audio_only
+        self.priorities = priorities if priorities is not None else {}
+    
+    def order(self, urls):
+        """Yield urls in scheduling order"""
+        if self.policy == 'fifo':
+            yield from urls
+            return
+        batch = []
+        for url in urls:
+            batch.append(url)
+            if len(batch) >= self.window:
+                yield from self.sort(batch)
+                batch = []
+        if batch:
+            yield from self.sort(batch)
+    
+    def cost(self, url):
+        """Estimated bytes of url at the run's quality, or None when unknown"""
+        downloader = self.downloader
+        try:
+            info = downloader.extract_info(url)
+        except Exception:
+            # Unavailable videos fail quickly in the download itself
+            return None
+        size = estimate_download_size(info, downloader.quality, self.audio_only)
+        if size is None and info.get('duration'):
+            # No sizes reported: rank by duration at a nominal 1 MB per second
+            size = info['duration'] * 1000 * 1000
+        return size
+    
+    def sort(self, batch):
+        """Return one window of URLs in scheduling order"""
+        def rank(url):
+            return -self.priorities.get(url, 0)
+        
+        if self.policy == 'priority':
+            return sorted(batch, key=rank)
+        
+        workers = max(1, self.downloader.preflight_workers)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            costs = dict(zip(batch, pool.map(self.cost, batch)))
+        known = [url for url in batch if costs[url] is not None]
+        unknown = [url for url in batch if costs[url] is None]
+        known.sort(key=costs.get, reverse=self.policy != 'shortest')
+        if self.policy == 'mixed':
+            # Largest, smallest, second largest, second smallest, ...
+            mixed = []
+            while known:
+                mixed.append(known.pop(0))
+                if known:
+                    mixed.append(known.pop())
+            known = mixed
+        # Stable sort: tags rank first, the size order holds within a tag
+        return sorted(known + unknown, key=rank)
+
+
+def iter_url_lines(file_path):
+    """Yield the lines of a URL file one at a time; '-' reads stdin"""
+    if str(file_path) == '-':
+        yield from sys.stdin
+        return
+    with open(file_path, 'r', encoding='utf-8') as f:
+        yield from f
+
+
+def count_url_lines(file_path):
+    """Count lines that look like URLs without parsing them"""
+    with open(file_path, 'rb') as f:
+        return sum(1 for line in f if line.lstrip().startswith(b'http'))
+
+
+class BulkSummary:
+    """Thread-safe tally of a bulk download run
+    
+    URLs are streamed in while downloads run, so total only becomes final
+    once ingestion is done; until then progress is shown against a
+    background estimate when one is available. reasons holds the reason
+    code of each failed URL, see classify_failure. on_record(url, ok,
+    reason), when set, is called for every final outcome.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.total = 0
+        self.estimated_total = None
+        self.ingest_done = False
+        self.success_count = 0
+        self.failed_urls = []
+        self.reasons = {}
+        self.retried = 0
+        self.on_record = None
+    
+    def added(self):
+        with self.lock:
+            self.total += 1
+    
+    def record(self, url, ok, reason=None):
+        with self.lock:
+            if ok:
+                self.success_count += 1
+            else:
+                self.failed_urls.append(url)
+                if reason:
+                    self.reasons[url] = reason
+            done = self.success_count + len(self.failed_urls)
+        if self.on_record:
+            self.on_record(url, ok, reason)
+        return done
+    
+    def progress(self, done):
+        """Progress label such as '12/300', '12/~5000' or '12/?'"""
+        if self.ingest_done:
+            return f"{done}/{self.total}"
+        if self.estimated_total and self.total <= self.estimated_total:
+            return f"{done}/~{self.estimated_total}"
+        return f"{done}/?"
+    
+    def count_in_background(self, file_path):
+        """Estimate the total from file_path on a separate thread"""
+        if str(file_path) == '-':
+            return
+        
+        def count():
+            try:
+                self.estimated_total = count_url_lines(file_path)
+            except OSError:
+                pass
+        
+        threading.Thread(target=count, daemon=True).start()
+    
+    def describe_failed(self, url):
+        """url followed by its reason code, e.g. 'URL (private)'"""
+        reason = self.reasons.get(url)
+        return f"{url} ({reason})" if reason else url
+    
+    def save_failed(self, failed_file):
+        """Write failed URLs atomically so a crash never leaves a half-written file
+        
+        Each line is a URL followed by its reason code as a tag ("URL
+        reason:geo_blocked"), so the file still works as a URL list.
+        """
+        failed_file = Path(failed_file)
+        tmp_file = failed_file.with_name(failed_file.name + '.tmp')
+        with self.lock:
+            content = '\n'.join(f"{url} reason:{self.reasons[url]}" if url in self.reasons else url
+                                for url in self.failed_urls)
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(tmp_file, failed_file)
+
+
+class MetadataCache:
+    """On-disk cache of yt-dlp info dicts keyed by video ID
+    
+    Each entry is stored as <id>.info.json so yt-dlp can load it directly
+    with --load-info-json. A small SQLite index tracks fetch and access
+    times: entries older than ttl seconds are treated as misses, and once
+    the cache grows past max_bytes the least recently used entries are
+    evicted. hits and misses count lookups that decide whether metadata
+    has to be fetched; a download's later lookups of the same entry pass
+    count=False.
+    """
+    def __init__(self, cache_dir, ttl=3600, max_bytes=200 * 1024 * 1024):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(str(self.cache_dir / 'index.sqlite'), check_same_thread=False)
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS entries ('
+            'video_id TEXT PRIMARY KEY, size INTEGER, fetched_at REAL, last_used REAL)'
+        )
+        self.db.commit()
+    
+    def path(self, video_id):
+        return self.cache_dir / f'{video_id}.info.json'
+    
+    def lookup(self, video_id, count=True):
+        """Return the path of a fresh entry for video_id, or None on a miss"""
+        now = time.time()
+        with self.lock:
+            row = self.db.execute(
+                'SELECT fetched_at FROM entries WHERE video_id = ?', (video_id,)
+            ).fetchone()
+            path = self.path(video_id)
+            if row and now - row[0] < self.ttl and path.exists():
+                self.db.execute('UPDATE entries SET last_used = ? WHERE video_id = ?', (now, video_id))
+                self.db.commit()
+                self.hits += count
+                return path
+            self.misses += count
+            return None
+    
+    def get(self, video_id, count=True):
+        """Return the cached info dict for video_id, or None on a miss"""
+        path = self.lookup(video_id, count)
+        if path is None:
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            with self.lock:
+                self.hits -= count
+                self.misses += count
+            return None
+    
+    def put(self, video_id, info):
+        """Store info for video_id"""
+        path = self.path(video_id)
+        tmp_path = path.with_name(path.name + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(info, f)
+        os.replace(tmp_path, path)
+        self.register(video_id)
+    
+    def register(self, video_id):
+        """Index an entry whose file was written directly (e.g. by yt-dlp --write-info-json)"""
+        path = self.path(video_id)
+        if not path.exists():
+            return
+        now = time.time()
+        with self.lock:
+            self.db.execute(
+                'INSERT OR REPLACE INTO entries (video_id, size, fetched_at, last_used) VALUES (?, ?, ?, ?)',
+                (video_id, path.stat().st_size, now, now)
+            )
+            self.db.commit()
+        self.evict()
+    
+    def evict(self):
+        """Drop expired entries, then least recently used ones until under max_bytes"""
+        with self.lock:
+            expired = self.db.execute(
+                'SELECT video_id FROM entries WHERE fetched_at < ?', (time.time() - self.ttl,)
+            ).fetchall()
+            victims = [video_id for video_id, in expired]
+            total = self.db.execute(
+                'SELECT COALESCE(SUM(size), 0) FROM entries WHERE fetched_at >= ?', (time.time() - self.ttl,)
+            ).fetchone()[0]
+            if total > self.max_bytes:
+                for video_id, size in self.db.execute(
+                    'SELECT video_id, size FROM entries WHERE fetched_at >= ? ORDER BY last_used',
+                    (time.time() - self.ttl,)
+                ):
+                    victims.append(video_id)
+                    total -= size
+                    if total <= self.max_bytes:
+                        break
+            for video_id in victims:
+                self.path(video_id).unlink(missing_ok=True)
+            self.db.executemany('DELETE FROM entries WHERE video_id = ?', [(v,) for v in victims])
+            self.db.commit()
+    
+    def purge(self):
+        """Remove every cached entry"""
+        with self.lock:
+            for path in self.cache_dir.glob('*.info.json'):
+                path.unlink(missing_ok=True)
+            self.db.execute('DELETE FROM entries')
+            self.db.commit()
+    
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+
+class JobJournal:
+    """Persistent per-URL state of a bulk run, stored as SQLite in the output dir
+    
+    States move from queued to running to done or failed. Updates are
+    handed to a writer thread that commits them in batches, so workers
+    never wait on the disk.
+    """
+    def __init__(self, path, flush_interval=0.5, batch_size=500):
+        self.path = Path(path)
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.db = sqlite3.connect(str(self.path), check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            'url TEXT PRIMARY KEY, state TEXT, attempts INTEGER DEFAULT 0, '
+            'error TEXT, updated_at REAL)'
+        )
+        self.db.commit()
+        self.pending = queue.Queue()
+        self.writer = threading.Thread(target=self._write_loop, daemon=True)
+        self.writer.start()
+    
+    def completed(self):
+        """URLs that finished successfully in an earlier run"""
+        return {url for url, in self.db.execute("SELECT url FROM jobs WHERE state = 'done'")}
+    
+    def reset(self):
+        """Forget earlier runs"""
+        self.pending.put(('reset',))
+    
+    def record(self, url, state, error=None):
+        """Queue a state change for url"""
+        self.pending.put(('record', url, state, error, time.time()))
+    
+    def close(self):
+        """Flush outstanding updates and stop the writer thread"""
+        self.pending.put(None)
+        self.writer.join()
+        self.db.close()
+    
+    def _write_loop(self):
+        batch = []
+        running = True
+        while running:
+            try:
+                item = self.pending.get(timeout=self.flush_interval)
+                if item is None:
+                    running = False
+                elif item[0] == 'reset':
+                    self._flush(batch)
+                    batch = []
+                    self.db.execute('DELETE FROM jobs')
+                    self.db.commit()
+                else:
+                    batch.append(item[1:])
+                if len(batch) < self.batch_size and running:
+                    continue
+            except queue.Empty:
+                pass
+            self._flush(batch)
+            batch = []
+    
+    def _flush(self, batch):
+        if not batch:
+            return
+        self.db.executemany(
+            'INSERT INTO jobs (url, state, attempts, error, updated_at) '
+            "VALUES (?1, ?2, ?2 = 'running', ?3, ?4) "
+            'ON CONFLICT(url) DO UPDATE SET state = ?2, error = ?3, updated_at = ?4, '
+            "attempts = attempts + (?2 = 'running')",
+            batch
+        )
+        self.db.commit()
+
+
+RATE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+
+class DownloadArchive:
+    """Index of finished downloads: video ID, format, title, path, size and SHA-256
+    
+    Stored as SQLite in the output dir. The (video ID, format) keys are
+    also kept in memory, so checking a URL against the archive is a set
+    lookup that needs neither the disk nor the network. find() looks up
+    files by ID or title, so large libraries are never scanned.
+    """
+    def __init__(self, path):
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(str(self.path), check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS archive ('
+            'video_id TEXT, format TEXT, path TEXT, size INTEGER, sha256 TEXT, completed_at REAL, title TEXT, '
+            'PRIMARY KEY (video_id, format))'
+        )
+        columns = [row[1] for row in self.db.execute('PRAGMA table_info(archive)')]
+        if 'title' not in columns:
+            # Archives written before titles were indexed
+            self.db.execute('ALTER TABLE archive ADD COLUMN title TEXT')
+        self.db.execute('CREATE INDEX IF NOT EXISTS archive_title ON archive (title COLLATE NOCASE)')
+        self.db.commit()
+        self.keys = set(self.db.execute('SELECT video_id, format FROM archive'))
+    
+    def count(self):
+        return len(self.keys)
+    
+    def contains(self, video_id, fmt):
+        return (video_id, fmt) in self.keys
+    
+    def get(self, video_id, fmt):
+        """(path, size, sha256) of an archived download, or None"""
+        with self.lock:
+            return self.db.execute(
+                'SELECT path, size, sha256 FROM archive WHERE video_id = ? AND format = ?', (video_id, fmt)
+            ).fetchone()
+    
+    def add(self, video_id, fmt, path, title=None, digest=None):
+        """Record path as the download of video_id in fmt
+        
+        digest is the file's (size, sha256) when it is known already;
+        otherwise path is hashed here.
+        """
+        path = Path(path).resolve()
+        size, digest = digest or file_digest(path)
+        with self.lock:
+            self.db.execute(
+                'INSERT OR REPLACE INTO archive (video_id, format, path, size, sha256, completed_at, title) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (video_id, fmt, str(path), size, digest, time.time(), title)
+            )
+            self.db.commit()
+            self.keys.add((video_id, fmt))
+    
+    def find(self, query=None):
+        """(video_id, format, title, path) rows for a video ID, a title prefix or words in the title
+        
+        An exact ID or title prefix is answered from the indexes; other
+        queries fall back to a substring match over the archive table,
+        still without touching the files. No query lists everything.
+        """
+        sql = 'SELECT video_id, format, title, path FROM archive'
+        with self.lock:
+            if not query:
+                return self.db.execute(sql + ' ORDER BY title COLLATE NOCASE').fetchall()
+            rows = self.db.execute(
+                sql + " WHERE video_id = ? OR title LIKE ? ESCAPE '\\' ORDER BY title COLLATE NOCASE",
+                (query, re.sub(r'([\\%_])', r'\\\1', query) + '%')
+            ).fetchall()
+            if rows:
+                return rows
+            return self.db.execute(
+                sql + " WHERE instr(lower(title), lower(?)) > 0 ORDER BY title COLLATE NOCASE", (query,)
+            ).fetchall()
+    
+    def remove(self, video_id, fmt):
+        with self.lock:
+            self.db.execute('DELETE FROM archive WHERE video_id = ? AND format = ?', (video_id, fmt))
+            self.db.commit()
+            self.keys.discard((video_id, fmt))
+    
+    def verify(self):
+        """Re-check every archived file and drop the broken ones
+        
+        Returns (video_id, format, path, problem) for each file that is
+        missing, has a different size (truncated) or a different hash
+        (corrupt).
+        """
+        with self.lock:
+            rows = self.db.execute('SELECT video_id, format, path, size, sha256 FROM archive').fetchall()
+        broken = []
+        for video_id, fmt, path, size, digest in rows:
+            try:
+                if os.path.getsize(path) != size:
+                    problem = 'truncated'
+                elif file_digest(path)[1] != digest:
+                    problem = 'corrupt'
+                else:
+                    continue
+            except OSError:
+                problem = 'missing'
+            self.remove(video_id, fmt)
+            broken.append((video_id, fmt, path, problem))
+        return broken
+    
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+class SourceSync:
+    """One listing of a playlist or channel, filtered against its watermark
+    
+    ids are the source's known videos in listing order, entries how many
+    the last listing had. Listings of newest-first sources stop at the
+    first known video; other playlists are listed in full but their known
+    videos are dropped. avoided counts the known videos skipped that way:
+    each dropped one, or on a stop the rest of the last listing from the
+    stop point. pending videos from earlier runs are yielded after the
+    listing.
+    """
+    def __init__(self, source, ids=(), pending=(), entries=0, latest_upload=None):
+        self.source = source
+        self.ids = list(ids)
+        self.known = set(self.ids)
+        self.pending = list(pending)
+        self.entries = entries
+        self.latest_upload = latest_upload
+        self.newest_first = is_newest_first(source)
+        self.new = []
+        self.listing = []
+        self.avoided = 0
+        self.stop_index = None
+        self.complete = False
+    
+    @property
+    def stopped(self):
+        return self.stop_index is not None
+    
+    @property
+    def listed_entries(self):
+        """Entries in the current listing, counting the known rest after a stop"""
+        if self.stopped:
+            return len(self.listing) + max(0, self.entries - self.stop_index)
+        return len(self.listing)
+    
+    def filter(self, entries):
+        """Yield the entry URLs to download; entries without a video ID (channel tabs) pass through"""
+        for url in entries:
+            video_id = video_id_from_url(url)
+            if video_id in self.known:
+                if self.newest_first:
+                    # Everything from here on is older and known already
+                    self.stop_index = self.ids.index(video_id)
+                    self.avoided += max(0, self.entries - self.stop_index)
+                    break
+                self.listing.append(video_id)
+                self.avoided += 1
+                continue
+            if video_id:
+                self.listing.append(video_id)
+                self.new.append(video_id)
+            yield url
+        self.complete = True
+        listed = set(self.new)
+        for video_id in self.pending:
+            if video_id not in listed:
+                if self.stopped and self.avoided:
+                    # Counted in the rest of the listing, but looked up again
+                    self.avoided -= 1
+                yield f'https://www.youtube.com/watch?v={video_id}'
+
+
+class SyncWatermarks:
+    """Per-source watermarks for incremental syncs of playlists and channels
+    
+    Stored as SQLite in the output dir. Every source URL keeps its known
+    video IDs (the newest max_ids for newest-first sources, which only
+    need them to stop the listing; all of them for other playlists, which
+    are matched in full), its entry count, the latest upload
+    date seen and the videos still to be retried. open() starts the
+    SourceSync of one listing, record() takes the outcome of each video
+    (it is a BulkSummary listener) and save() folds the run back in: only
+    videos that finished for good become known, so transient failures and
+    interrupted downloads are tried again by the next sync.
+    """
+    def __init__(self, path, max_ids=1000):
+        self.path = Path(path)
+        self.max_ids = max_ids
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(str(self.path), check_same_thread=False)
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS sources ('
+            'source TEXT PRIMARY KEY, ids TEXT, pending TEXT, entries INTEGER, latest_upload TEXT, synced_at REAL)'
+        )
+        self.db.commit()
+        self.syncs = []
+        self.settled = set()
+    
+    def open(self, source):
+        with self.lock:
+            row = self.db.execute(
+                'SELECT ids, pending, entries, latest_upload FROM sources WHERE source = ?', (source,)
+            ).fetchone()
+            sync = SourceSync(source, json.loads(row[0]), json.loads(row[1]), row[2], row[3]) if row else SourceSync(source)
+            self.syncs.append(sync)
+        return sync
+    
+    def record(self, url, ok, reason=None):
+        """Note that url finished for good: downloaded, or failed permanently"""
+        video_id = video_id_from_url(url)
+        if video_id and (ok or (reason != 'cancelled' and FAILURE_KINDS.get(reason, PERMANENT) == PERMANENT)):
+            with self.lock:
+                self.settled.add(video_id)
+    
+    @property
+    def new(self):
+        return sum(len(sync.new) for sync in self.syncs)
+    
+    @property
+    def avoided(self):
+        return sum(sync.avoided for sync in self.syncs)
+    
+    def save(self, upload_date=None):
+        """Store the watermarks after the run; upload_date(video_id) returns a finished video's upload date"""
+        with self.lock:
+            for sync in self.syncs:
+                if not (sync.ids or sync.new or sync.pending):
+                    # Channel pages that only list their tabs
+                    continue
+                candidates = list(dict.fromkeys(sync.new + sync.pending))
+                settled = [video_id for video_id in candidates if video_id in self.settled]
+                ids = sync.ids
+                entries = sync.entries
+                if sync.complete:
+                    pending = [video_id for video_id in candidates if video_id not in self.settled]
+                    # Known videos that left the playlist are dropped with the listing
+                    ids = [video_id for video_id in sync.listing if video_id in sync.known or video_id in self.settled]
+                    if sync.stopped:
+                        ids += sync.ids[sync.stop_index:]
+                    ids = list(dict.fromkeys(ids + settled))
+                    if sync.newest_first:
+                        ids = ids[:self.max_ids]
+                    entries = sync.listed_entries
+                else:
+                    # Older new videos may not have been listed yet; knowing
+                    # the newest ones would stop the next listing before them
+                    pending = candidates
+                latest = sync.latest_upload
+                for video_id in settled if upload_date else ():
+                    date = upload_date(video_id)
+                    if date and (not latest or date > latest):
+                        latest = date
+                self.db.execute(
+                    'INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?, ?, ?)',
+                    (sync.source, json.dumps(ids), json.dumps(pending), entries, latest, time.time())
+                )
+            self.db.commit()
+    
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+# Marks the staging folder as created by this tool; cleanup needs it
+STAGING_MARKER = '.youtube-video-downloader-staging'
+# Per-output subfolders of the staging folder
+STAGING_KEY_RE = re.compile(r'^[0-9a-f]{12}$')
+
+
+class StagingArea:
+    """Local scratch folder where downloads and post-processing happen
+    
+    Everything lives in a yt-staging folder of root that this tool creates
+    and marks with a STAGING_MARKER file; each output folder gets its own
+    subfolder there. Only finished files leave it, with move_file(). Files
+    untouched for max_age seconds are leftovers of crashed or abandoned
+    runs and are removed when the area is opened. Cleanup never looks
+    outside the marked folder, so root may be shared, e.g. /dev/shm or /tmp.
+    """
+    def __init__(self, root, output_dir, max_age=24 * 3600):
+        self.root = Path(root).expanduser() / 'yt-staging'
+        self.output_dir = Path(output_dir)
+        key = hashlib.sha1(str(self.output_dir.resolve()).encode('utf-8')).hexdigest()[:12]
+        self.path = self.root / key
+        self.owned = self._claim()
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.removed = self.cleanup(max_age) if self.owned else 0
+    
+    def _claim(self):
+        """Create the yt-staging folder and its marker; False when a folder of that name is not ours"""
+        marker = self.root / STAGING_MARKER
+        if marker.exists():
+            return True
+        try:
+            self.root.mkdir(parents=True)
+        except FileExistsError:
+            # Someone else's folder: use it, but never delete anything in it
+            return False
+        marker.write_text('Scratch folder of YouTube Video Downloader, see staging_dir in config.json\n')
+        return True
+    
+    def cleanup(self, max_age):
+        """Delete staged files and folders older than max_age seconds; returns the number of files
+        
+        Only the per-output subfolders this tool creates are looked at.
+        """
+        cutoff = time.time() - max_age
+        removed = 0
+        for area in self.root.iterdir():
+            if not STAGING_KEY_RE.match(area.name) or area.is_symlink() or not area.is_dir():
+                continue
+            folders = list(os.walk(area, topdown=False))
+            # Deleting files touches their folder, so folder ages are taken first
+            stale = set()
+            for dirpath, dirnames, filenames in folders:
+                try:
+                    if os.stat(dirpath).st_mtime < cutoff:
+                        stale.add(dirpath)
+                except OSError:
+                    pass
+            for dirpath, dirnames, filenames in folders:
+                folder = Path(dirpath)
+                for name in filenames:
+                    try:
+                        if (folder / name).lstat().st_mtime < cutoff:
+                            (folder / name).unlink()
+                            removed += 1
+                    except OSError:
+                        pass
+                if dirpath in stale and folder != self.path:
+                    try:
+                        folder.rmdir()
+                    except OSError:
+                        # Still holds recent files
+                        pass
+        return removed
+
+
+def move_file(path, target):
+    """Move path to target without target ever being partly written
+    
+    A rename when both are on the same filesystem; otherwise one streamed
+    copy to a hidden temporary name next to target that is then renamed.
+    Returns target.
+    """
+    target = Path(target)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.replace(path, target)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        tmp_path = target.with_name(f".{target.name}.staging")
+        try:
+            shutil.copyfile(path, tmp_path)
+            os.replace(tmp_path, target)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+        os.unlink(path)
+    return target
+
+
+def shard_dir(video_id):
+    """Two-level folder for video_id in the sharded layout, e.g. Path('3f/a9')
+    
+    Taken from a hash of the ID, so videos spread evenly over 65536
+    folders and the same video always lands in the same one.
+    """
+    digest = hashlib.sha1(video_id.encode('utf-8')).hexdigest()
+    return Path(digest[:2]) / digest[2:4]
+
+
+def file_digest(path, chunk_size=1024 * 1024):
+    """(size, SHA-256 hex digest) of the file at path"""
+    sha = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+            size += len(chunk)
+    return size, sha.hexdigest()
+
+
+def parse_rate(text):
+    """Parse a rate such as '500K', '5M' or '2.5MB' into bytes/s; None means unlimited"""
+    if text in (None, '', 0, '0'):
+        return None
+    if isinstance(text, (int, float)):
+        return float(text)
+    match = re.fullmatch(r'\s*([\d.]+)\s*([KMG]?)(?:i?B)?(?:/s)?\s*', str(text), re.IGNORECASE)
+    if not match:
+        raise ValueError(f"Invalid rate: {text}")
+    return float(match.group(1)) * RATE_UNITS[match.group(2).upper()] or None
+
+
+def _minutes(clock):
+    hours, minutes = clock.split(':')
+    return int(hours) * 60 + int(minutes)
+
+
+class BandwidthGovernor:
+    """Token bucket shared by every download of a YouTubeDownloader
+    
+    In-process downloads draw from the bucket as bytes arrive, so the total
+    stays at the budget however many are running and a lone download may
+    use all of it. yt-dlp processes cannot be throttled from outside; each
+    reserves a fixed --limit-rate when it starts (see reserve()), and the
+    reserved caps never add up to more than the budget. The limit can be
+    changed at any time: in-process downloads follow at once, processes
+    from their next start on. Schedule entries of the form
+    {"start": "09:00", "end": "18:00", "limit": "2M"} override it during
+    their time window.
+    """
+    def __init__(self, limit=None, schedule=None):
+        self.lock = threading.Lock()
+        self.cond = threading.Condition(self.lock)
+        self.limit = parse_rate(limit)
+        self.schedule = [
+            (_minutes(entry['start']), _minutes(entry['end']), parse_rate(entry.get('limit')))
+            for entry in schedule or []
+        ]
+        self.active = 0
+        # Sum of the --limit-rate caps of running yt-dlp processes
+        self.reserved = 0.0
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+    
+    def set_limit(self, limit):
+        """Change the global budget; in-process downloads follow it immediately"""
+        limit = parse_rate(limit)
+        with self.cond:
+            self.limit = limit
+            self.cond.notify_all()
+    
+    def current_limit(self):
+        """Budget in bytes/s right now, or None if unlimited"""
+        if self.schedule:
+            now = time.localtime()
+            minute = now.tm_hour * 60 + now.tm_min
+            for start, end, limit in self.schedule:
+                inside = start <= minute < end if start <= end else (minute >= start or minute < end)
+                if inside:
+                    return limit
+        return self.limit
+    
+    def start(self):
+        with self.lock:
+            self.active += 1
+    
+    def finish(self):
+        with self.lock:
+            self.active = max(0, self.active - 1)
+    
+    def reserve(self, slots):
+        """Claim the --limit-rate of a yt-dlp process about to start, or None when unlimited
+        
+        Each process gets limit / slots, where slots is how many may run
+        at once, clamped to what running processes left unclaimed. When
+        less than half a share is left, e.g. after the limit was lowered,
+        this waits for running processes to release theirs. Pair every
+        reserve() with a release().
+        """
+        with self.cond:
+            while True:
+                reserved, rate = self._try_reserve(slots)
+                if reserved:
+                    return rate
+                # Also wakes up for a new schedule window
+                self.cond.wait(1)
+    
+    def try_reserve(self, slots):
+        """reserve() without waiting: (True, rate), or (False, None) when no share is free"""
+        with self.cond:
+            return self._try_reserve(slots)
+    
+    def _try_reserve(self, slots):
+        limit = self.current_limit()
+        if limit is None:
+            return True, None
+        share = limit / max(1, slots)
+        free = limit - self.reserved
+        if free < share / 2:
+            return False, None
+        rate = min(share, free)
+        self.reserved += rate
+        return True, rate
+    
+    def release(self, rate):
+        """Give back a cap from reserve() once its process has ended"""
+        if not rate:
+            return
+        with self.cond:
+            self.reserved = max(0.0, self.reserved - rate)
+            self.cond.notify_all()
+    
+    def consume(self, num_bytes):
+        """Take num_bytes from the bucket, sleeping until the budget allows them"""
+        limit = self.current_limit()
+        if limit is None or num_bytes <= 0:
+            return
+        with self.lock:
+            now = time.monotonic()
+            # Allow half a second of burst so short pauses are not wasted
+            self.tokens = min(limit / 2, self.tokens + (now - self.updated) * limit)
+            self.updated = now
+            self.tokens -= num_bytes
+            deficit = -self.tokens
+        if deficit > 0:
+            time.sleep(deficit / limit)
+
+
+class DownloadResult:
+    """Outcome of a single download, truthy when it succeeded
+    
+    postprocess is the PostProcessJob still needed to produce the final
+    file when post-processing was deferred. path is the finished file,
+    when known.
+    """
+    def __init__(self, url, ok, error=None, info=None, postprocess=None, path=None):
+        self.url = url
+        self.ok = ok
+        self.error = error
+        self.info = info
+        self.postprocess = postprocess
+        self.path = path
+    
+    def __bool__(self):
+        return self.ok
+
+
+PERMANENT = 'permanent'
+TRANSIENT = 'transient'
+
+# Reason codes of failed downloads by the yt-dlp message they show up in,
+# most specific first. Permanent failures fail the same way on every
+# attempt, transient ones are worth another try after a pause.
+FAILURE_PATTERNS = [
+    ('cancelled', PERMANENT, r'Stopped by user|Cancelled by user'),
+    ('private', PERMANENT, r'Private video|video is private'),
+    ('removed', PERMANENT, r'removed by the uploader|has been removed|has been terminated|no longer available'),
+    ('geo_blocked', PERMANENT, r'available in your country|available from your location|geo.?restrict'),
+    ('age_restricted', PERMANENT, r'confirm your age|age.restricted|inappropriate for some users'),
+    ('members_only', PERMANENT, r'members.only|Join this channel'),
+    ('copyright', PERMANENT, r'copyright'),
+    ('upcoming', PERMANENT, r'Premieres in|live event will begin|has not started'),
+    ('throttled', TRANSIENT, r'HTTP Error 429|Too Many Requests|rate.limit|not a bot'),
+    ('server_error', TRANSIENT, r'HTTP Error 5\d\d|Internal Server Error|Bad Gateway|Service Unavailable'),
+    ('network', TRANSIENT, r'timed out|Connection (?:reset|refused|aborted)|name resolution|'
+                           r'Network is unreachable|IncompleteRead|Remote end closed|urlopen error'),
+    ('format_unavailable', PERMANENT, r'Requested format is not available'),
+    ('unsupported', PERMANENT, r'Unsupported URL|Incomplete YouTube ID|is not a valid URL'),
+    ('not_found', PERMANENT, r'HTTP Error 40[46]|HTTP Error 410'),
+    ('disk_full', PERMANENT, r'No space left on device|Not enough disk space'),
+    ('postprocessing', PERMANENT, r'Post-processing failed'),
+    ('unavailable', PERMANENT, r'unavailable|not available'),
+]
+FAILURE_RES = [(reason, kind, re.compile(pattern, re.IGNORECASE)) for reason, kind, pattern in FAILURE_PATTERNS]
+FAILURE_KINDS = {reason: kind for reason, kind, pattern in FAILURE_PATTERNS}
+
+
+def classify_failure(error):
+    """Return (reason, kind) for the error of a failed download
+    
+    kind is PERMANENT or TRANSIENT. Errors matching no known message,
+    including a bare non-zero yt-dlp exit status, count as permanent.
+    """
+    for reason, kind, pattern in FAILURE_RES:
+        if error and pattern.search(error):
+            return reason, kind
+    return 'error', PERMANENT
+
+
+def retry_delay(failures, backoff=5, backoff_max=300):
+    """Seconds to wait before retrying after the nth consecutive failure
+    
+    Exponential backoff capped at backoff_max, half of it random so URLs
+    that were throttled together don't all come back at the same moment.
+    """
+    delay = min(backoff_max, backoff * 2 ** (failures - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class RetryQueue:
+    """Transiently failed URLs of a bulk run waiting for another attempt
+    
+    Bulk runs queue every URL once and only then drain this queue, so a
+    few flaky URLs never hold up the rest of the list. started() and
+    done() bracket every attempt: the queue is drained once nothing is
+    waiting and no attempt that could still be deferred is running.
+    """
+    def __init__(self, attempts=3, backoff=5, backoff_max=300):
+        self.attempts = attempts
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.cond = threading.Condition()
+        self.heap = []
+        self.failures = {}
+        self.in_flight = 0
+    
+    def started(self):
+        with self.cond:
+            self.in_flight += 1
+    
+    def done(self):
+        with self.cond:
+            self.in_flight -= 1
+            self.cond.notify_all()
+    
+    def defer(self, url):
+        """Schedule another attempt of url; returns the delay, or None when out of attempts"""
+        with self.cond:
+            failures = self.failures.get(url, 0) + 1
+            self.failures[url] = failures
+            if failures > self.attempts:
+                return None
+            delay = retry_delay(failures, self.backoff, self.backoff_max)
+            heapq.heappush(self.heap, (time.monotonic() + delay, url))
+            self.cond.notify_all()
+            return delay
+    
+    def poll(self):
+        """Return (url, None) for a URL that is due, (None, seconds) to wait, or (None, None) when drained
+        
+        A returned URL counts as started.
+        """
+        with self.cond:
+            if self.heap:
+                wait = self.heap[0][0] - time.monotonic()
+                if wait > 0:
+                    return None, wait
+                self.in_flight += 1
+                return heapq.heappop(self.heap)[1], None
+            if self.in_flight:
+                return None, float('inf')
+            return None, None
+    
+    def drain(self, should_stop=None):
+        """Yield deferred URLs as they come due until the queue is drained"""
+        while not (should_stop and should_stop()):
+            url, wait = self.poll()
+            if url:
+                yield url
+            elif wait is None:
+                return
+            else:
+                with self.cond:
+                    self.cond.wait(min(wait, 1))
+
+
+class ProgressEvent:
+    """Progress of one download, as data instead of yt-dlp's text output
+    
+    phase is one of the PHASE_* constants; the numeric fields are None
+    when yt-dlp does not know them yet.
+    """
+    PHASE_DOWNLOAD = 'download'
+    PHASE_MERGE = 'merge'
+    PHASE_EXTRACT_AUDIO = 'extract_audio'
+    PHASE_POSTPROCESS = 'postprocess'
+    PHASE_FINISHED = 'finished'
+    
+    def __init__(self, url, phase, percent=None, downloaded_bytes=None, total_bytes=None,
+                 speed=None, eta=None, filename=None):
+        self.url = url
+        self.phase = phase
+        self.percent = percent
+        self.downloaded_bytes = downloaded_bytes
+        self.total_bytes = total_bytes
+        self.speed = speed
+        self.eta = eta
+        self.filename = filename
+    
+    def as_dict(self):
+        return dict(vars(self))
+    
+    def __repr__(self):
+        return f"ProgressEvent({self.as_dict()!r})"
+
+
+BYTE_UNITS = {
+    'B': 1, 'KiB': 1024, 'MiB': 1024 ** 2, 'GiB': 1024 ** 3, 'TiB': 1024 ** 4,
+    'KB': 1000, 'MB': 1000 ** 2, 'GB': 1000 ** 3, 'TB': 1000 ** 4,
+}
+
+PROGRESS_LINE_RE = re.compile(
+    r'^\[download\]\s+(?P<percent>[\d.]+)%\s+of\s+~?\s*(?P<total>[\d.]+)(?P<total_unit>[KMGT]?i?B)'
+    r'(?:\s+in\s+[\d:]+)?(?:\s+at\s+(?:(?P<speed>[\d.]+)(?P<speed_unit>[KMGT]?i?B)/s|Unknown\s+B/s))?'
+    r'(?:\s+ETA\s+(?P<eta>[\d:]+))?'
+)
+DESTINATION_RE = re.compile(r'^\[download\] Destination: (?P<filename>.+)$')
+POSTPROCESSOR_RE = re.compile(
+    r'^\[(?P<name>Merger|ExtractAudio|Fixup\w+|VideoConvertor|VideoRemuxer|Embed\w+|Metadata'
+    r'|ThumbnailsConvertor|SplitChapters|ModifyChapters)\]'
+)
+
+POSTPROCESSOR_PHASES = {
+    'Merger': ProgressEvent.PHASE_MERGE,
+    'ExtractAudio': ProgressEvent.PHASE_EXTRACT_AUDIO,
+}
+
+# yt-dlp lines naming the file a download ends up in; the last match wins
+OUTPUT_PATH_RES = [
+    DESTINATION_RE,
+    re.compile(r'^\[download\] (?P<filename>.+) has already been downloaded$'),
+    re.compile(r'^\[Merger\] Merging formats into "(?P<filename>.+)"$'),
+    re.compile(r'^\[ExtractAudio\] Destination: (?P<filename>.+)$'),
+    re.compile(r'^\[ExtractAudio\] Not converting audio (?P<filename>.+?); file is already in target format'),
+]
+
+
+def output_path(line):
+    """The output file named by a yt-dlp line, or None"""
+    for regex in OUTPUT_PATH_RES:
+        match = regex.match(line)
+        if match:
+            return match.group('filename')
+    return None
+
+
+def _parse_eta(text):
+    seconds = 0
+    for part in text.split(':'):
+        seconds = seconds * 60 + int(part)
+    return seconds
+
+
+class ProgressReporter:
+    """Turns yt-dlp output or progress hooks for one URL into ProgressEvents
+    
+    Download progress is throttled to one event per interval seconds;
+    phase changes and completion are always reported.
+    """
+    def __init__(self, url, callback, interval=0.5):
+        self.url = url
+        self.callback = callback
+        self.interval = interval
+        self.phase = None
+        self.filename = None
+        self.last_emit = 0.0
+    
+    def emit(self, event):
+        now = time.monotonic()
+        if (event.phase == self.phase and event.percent != 100
+                and now - self.last_emit < self.interval):
+            return
+        self.phase = event.phase
+        self.last_emit = now
+        self.callback(event)
+    
+    def feed_line(self, line):
+        """Parse one line of yt-dlp --newline output"""
+        if line.startswith('[download]'):
+            match = PROGRESS_LINE_RE.match(line)
+            if match:
+                total = float(match['total']) * BYTE_UNITS.get(match['total_unit'], 1)
+                percent = float(match['percent'])
+                speed = None
+                if match['speed']:
+                    speed = float(match['speed']) * BYTE_UNITS.get(match['speed_unit'], 1)
+                self.emit(ProgressEvent(
+                    self.url, ProgressEvent.PHASE_DOWNLOAD,
+                    percent=percent,
+                    downloaded_bytes=int(total * percent / 100),
+                    total_bytes=int(total),
+                    speed=speed,
+                    eta=_parse_eta(match['eta']) if match['eta'] else None,
+                    filename=self.filename,
+                ))
+                return
+            match = DESTINATION_RE.match(line)
+            if match:
+                self.filename = match['filename']
+            return
+        match = POSTPROCESSOR_RE.match(line)
+        if match:
+            phase = POSTPROCESSOR_PHASES.get(match['name'], ProgressEvent.PHASE_POSTPROCESS)
+            self.emit(ProgressEvent(self.url, phase, filename=self.filename))
+    
+    def feed_hook(self, status):
+        """Translate a yt_dlp progress hook dict"""
+        if status.get('status') not in ('downloading', 'finished'):
+            return
+        downloaded = status.get('downloaded_bytes')
+        total = status.get('total_bytes') or status.get('total_bytes_estimate')
+        percent = 100.0 if status['status'] == 'finished' else None
+        if percent is None and downloaded is not None and total:
+            percent = downloaded * 100 / total
+        self.filename = status.get('filename', self.filename)
+        self.emit(ProgressEvent(
+            self.url, ProgressEvent.PHASE_DOWNLOAD,
+            percent=percent,
+            downloaded_bytes=downloaded,
+            total_bytes=total,
+            speed=status.get('speed'),
+            eta=status.get('eta'),
+            filename=self.filename,
+        ))
+    
+    def feed_postprocessor_hook(self, status):
+        """Translate a yt_dlp postprocessor hook dict"""
+        if status.get('status') == 'started':
+            phase = POSTPROCESSOR_PHASES.get(status.get('postprocessor'), ProgressEvent.PHASE_POSTPROCESS)
+            self.emit(ProgressEvent(self.url, phase, filename=self.filename))
+    
+    def finish(self):
+        self.emit(ProgressEvent(self.url, ProgressEvent.PHASE_FINISHED, percent=100.0, filename=self.filename))
+
+
+RETRY_RE = re.compile(r'Retrying(?: fragment \d+)? \(\d+/')
+
+
+class Metrics:
+    """Counters, gauges and phase-time histograms of a running downloader
+    
+    Every method is thread-safe. prometheus() renders the text exposition
+    format served by MetricsServer and snapshot() the same values as a dict
+    for the JSON snapshot file.
+    """
+    BUCKETS = (0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+    PHASES = ('extract', 'download', 'postprocess')
+    HELP = {
+        'downloads_started_total': ('counter', 'Downloads started'),
+        'downloads_succeeded_total': ('counter', 'Downloads that finished successfully'),
+        'downloads_failed_total': ('counter', 'Downloads that failed or were stopped'),
+        'retries_total': ('counter', 'Retries reported by yt-dlp'),
+        'bytes_downloaded_total': ('counter', 'Media bytes received'),
+        'queue_depth': ('gauge', 'URLs waiting in the bulk queue'),
+        'active_downloads': ('gauge', 'Downloads currently running'),
+        'postprocess_queue_depth': ('gauge', 'Downloaded videos waiting for ffmpeg'),
+        'audio_fast_path_total': ('counter', 'Audio files remuxed without re-encoding'),
+        'audio_transcoded_total': ('counter', 'Audio files converted to another codec'),
+        'audio_fast_path_cpu_seconds_total': ('counter', 'ffmpeg CPU time spent on remuxed audio'),
+        'audio_fast_path_media_seconds_total': ('counter', 'Duration of the remuxed audio'),
+        'audio_transcode_cpu_seconds_total': ('counter', 'ffmpeg CPU time spent converting audio'),
+        'audio_transcode_media_seconds_total': ('counter', 'Duration of the converted audio'),
+        'bytes_per_second': ('gauge', 'Download rate since the previous sample'),
+    }
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {name: 0 for name in self.HELP}
+        self.histograms = {phase: [0] * (len(self.BUCKETS) + 1) for phase in self.PHASES}
+        self.sums = {phase: 0.0 for phase in self.PHASES}
+        self.started_at = time.time()
+        self.last_sample = (time.monotonic(), 0)
+    
+    def inc(self, name, amount=1):
+        with self.lock:
+            self.values[name] += amount
+    
+    def set(self, name, value):
+        with self.lock:
+            self.values[name] = value
+    
+    def observe(self, phase, seconds):
+        """Add one duration in seconds to the histogram of phase"""
+        index = next((i for i, bound in enumerate(self.BUCKETS) if seconds <= bound), len(self.BUCKETS))
+        with self.lock:
+            self.histograms[phase][index] += 1
+            self.sums[phase] += seconds
+    
+    def record_audio(self, fast_path, cpu_seconds, duration):
+        """Count one audio post-processing job and what it cost"""
+        kind = 'fast_path' if fast_path else 'transcode'
+        with self.lock:
+            self.values['audio_fast_path_total' if fast_path else 'audio_transcoded_total'] += 1
+            if cpu_seconds is not None and duration:
+                self.values[f'audio_{kind}_cpu_seconds_total'] += cpu_seconds
+                self.values[f'audio_{kind}_media_seconds_total'] += duration
+    
+    def audio_cpu_saved(self):
+        """Estimated CPU seconds the audio fast path saved
+        
+        Uses the CPU per second of audio measured on this run's transcodes,
+        or DEFAULT_TRANSCODE_CPU_RATIO when nothing was transcoded.
+        """
+        with self.lock:
+            values = dict(self.values)
+        ratio = DEFAULT_TRANSCODE_CPU_RATIO
+        if values['audio_transcode_media_seconds_total']:
+            ratio = values['audio_transcode_cpu_seconds_total'] / values['audio_transcode_media_seconds_total']
+        saved = values['audio_fast_path_media_seconds_total'] * ratio - values['audio_fast_path_cpu_seconds_total']
+        return max(0.0, saved)
+    
+    def sample(self):
+        """Update bytes_per_second from the bytes received since the last sample"""
+        now = time.monotonic()
+        with self.lock:
+            last_time, last_bytes = self.last_sample
+            received = self.values['bytes_downloaded_total']
+            if now > last_time:
+                self.values['bytes_per_second'] = (received - last_bytes) / (now - last_time)
+            self.last_sample = (now, received)
+    
+    def snapshot(self):
+        with self.lock:
+            phases = {}
+            for phase in self.PHASES:
+                count = sum(self.histograms[phase])
+                phases[phase] = {
+                    'count': count,
+                    'sum_seconds': round(self.sums[phase], 3),
+                    'mean_seconds': round(self.sums[phase] / count, 3) if count else None,
+                    'buckets': dict(zip([*map(str, self.BUCKETS), '+Inf'], self.histograms[phase])),
+                }
+            return {
+                'timestamp': time.time(),
+                'uptime_seconds': round(time.time() - self.started_at, 3),
+                **self.values,
+                'phase_seconds': phases,
+            }
+    
+    def prometheus(self):
+        lines = []
+        with self.lock:
+            for name, (kind, help_text) in self.HELP.items():
+                lines.append(f"# HELP ytdl_{name} {help_text}")
+                lines.append(f"# TYPE ytdl_{name} {kind}")
+                lines.append(f"ytdl_{name} {self.values[name]}")
+            lines.append("# HELP ytdl_phase_seconds Time spent per download phase")
+            lines.append("# TYPE ytdl_phase_seconds histogram")
+            for phase in self.PHASES:
+                cumulative = 0
+                for bound, count in zip([*map(str, self.BUCKETS), '+Inf'], self.histograms[phase]):
+                    cumulative += count
+                    lines.append(f'ytdl_phase_seconds_bucket{{phase="{phase}",le="{bound}"}} {cumulative}')
+                lines.append(f'ytdl_phase_seconds_sum{{phase="{phase}"}} {self.sums[phase]}')
+                lines.append(f'ytdl_phase_seconds_count{{phase="{phase}"}} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+
+class DownloadTimer:
+    """Feeds the phases and bytes of one download into Metrics
+    
+    Used as the ProgressReporter callback: extraction lasts until the first
+    download event, downloading until the first post-processing event.
+    """
+    def __init__(self, metrics, on_progress=None):
+        self.metrics = metrics
+        self.on_progress = on_progress
+        self.started = time.monotonic()
+        self.marks = {}
+        self.filename = None
+        self.received = 0
+    
+    def __call__(self, event):
+        phase = 'download' if event.phase == ProgressEvent.PHASE_DOWNLOAD else 'postprocess'
+        if event.phase != ProgressEvent.PHASE_FINISHED:
+            self.marks.setdefault(phase, time.monotonic())
+        if event.phase == ProgressEvent.PHASE_DOWNLOAD and event.downloaded_bytes is not None:
+            if event.filename != self.filename:
+                self.filename, self.received = event.filename, 0
+            self.metrics.inc('bytes_downloaded_total', max(0, event.downloaded_bytes - self.received))
+            self.received = max(self.received, event.downloaded_bytes)
+        if self.on_progress:
+            self.on_progress(event)
+    
+    def on_line(self, line):
+        if RETRY_RE.search(line):
+            self.metrics.inc('retries_total')
+    
+    def finish(self):
+        """Record the duration of every phase the download went through"""
+        end = time.monotonic()
+        download_at = self.marks.get('download')
+        postprocess_at = self.marks.get('postprocess')
+        self.metrics.observe('extract', (download_at or postprocess_at or end) - self.started)
+        if download_at:
+            self.metrics.observe('download', (postprocess_at or end) - download_at)
+        if postprocess_at:
+            self.metrics.observe('postprocess', end - postprocess_at)
+
+
+class MetricsServer:
+    """Serves Metrics on a local port: /metrics as Prometheus text, /metrics.json as JSON
+    
+    Also samples the transfer rate every interval seconds and, when
+    snapshot_file is set, rewrites it with the current snapshot.
+    """
+    def __init__(self, metrics, port=None, snapshot_file=None, interval=10, host='127.0.0.1'):
+        self.metrics = metrics
+        self.snapshot_file = Path(snapshot_file) if snapshot_file else None
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.httpd = None
+        if port is not None:
+            self.httpd = ThreadingHTTPServer((host, port), self._handler())
+            self.httpd.daemon_threads = True
+    
+    def _handler(self):
+        metrics = self.metrics
+        
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split('?')[0]
+                if path == '/metrics':
+                    body = metrics.prometheus().encode()
+                    content_type = 'text/plain; version=0.0.4'
+                elif path == '/metrics.json':
+                    body = json.dumps(metrics.snapshot()).encode()
+                    content_type = 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def log_message(self, format, *args):
+                pass
+        
+        return Handler
+    
+    def start(self):
+        if self.httpd:
+            threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        threading.Thread(target=self._sample_loop, daemon=True).start()
+        return self
+    
+    def _sample_loop(self):
+        while not self.stopped.wait(self.interval):
+            self.metrics.sample()
+            self.write_snapshot()
+    
+    def write_snapshot(self):
+        if not self.snapshot_file:
+            return
+        tmp_path = self.snapshot_file.with_name(self.snapshot_file.name + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.metrics.snapshot(), f, indent=2)
+        os.replace(tmp_path, self.snapshot_file)
+    
+    def stop(self):
+        self.stopped.set()
+        self.metrics.sample()
+        self.write_snapshot()
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+
+
+# Characters yt-dlp swaps for look-alikes when it turns a title into a filename
+FILENAME_REPLACEMENTS = str.maketrans({
+    '/': '⧸', '\\': '⧹', ':': '：', '*': '＊', '?': '？',
+    '"': '＂', '<': '＜', '>': '＞', '|': '｜',
+})
+
+
+def sanitize_filename(title):
+    """Filename for title following yt-dlp's default (non-restricted) rules"""
+    name = ''.join(ch for ch in title.translate(FILENAME_REPLACEMENTS) if ch.isprintable())
+    return name.strip().lstrip('.') or '_'
+
+
+class RangeNotSupported(Exception):
+    """The server ignored the Range header, so the file cannot be split"""
+
+
+class RangeDownloader:
+    """Fetches one HTTP file over several connections using byte ranges
+    
+    The file is split into chunk_size pieces that are written straight into
+    a preallocated <path>.part. Finished chunks are listed in a
+    <path>.part.chunks sidecar, so a retry after a failure or Ctrl+C only
+    fetches the missing ranges. on_progress(received, size) is called as
+    data arrives.
+    """
+    def __init__(self, url, path, size, connections=4, chunk_size=10 * 1024 * 1024, headers=None,
+                 governor=None, should_stop=None, on_progress=None, retries=3, timeout=30):
+        self.url = url
+        self.path = Path(path)
+        self.part = self.path.with_name(self.path.name + '.part')
+        self.sidecar = self.path.with_name(self.path.name + '.part.chunks')
+        self.size = size
+        self.connections = max(1, connections)
+        self.chunk_size = max(1, chunk_size)
+        self.headers = dict(headers or {})
+        self.governor = governor
+        self.should_stop = should_stop
+        self.on_progress = on_progress
+        self.retries = retries
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.done = set()
+        self.received = 0
+        self.stopped = threading.Event()
+    
+    def chunk_range(self, index):
+        start = index * self.chunk_size
+        return start, min(self.size, start + self.chunk_size) - 1
+    
+    def _load_sidecar(self):
+        """Chunks finished by an earlier attempt with the same size and chunking"""
+        try:
+            with open(self.sidecar, 'r') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return set()
+        if state.get('size') != self.size or state.get('chunk_size') != self.chunk_size:
+            return set()
+        if not self.part.exists() or self.part.stat().st_size != self.size:
+            return set()
+        return set(state.get('done', []))
+    
+    def _save_sidecar(self):
+        tmp_path = self.sidecar.with_name(self.sidecar.name + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump({'size': self.size, 'chunk_size': self.chunk_size, 'done': sorted(self.done)}, f)
+        os.replace(tmp_path, self.sidecar)
+    
+    def _progress(self, num_bytes):
+        with self.lock:
+            self.received += num_bytes
+            received = self.received
+        if self.on_progress:
+            self.on_progress(received, self.size)
+    
+    def _fetch(self, index):
+        start, end = self.chunk_range(index)
+        for attempt in range(self.retries + 1):
+            written = 0
+            try:
+                request = urllib.request.Request(self.url, headers={**self.headers, 'Range': f'bytes={start}-{end}'})
+                with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                    if response.status != 206:
+                        raise RangeNotSupported(f"HTTP {response.status} for a range request")
+                    with open(self.part, 'r+b') as f:
+                        f.seek(start)
+                        while written <= end - start:
+                            if self.stopped.is_set() or (self.should_stop and self.should_stop()):
+                                self.stopped.set()
+                                return
+                            block = response.read(min(256 * 1024, end - start + 1 - written))
+                            if not block:
+                                raise OSError(f"Connection closed after {start + written} bytes")
+                            if self.governor:
+                                self.governor.consume(len(block))
+                            f.write(block)
+                            written += len(block)
+                            self._progress(len(block))
+                break
+            except RangeNotSupported:
+                raise
+            except (OSError, http.client.HTTPException) as e:
+                # The chunk is fetched again from its start
+                self._progress(-written)
+                if attempt == self.retries:
+                    raise OSError(f"Range {start}-{end} failed: {e}")
+                time.sleep(min(2 ** attempt, 10))
+        with self.lock:
+            self.done.add(index)
+            self._save_sidecar()
+    
+    def run(self):
+        """Download the file to path; returns False if should_stop() interrupted it"""
+        chunks = -(-self.size // self.chunk_size)
+        self.done = self._load_sidecar()
+        if not self.done:
+            with open(self.part, 'wb') as f:
+                f.truncate(self.size)
+        self.received = sum(self.chunk_range(i)[1] - self.chunk_range(i)[0] + 1 for i in self.done)
+        pending = [i for i in range(chunks) if i not in self.done]
+        with ThreadPoolExecutor(max_workers=min(self.connections, max(1, len(pending)))) as pool:
+            futures = [pool.submit(self._fetch, index) for index in pending]
+            try:
+                for future in futures:
+                    future.result()
+            except BaseException:
+                self.stopped.set()
+                raise
+        if self.stopped.is_set():
+            return False
+        os.replace(self.part, self.path)
+        self.sidecar.unlink(missing_ok=True)
+        return True
+
+
+# ffmpeg encoder for each --audio-format value
+AUDIO_ENCODERS = {
+    'mp3': 'libmp3lame',
+    'm4a': 'aac',
+    'aac': 'aac',
+    'opus': 'libopus',
+    'vorbis': 'libvorbis',
+    'ogg': 'libvorbis',
+    'flac': 'flac',
+    'wav': 'pcm_s16le',
+}
+
+# Codec produced by each --audio-format value
+AUDIO_FORMAT_CODECS = {
+    'mp3': 'mp3', 'm4a': 'aac', 'aac': 'aac', 'opus': 'opus',
+    'vorbis': 'vorbis', 'ogg': 'vorbis', 'flac': 'flac', 'wav': 'pcm',
+}
+
+# File extension for audio kept in its original codec
+AUDIO_CODEC_EXTENSIONS = {'aac': 'm4a', 'opus': 'opus', 'vorbis': 'ogg', 'mp3': 'mp3', 'flac': 'flac'}
+
+# CPU seconds per second of audio for an mp3/aac encode, used to estimate
+# the savings of the audio fast path before any transcode was measured
+DEFAULT_TRANSCODE_CPU_RATIO = 0.02
+
+
+def audio_codec(fmt):
+    """Normalised audio codec of a yt-dlp format ('aac', 'opus', ...), or None"""
+    acodec = (fmt.get('acodec') or '').lower()
+    if acodec in ('', 'none'):
+        return None
+    if acodec.startswith('mp4a') or acodec == 'aac':
+        return 'aac'
+    for codec in ('opus', 'vorbis', 'flac', 'mp3'):
+        if acodec.startswith(codec):
+            return codec
+    return acodec
+
+
+def run_measured(cmd):
+    """Run cmd and return (returncode, stderr, cpu_seconds)
+    
+    The CPU time of the child is read with os.wait4 where the platform has
+    it, otherwise cpu_seconds is None.
+    """
+    process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    if not hasattr(os, 'wait4'):
+        _, stderr = process.communicate()
+        return process.returncode, stderr, None
+    stderr = process.stderr.read()
+    process.stderr.close()
+    _, status, usage = os.wait4(process.pid, 0)
+    returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+    # Stop Popen from waiting for the already reaped process again
+    process.returncode = returncode
+    return returncode, stderr, usage.ru_utime + usage.ru_stime
+
+
+class PostProcessJob:
+    """ffmpeg step turning downloaded raw streams into the final file
+    
+    With audio_format set the first input is converted to that audio
+    format, or only remuxed when copy_audio is true (the audio fast path).
+    Otherwise the video of the first input and the audio of the second are
+    merged without re-encoding. The inputs are removed once the target has
+    been written. ffmpeg's CPU time ends up in cpu_seconds and, with
+    metrics given, in the audio counters.
+    """
+    def __init__(self, url, inputs, target, audio_format=None, audio_quality=None, copy_audio=False,
+                 duration=None, metrics=None):
+        self.url = url
+        self.inputs = [Path(p) for p in inputs]
+        self.target = Path(target)
+        self.audio_format = audio_format
+        self.audio_quality = audio_quality
+        self.copy_audio = copy_audio
+        self.duration = duration
+        self.metrics = metrics
+        self.cpu_seconds = None
+        # Called with the target path once it has been written; returns
+        # where the file ended up (see YouTubeDownloader.finalize)
+        self.finalize = None
+        # Called with the final path once the file is in place
+        self.on_success = None
+    
+    @property
+    def postprocessor(self):
+        """Name of the matching yt-dlp postprocessor, used for progress events"""
+        return 'ExtractAudio' if self.audio_format else 'Merger'
+    
+    def describe(self):
+        if self.audio_format and self.copy_audio:
+            return f"[ExtractAudio] Not converting audio, remuxing into {self.target}"
+        if self.audio_format:
+            return f"[ExtractAudio] Destination: {self.target}"
+        return f'[Merger] Merging formats into "{self.target}"'
+    
+    def command(self, output):
+        cmd = ['ffmpeg', '-y', '-loglevel', 'error']
+        for path in self.inputs:
+            cmd.extend(['-i', str(path)])
+        if self.audio_format and self.copy_audio:
+            cmd.extend(['-vn', '-map', '0:a:0', '-c:a', 'copy'])
+        elif self.audio_format:
+            cmd.extend(['-vn', '-map', '0:a:0'])
+            encoder = AUDIO_ENCODERS.get(self.audio_format)
+            if encoder:
+                cmd.extend(['-c:a', encoder])
+            quality = str(self.audio_quality or '')
+            if quality.isdigit() and int(quality) > 10:
+                cmd.extend(['-b:a', f"{quality}k"])
+            elif quality.isdigit():
+                # yt-dlp's 0 (best) .. 10 (worst) VBR scale
+                cmd.extend(['-q:a', quality])
+        else:
+            cmd.extend(['-map', '0:v:0', '-map', '1:a:0', '-c', 'copy'])
+        cmd.append(str(output))
+        return cmd
+    
+    def run(self):
+        """Run ffmpeg and return a DownloadResult"""
+        tmp_path = self.target.with_name(f"{self.target.stem}.temp{self.target.suffix}")
+        try:
+            returncode, stderr, self.cpu_seconds = run_measured(self.command(tmp_path))
+        except OSError as e:
+            return DownloadResult(self.url, False, f"ERROR: Post-processing failed: {e}")
+        if returncode != 0:
+            tmp_path.unlink(missing_ok=True)
+            errors = stderr.strip().splitlines()
+            return DownloadResult(self.url, False,
+                                  f"ERROR: Post-processing failed: {errors[-1] if errors else returncode}")
+        os.replace(tmp_path, self.target)
+        if self.metrics and self.audio_format:
+            self.metrics.record_audio(self.copy_audio, self.cpu_seconds, self.duration)
+        for path in self.inputs:
+            path.unlink(missing_ok=True)
+        target = self.target
+        if self.finalize:
+            try:
+                target = self.finalize(target)
+            except OSError as e:
+                return DownloadResult(self.url, False, f"ERROR: Could not move {target.name} to the output folder: {e}")
+        if self.on_success:
+            self.on_success(target)
+        return DownloadResult(self.url, True, path=target)
+
+
+class PostProcessPool:
+    """Runs PostProcessJobs on their own workers, separate from the downloads
+    
+    Each job is an ffmpeg process, so workers defaults to the CPU count.
+    The queue is bounded: submit() blocks while it is full, so downloads
+    cannot run arbitrarily far ahead of post-processing.
+    """
+    def __init__(self, workers=None, queue_size=None, metrics=None):
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.queue = queue.Queue(maxsize=max(1, queue_size or self.workers * 2))
+        self.metrics = metrics
+        self.threads = [threading.Thread(target=self._worker, daemon=True) for _ in range(self.workers)]
+        for thread in self.threads:
+            thread.start()
+    
+    def submit(self, job, callback):
+        """Queue job; callback(result) is called from a pool thread when it is done"""
+        self.queue.put((job, callback))
+        if self.metrics:
+            self.metrics.set('postprocess_queue_depth', self.queue.qsize())
+    
+    def _worker(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                return
+            job, callback = item
+            if self.metrics:
+                self.metrics.set('postprocess_queue_depth', self.queue.qsize())
+            started = time.monotonic()
+            try:
+                result = job.run()
+            except Exception as e:
+                result = DownloadResult(job.url, False, f"ERROR: Post-processing failed: {e}")
+            if self.metrics:
+                self.metrics.observe('postprocess', time.monotonic() - started)
+            try:
+                callback(result)
+            finally:
+                self.queue.task_done()
+    
+    def join(self):
+        """Wait until every submitted job has finished"""
+        self.queue.join()
+    
+    def close(self):
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+
+
+class SubprocessBackend:
+    """Runs every download in a fresh yt-dlp process"""
+    name = 'subprocess'
+    
+    def __init__(self, downloader):
+        self.downloader = downloader
+    
+    def download(self, url, audio_only=False, on_line=None, should_stop=None, info_file=None,
+                 reporter=None, raw_formats=None):
+        """Run yt-dlp for url, passing each output line to on_line (default: print)
+        
+        When info_file is given the metadata is loaded from it instead of
+        being extracted again. Lines are also parsed into progress events
+        when a ProgressReporter is given. raw_formats lists format IDs to
+        download as separate files without post-processing.
+        """
+        governor = self.downloader.governor
+        rate = governor.reserve(self.downloader.concurrent_downloads)
+        try:
+            return self._run(url, audio_only, on_line, should_stop, info_file, reporter, raw_formats, rate)
+        finally:
+            governor.release(rate)
+    
+    def _run(self, url, audio_only, on_line, should_stop, info_file, reporter, raw_formats, rate):
+        cmd = self.downloader.build_command(url, audio_only, info_file=info_file, raw_formats=raw_formats, rate=rate)
+        on_line = on_line or print
+        error = None
+        process = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            bufsize=1
+        )
+        try:
+            for line in process.stdout:
+                if should_stop and should_stop():
+                    process.terminate()
+                    error = 'Stopped by user'
+                    break
+                line = line.strip()
+                if not line:
+                    continue
+                if line.startswith('ERROR:'):
+                    error = line
+                if reporter:
+                    reporter.feed_line(line)
+                on_line(line)
+            process.wait()
+        except BaseException:
+            process.kill()
+            process.wait()
+            raise
+        
+        if process.returncode == 0 and not error:
+            return DownloadResult(url, True)
+        return DownloadResult(url, False, error or f"yt-dlp exited with status {process.returncode}")
+    
+    def iter_entries(self, url):
+        """Yield the entry URLs of a playlist or channel as yt-dlp lists them
+        
+        Uses flat, lazy extraction so the first entries arrive while the
+        rest of the list is still being fetched. Raises RuntimeError if
+        yt-dlp fails.
+        """
+        cmd = ['yt-dlp', '--flat-playlist', '--lazy-playlist', '--no-warnings', '--print', '%(url)s', url]
+        error = None
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1)
+        try:
+            for line in process.stdout:
+                line = line.strip()
+                if line.startswith('ERROR:'):
+                    error = line
+                elif line.startswith('http'):
+                    yield line
+            process.wait()
+        finally:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+        if process.returncode != 0:
+            raise RuntimeError(error or f"yt-dlp exited with status {process.returncode}")
+    
+    def extract_info(self, url, timeout=30):
+        """Return the yt-dlp info dict for url without downloading"""
+        cmd = ['yt-dlp', '--dump-json', '--no-warnings', url]
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
+        if result.returncode != 0:
+            errors = result.stderr.strip().splitlines()
+            raise RuntimeError(errors[-1] if errors else 'Failed to fetch video info')
+        return json.loads(result.stdout)
+
+
+class _YdlLogger:
+    """Forwards yt-dlp's messages to the callback of the running download"""
+    def __init__(self):
+        self.on_line = print
+    
+    def debug(self, msg):
+        if not msg.startswith('[debug] '):
+            self.on_line(msg)
+    
+    def info(self, msg):
+        self.on_line(msg)
+    
+    def warning(self, msg):
+        # Retries are reported as warnings; shown like the executable would
+        self.on_line(f"WARNING: {msg}")
+    
+    def error(self, msg):
+        self.on_line(msg)
+
+
+class InProcessBackend:
+    """Drives the yt_dlp Python API inside this process
+    
+    Each worker thread keeps its own YoutubeDL instances (they are not
+    thread-safe), so extractors are initialised and HTTP connections are
+    reused once per thread instead of once per URL.
+    """
+    name = 'inprocess'
+    
+    def __init__(self, downloader):
+        import yt_dlp
+        self.yt_dlp = yt_dlp
+        self.downloader = downloader
+        self._local = threading.local()
+    
+    def _ydl(self, audio_only, raw=False):
+        """Return this thread's YoutubeDL for the given mode"""
+        instances = getattr(self._local, 'instances', None)
+        if instances is None:
+            instances = self._local.instances = {}
+        mode = 'raw' if raw else audio_only
+        if mode not in instances:
+            logger = _YdlLogger()
+            params = self.downloader.build_params(audio_only, logger, raw=raw)
+            if raw:
+                params['format'] = self._select_raw_formats
+            ydl = self.yt_dlp.YoutubeDL(params)
+            ydl.add_progress_hook(self._check_stop)
+            ydl.add_progress_hook(self._throttle)
+            ydl.add_progress_hook(self._report_progress)
+            ydl.add_postprocessor_hook(self._report_postprocessing)
+            ydl.add_post_hook(self._record_path)
+            instances[mode] = ydl
+        return instances[mode]
+    
+    def _select_raw_formats(self, ctx):
+        """Format selector picking the IDs requested by the running raw download"""
+        wanted = getattr(self._local, 'raw_formats', None) or []
+        by_id = {fmt.get('format_id'): fmt for fmt in ctx['formats']}
+        return [by_id[format_id] for format_id in wanted if format_id in by_id]
+    
+    def _check_stop(self, status):
+        """Progress hook aborting the running download once a stop is requested"""
+        should_stop = getattr(self._local, 'should_stop', None)
+        if should_stop and should_stop():
+            raise self.yt_dlp.utils.DownloadCancelled('Stopped by user')
+    
+    def _throttle(self, status):
+        """Progress hook charging newly received bytes to the bandwidth governor"""
+        if status.get('status') != 'downloading':
+            return
+        downloaded = status.get('downloaded_bytes') or 0
+        key = status.get('filename')
+        last_key, last = getattr(self._local, 'throttle_position', (None, 0))
+        self._local.throttle_position = (key, downloaded)
+        self.downloader.governor.consume(downloaded - last if key == last_key else downloaded)
+    
+    def _report_progress(self, status):
+        reporter = getattr(self._local, 'reporter', None)
+        if reporter:
+            reporter.feed_hook(status)
+    
+    def _report_postprocessing(self, status):
+        reporter = getattr(self._local, 'reporter', None)
+        if reporter:
+            reporter.feed_postprocessor_hook(status)
+    
+    def _record_path(self, filepath):
+        """Post hook noting the finished file, after every postprocessor ran"""
+        self._local.final_path = filepath
+    
+    def download(self, url, audio_only=False, on_line=None, should_stop=None, info_file=None,
+                 reporter=None, raw_formats=None):
+        """Download url with the thread's YoutubeDL, mirroring SubprocessBackend.download"""
+        ydl = self._ydl(audio_only, raw=bool(raw_formats))
+        ydl.params['logger'].on_line = on_line or print
+        self._local.should_stop = should_stop
+        self._local.reporter = reporter
+        self._local.raw_formats = raw_formats
+        self._local.final_path = None
+        info = None
+        try:
+            if info_file:
+                retcode = ydl.download_with_info_file(str(info_file))
+            else:
+                info = ydl.sanitize_info(ydl.extract_info(url, download=True))
+                retcode = 0
+            path = self._local.final_path
+        except self.yt_dlp.utils.DownloadCancelled as e:
+            return DownloadResult(url, False, str(e))
+        except self.yt_dlp.utils.DownloadError as e:
+            return DownloadResult(url, False, str(e))
+        finally:
+            self._local.should_stop = None
+            self._local.reporter = None
+            self._local.raw_formats = None
+            self._local.final_path = None
+        
+        if retcode != 0:
+            return DownloadResult(url, False, f"yt-dlp exited with status {retcode}")
+        if not path and info and info.get('requested_downloads'):
+            path = info['requested_downloads'][-1].get('filepath')
+        # Taken from yt-dlp itself rather than from its log messages
+        return DownloadResult(url, True, info=info, path=Path(path) if path else None)
+    
+    def iter_entries(self, url):
+        """Yield the entry URLs of a playlist or channel, like SubprocessBackend.iter_entries"""
+        ydl = getattr(self._local, 'flat_ydl', None)
+        if ydl is None:
+            ydl = self._local.flat_ydl = self.yt_dlp.YoutubeDL({
+                'extract_flat': 'in_playlist',
+                'lazy_playlist': True,
+                'quiet': True,
+                'no_warnings': True,
+                'logger': _YdlLogger(),
+            })
+        ydl.params['logger'].on_line = lambda msg: None
+        try:
+            # process=False keeps the entries as the extractor's lazy generator
+            info = ydl.extract_info(url, download=False, process=False)
+            if info.get('_type') in ('url', 'url_transparent') and info.get('url') != url:
+                # The extractor redirected, e.g. from a channel to its videos tab
+                yield from self.iter_entries(info['url'])
+                return
+            for entry in info.get('entries') or []:
+                entry_url = (entry or {}).get('url') or (entry or {}).get('webpage_url')
+                if entry_url:
+                    yield entry_url
+        except self.yt_dlp.utils.DownloadError as e:
+            raise RuntimeError(str(e))
+    
+    def extract_info(self, url, timeout=30):
+        """Return the info dict for url in the same shape as --dump-json"""
+        ydl = self._ydl(False)
+        ydl.params['logger'].on_line = lambda msg: None
+        try:
+            info = ydl.extract_info(url, download=False)
+        except self.yt_dlp.utils.DownloadError as e:
+            raise RuntimeError(str(e))
+        return ydl.sanitize_info(info)
+
+
+BACKENDS = {
+    SubprocessBackend.name: SubprocessBackend,
+    InProcessBackend.name: InProcessBackend,
+}
+
+
+class AsyncEngine:
+    """Runs downloads as asyncio tasks, each driving a yt-dlp process
+    
+    Output is read without blocking, so one event loop can supervise
+    hundreds of downloads, and cancelling a task terminates its yt-dlp
+    process right away instead of after its next output line. The
+    in-process yt_dlp API blocks, so this engine always uses the yt-dlp
+    executable; merging happens inside yt-dlp.
+    """
+    name = 'asyncio'
+    
+    def __init__(self, downloader, kill_timeout=5):
+        self.downloader = downloader
+        self.kill_timeout = kill_timeout
+        self._host_slots = {}
+    
+    def host_slot(self, url):
+        """asyncio counterpart of YouTubeDownloader.host_slot"""
+        host = host_key(url)
+        if host not in self._host_slots:
+            self._host_slots[host] = asyncio.Semaphore(max(1, self.downloader.max_per_host))
+        return self._host_slots[host]
+    
+    async def download(self, url, audio_only=False, on_line=None, on_progress=None):
+        """Download url and return a DownloadResult; see YouTubeDownloader.download"""
+        downloader = self.downloader
+        video_id = video_id_from_url(url)
+        info_file = None
+        if downloader.metadata_cache and video_id:
+            info_file = downloader.metadata_cache.lookup(video_id)
+        timer = DownloadTimer(downloader.metrics, on_progress)
+        reporter = ProgressReporter(url, timer, downloader.progress_interval)
+        on_line = on_line or print
+        paths = []
+        
+        def forward_line(line):
+            path = output_path(line)
+            if path:
+                paths.append(path)
+            on_line(line)
+        
+        downloader.metrics.inc('downloads_started_total')
+        downloader.metrics.inc('active_downloads')
+        downloader.governor.start()
+        result = DownloadResult(url, False, 'Cancelled by user')
+        rate = None
+        try:
+            while True:
+                reserved, rate = downloader.governor.try_reserve(downloader.concurrent_downloads)
+                if reserved:
+                    break
+                # Wait for running processes to release bandwidth without blocking the loop
+                await asyncio.sleep(0.5)
+            cmd = downloader.build_command(url, audio_only, info_file=info_file, rate=rate)
+            result = await self._run(url, cmd, reporter, timer, forward_line)
+        finally:
+            downloader.governor.release(rate)
+            downloader.governor.finish()
+            downloader.metrics.inc('active_downloads', -1)
+            downloader.metrics.inc('downloads_succeeded_total' if result else 'downloads_failed_total')
+            timer.finish()
+        if result:
+            reporter.finish()
+            if paths:
+                result.path = Path(paths[-1])
+            # Moving to the output dir and hashing for the archive block
+            result = await asyncio.get_running_loop().run_in_executor(
+                None, self._finish, url, audio_only, result
+            )
+        if downloader.metadata_cache and not info_file and video_id:
+            downloader.metadata_cache.register(video_id)
+        return result
+    
+    def _finish(self, url, audio_only, result):
+        """Finalize a finished download and add it to the archive (runs on an executor thread)"""
+        result = self.downloader.finalize_result(result)
+        if result:
+            self.downloader.archive_download(url, audio_only, result.path)
+        return result
+    
+    async def _run(self, url, cmd, reporter, timer, on_line):
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT
+            )
+        except OSError as e:
+            return DownloadResult(url, False, f"Could not start yt-dlp: {e}")
+        error = None
+        try:
+            while True:
+                line = await process.stdout.readline()
+                if not line:
+                    break
+                line = line.decode('utf-8', 'replace').strip()
+                if not line:
+                    continue
+                if line.startswith('ERROR:'):
+                    error = line
+                reporter.feed_line(line)
+                timer.on_line(line)
+                on_line(line)
+            await process.wait()
+        except BaseException:
+            # Cancelled: stop the transfer now, not after yt-dlp's next line
+            if process.returncode is None:
+                process.terminate()
+                try:
+                    await asyncio.wait_for(process.wait(), self.kill_timeout)
+                except asyncio.TimeoutError:
+                    process.kill()
+                    await process.wait()
+            raise
+        
+        if process.returncode == 0 and not error:
+            return DownloadResult(url, True)
+        return DownloadResult(url, False, error or f"yt-dlp exited with status {process.returncode}")
+    
+    async def run_bulk(self, urls, audio_only=False, log=print, journal=None, summary=None, quiet=True):
+        """asyncio counterpart of YouTubeDownloader.run_bulk
+        
+        concurrent_downloads tasks share one event loop. urls may be a
+        blocking generator; it is advanced on a single helper thread so
+        listing never stalls the running downloads. Transient failures are
+        retried at the end, as in the threaded version. Cancelling the
+        returned coroutine cancels every running download at once.
+        """
+        downloader = self.downloader
+        summary = summary or BulkSummary()
+        workers = max(1, downloader.concurrent_downloads)
+        work = asyncio.Queue(maxsize=workers * 2)
+        
+        async def worker():
+            while True:
+                url = await work.get()
+                downloader.metrics.set('queue_depth', work.qsize())
+                if url is None:
+                    return
+                async with self.host_slot(url):
+                    if journal:
+                        journal.record(url, 'running')
+                    if not quiet:
+                        print(f"\n📥 Downloading: {url}")
+                    try:
+                        ok = await self.download(url, audio_only, on_line=(lambda line: None) if quiet else None)
+                    except Exception as e:
+                        log(f"❌ Error: {url}: {e}")
+                        ok = DownloadResult(url, False, f"ERROR: {e}")
+                downloader.finish_download(url, ok, summary, retries, journal, log)
+        
+        retries = downloader.retry_queue()
+        loop = asyncio.get_running_loop()
+        reader = ThreadPoolExecutor(max_workers=1)
+        urls = iter(urls)
+        tasks = [asyncio.ensure_future(worker()) for _ in range(workers)]
+        try:
+            while True:
+                url = await loop.run_in_executor(reader, next, urls, None)
+                if url is None:
+                    break
+                if journal:
+                    journal.record(url, 'queued')
+                summary.added()
+                retries.started()
+                await work.put(url)
+                downloader.metrics.set('queue_depth', work.qsize())
+            summary.ingest_done = True
+            while True:
+                url, wait = retries.poll()
+                if url:
+                    log(f"🔁 Retrying {url}")
+                    await work.put(url)
+                elif wait is None:
+                    break
+                else:
+                    await asyncio.sleep(min(wait, 0.5))
+            for _ in tasks:
+                await work.put(None)
+            await asyncio.gather(*tasks)
+        finally:
+            summary.ingest_done = True
+            summary.retried = len(retries.failures)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            reader.shutdown(wait=False)
+        return summary
+
+
+class EventLoopThread:
+    """One background event loop that other threads hand coroutines to"""
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+    
+    def submit(self, coro):
+        """Schedule coro; cancelling the returned Future cancels the coroutine"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+    
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+
+ENGINES = ('threads', AsyncEngine.name)
+
 
 class YouTubeDownloader:
-    def __init__(self, output_dir="./downloads", quality="2160p"):
+    def __init__(self, output_dir="./downloads", quality="2160p", config_file="config.json"):
         self.output_dir = Path(output_dir)
-        self.output_dir.mkdir(exist_ok=True)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
         self.quality = quality
+        self.config_file = Path(config_file)
         # Set defaults before loading config
         self.max_retries = 3
         self.audio_format = 'mp3'
         self.audio_quality = '320'
+        self.concurrent_downloads = 4
+        self.max_per_host = 4
+        self.backend_name = 'auto'
+        self.cache_dir = Path.home() / '.cache' / 'youtube-video-downloader'
+        self.metadata_cache_ttl = 3600
+        self.metadata_cache_max_mb = 200
+        self.progress_interval = 0.5
+        self.preflight_workers = 8
+        self.bandwidth_limit = None
+        self.bandwidth_schedule = []
+        self.metrics_port = None
+        self.metrics_file = None
+        self.metrics_interval = 10
+        self.parallel_connections = {'2160p': 8, '1440p': 8, '1080p': 4}
+        self.range_chunk_mb = 10
+        self.connections = None
+        self.pipeline_postprocessing = True
+        self.postprocess_workers = None
+        self.postprocess_queue = None
+        self.lossless_audio = False
+        self.engine_name = 'threads'
+        self.download_archive = True
+        self.schedule_policy = 'fifo'
+        self.schedule_window = 100
+        self.retry_attempts = 3
+        self.retry_backoff = 5
+        self.retry_backoff_max = 300
+        self.staging_dir = None
+        self.staging_max_age = 24
+        self.output_layout = 'flat'
         self.load_config()
-        
+        self.governor = BandwidthGovernor(self.bandwidth_limit, self.bandwidth_schedule)
+        self.select_backend(self.backend_name)
+        self.select_engine(self.engine_name)
+        self.metadata_cache = MetadataCache(
+            self.cache_dir / 'metadata',
+            ttl=self.metadata_cache_ttl,
+            max_bytes=self.metadata_cache_max_mb * 1024 * 1024,
+        )
+        self._host_slots = {}
+        self._host_slots_lock = threading.Lock()
+        self.metrics = Metrics()
+        self._archive = None
+        self._archive_lock = threading.Lock()
+        # (size, sha256) of finalized files, hashed before they left work_dir
+        self._digests = {}
+        self._staging = None
+        self._staging_lock = threading.Lock()
+    
     def load_config(self):
-        """Load configuration from config.json if exists"""
-        config_file = Path("config.json")
+        """Load configuration from config_file (config.json) if exists"""
+        config_file = self.config_file
         if config_file.exists():
             with open(config_file, 'r') as f:
                 config = json.load(f)
@@ -33,6 +2535,66 @@ class YouTubeDownloader:
                 self.max_retries = config.get('max_retries', self.max_retries)
                 self.audio_format = config.get('audio_format', self.audio_format)
                 self.audio_quality = str(config.get('audio_quality', self.audio_quality))
+                self.concurrent_downloads = int(config.get('concurrent_downloads', self.concurrent_downloads))
+                self.max_per_host = int(config.get('max_per_host', self.max_per_host))
+                self.backend_name = config.get('backend', self.backend_name)
+                self.cache_dir = Path(config.get('cache_dir', self.cache_dir)).expanduser()
+                self.metadata_cache_ttl = config.get('metadata_cache_ttl', self.metadata_cache_ttl)
+                self.metadata_cache_max_mb = config.get('metadata_cache_max_mb', self.metadata_cache_max_mb)
+                self.progress_interval = float(config.get('progress_interval', self.progress_interval))
+                self.preflight_workers = int(config.get('preflight_workers', self.preflight_workers))
+                self.bandwidth_limit = config.get('bandwidth_limit', self.bandwidth_limit)
+                self.bandwidth_schedule = config.get('bandwidth_schedule', self.bandwidth_schedule)
+                self.metrics_port = config.get('metrics_port', self.metrics_port)
+                self.metrics_file = config.get('metrics_file', self.metrics_file)
+                self.metrics_interval = float(config.get('metrics_interval', self.metrics_interval))
+                self.parallel_connections = config.get('parallel_connections', self.parallel_connections)
+                self.range_chunk_mb = float(config.get('range_chunk_mb', self.range_chunk_mb))
+                self.pipeline_postprocessing = config.get('pipeline_postprocessing', self.pipeline_postprocessing)
+                self.postprocess_workers = config.get('postprocess_workers', self.postprocess_workers)
+                self.postprocess_queue = config.get('postprocess_queue', self.postprocess_queue)
+                self.lossless_audio = config.get('lossless_audio', self.lossless_audio)
+                self.engine_name = config.get('engine', self.engine_name)
+                self.download_archive = config.get('download_archive', self.download_archive)
+                self.schedule_policy = config.get('schedule_policy', self.schedule_policy)
+                self.schedule_window = int(config.get('schedule_window', self.schedule_window))
+                self.retry_attempts = int(config.get('retry_attempts', self.retry_attempts))
+                self.retry_backoff = float(config.get('retry_backoff', self.retry_backoff))
+                self.retry_backoff_max = float(config.get('retry_backoff_max', self.retry_backoff_max))
+                self.staging_dir = config.get('staging_dir', self.staging_dir)
+                self.staging_max_age = float(config.get('staging_max_age', self.staging_max_age))
+                self.output_layout = config.get('output_layout', self.output_layout)
+    
+    def select_backend(self, name='auto'):
+        """Pick the download engine: 'inprocess', 'subprocess' or 'auto'
+        
+        'auto' uses the in-process yt_dlp API when the module is importable
+        and falls back to spawning the yt-dlp executable otherwise.
+        """
+        if name not in ('auto', *BACKENDS):
+            raise ValueError(f"Unknown backend: {name}")
+        if name in ('auto', InProcessBackend.name):
+            try:
+                self.backend = InProcessBackend(self)
+                return self.backend
+            except ImportError:
+                if name != 'auto':
+                    raise
+        self.backend = SubprocessBackend(self)
+        return self.backend
+    
+    def select_engine(self, name='threads'):
+        """Pick how downloads are orchestrated: 'threads' or 'asyncio'
+        
+        With 'asyncio', self.engine is an AsyncEngine and download_single
+        and download_bulk run on an event loop; with 'threads' it is None
+        and downloads go through self.backend on worker threads.
+        """
+        if name not in ENGINES:
+            raise ValueError(f"Unknown engine: {name}")
+        self.engine_name = name
+        self.engine = AsyncEngine(self) if name == AsyncEngine.name else None
+        return self.engine
     
     def get_format_string(self, quality, audio_only=False):
         """Get yt-dlp format string based on quality"""
@@ -40,28 +2602,562 @@ class YouTubeDownloader:
             return 'bestaudio/best'
         
         quality_map = {
-            '2160p': 'bestvideo[height<=2160]+bestaudio/best[height<=2160]/best',
-            '1440p': 'bestvideo[height<=1440]+bestaudio/best[height<=1440]/best',
-            '1080p': 'bestvideo[height<=1080]+bestaudio/best[height<=1080]/best',
-            '720p': 'bestvideo[height<=720]+bestaudio/best[height<=720]/best',
-            '480p': 'bestvideo[height<=480]+bestaudio/best[height<=480]/best',
-            '360p': 'bestvideo[height<=360]+bestaudio/best[height<=360]/best',
+            label: f'bestvideo[height<={height}]+bestaudio/best[height<={height}]/best'
+            for label, height in QUALITY_HEIGHTS.items()
         }
         
         return quality_map.get(quality, quality_map['1080p'])
     
-    def download_single(self, url, audio_only=False):
-        """Download a single video"""
-        print(f"\n📥 Downloading: {url}")
-        print(f"Quality: {self.quality if not audio_only else 'Audio Only'}")
-        print(f"Output: {self.output_dir}")
+    @property
+    def archive(self):
+        """DownloadArchive of the current output_dir, or None when download_archive is off"""
+        if not self.download_archive:
+            return None
+        path = self.output_dir / '.download_archive.sqlite'
+        with self._archive_lock:
+            if self._archive is None or self._archive.path != path:
+                self.output_dir.mkdir(parents=True, exist_ok=True)
+                self._archive = DownloadArchive(path)
+            return self._archive
+    
+    @property
+    def staging(self):
+        """StagingArea of the current output_dir, or None when no staging_dir is set"""
+        if not self.staging_dir:
+            return None
+        with self._staging_lock:
+            if self._staging is None or self._staging.output_dir != self.output_dir:
+                self._staging = StagingArea(self.staging_dir, self.output_dir, self.staging_max_age * 3600)
+                if self._staging.removed:
+                    print(f"🧹 Removed {self._staging.removed} stale files from {self._staging.root}")
+            return self._staging
+    
+    @property
+    def work_dir(self):
+        """Where downloads and post-processing write: the staging area, or else output_dir"""
+        staging = self.staging
+        return staging.path if staging else self.output_dir
+    
+    @property
+    def sharded(self):
+        return self.output_layout == 'sharded'
+    
+    def library_path(self, name):
+        """Final place of a finished file called name in output_dir
+        
+        With the sharded layout names start with the video ID, which picks
+        the folder (see shard_dir).
+        """
+        if self.sharded:
+            return self.output_dir / shard_dir(Path(name).stem) / name
+        return self.output_dir / name
+    
+    def finalize(self, path):
+        """Move a finished file from work_dir to its place in output_dir and return the new path
+        
+        Files elsewhere, such as ones found already downloaded in
+        output_dir, are returned unchanged.
+        """
+        path = Path(path)
+        if path.resolve().parent != self.work_dir.resolve():
+            return path
+        target = self.library_path(path.name)
+        if target == path:
+            return path
+        # Hash for the archive now, while the file is still on local disk
+        digest = file_digest(path) if self.archive else None
+        target = move_file(path, target)
+        if digest:
+            self._digests[target.resolve()] = digest
+        return target
+    
+    def finalize_result(self, result):
+        """Move the file of a successful result to its place in output_dir
+        
+        Returns result with the final path, or a failed result when the
+        file could not be moved.
+        """
+        if not result or not result.path:
+            return result
+        try:
+            result.path = self.finalize(result.path)
+        except OSError as e:
+            return DownloadResult(result.url, False,
+                                  f"ERROR: Could not move {Path(result.path).name} to {self.output_dir}: {e}",
+                                  info=result.info)
+        return result
+    
+    def archive_format(self, audio_only=False):
+        """Archive key for what a download produces: the quality, or the audio format"""
+        if audio_only:
+            return f"audio-{'lossless' if self.lossless_audio else self.audio_format}"
+        return self.quality
+    
+    def cached_info(self, video_id):
+        """Info dict of video_id from the metadata cache, or {}
+        
+        Read directly, without touching the cache statistics: an expired
+        entry still has the right title and upload date.
+        """
+        if not self.metadata_cache:
+            return {}
+        try:
+            with open(self.metadata_cache.path(video_id), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+    
+    def archive_download(self, url, audio_only, path, info=None):
+        """Record a finished download in the archive, with its title from info or the metadata cache"""
+        archive = self.archive
+        video_id = video_id_from_url(url)
+        digest = self._digests.pop(Path(path).resolve(), None) if path else None
+        if not archive or not video_id or not path:
+            return
+        title = (info or self.cached_info(video_id)).get('title')
+        try:
+            archive.add(video_id, self.archive_format(audio_only), path, title, digest)
+        except OSError:
+            # Moved or deleted before it could be hashed; it is simply not archived
+            pass
+    
+    def schedule(self, urls, audio_only=False, priorities=None, window=None):
+        """Yield urls in the order of schedule_policy; see BulkScheduler"""
+        scheduler = BulkScheduler(self, self.schedule_policy, window or self.schedule_window, audio_only, priorities)
+        return scheduler.order(urls)
+    
+    def archived_path(self, url, audio_only=False):
+        """Path of url's video when it is archived in this format, else None"""
+        archive = self.archive
+        video_id = video_id_from_url(url)
+        if not archive or not video_id or not archive.contains(video_id, self.archive_format(audio_only)):
+            return None
+        entry = archive.get(video_id, self.archive_format(audio_only))
+        return Path(entry[0]) if entry else None
+    
+    def skip_archived(self, urls, audio_only=False, on_skip=None):
+        """Yield the URLs whose video is not archived in this format yet
+        
+        Only the video ID in the URL is looked at, so archived videos are
+        skipped without any network request. on_skip(url) is called for
+        every skipped URL.
+        """
+        archive = self.archive
+        fmt = self.archive_format(audio_only)
+        for url in urls:
+            video_id = video_id_from_url(url)
+            if archive and video_id and archive.contains(video_id, fmt):
+                if on_skip:
+                    on_skip(url)
+                continue
+            yield url
+    
+    def find_downloads(self, query=None):
+        """Print the archived downloads matching query and return them; see DownloadArchive.find"""
+        archive = self.archive
+        if not archive:
+            print("❌ The download archive is turned off (download_archive in config.json)")
+            return []
+        rows = archive.find(query)
+        for video_id, fmt, title, path in rows:
+            print(f"{video_id}  [{fmt}]  {title or '(no title)'}")
+            print(f"    {path}")
+        print(f"\n📚 {len(rows)} of {archive.count()} archived downloads" + (f" match '{query}'" if query else ""))
+        return rows
+    
+    def verify_archive(self, audio_only=False):
+        """Check every archived file; return the URLs to download again
+        
+        Missing, truncated and corrupt files are dropped from the archive.
+        Those archived in the format of this run are returned, with broken
+        files deleted so they are not taken for finished downloads; the
+        others are downloaded again by the next run in their format.
+        """
+        archive = self.archive
+        if not archive:
+            print("❌ The download archive is turned off (download_archive in config.json)")
+            return []
+        print(f"🔍 Verifying {archive.count()} archived downloads in {self.output_dir}")
+        broken = archive.verify()
+        for video_id, fmt, path, problem in broken:
+            print(f"⚠️  {problem.capitalize()} ({fmt}): {path}")
+        print(f"✅ Intact: {archive.count()}, broken: {len(broken)}")
+        fmt = self.archive_format(audio_only)
+        urls = []
+        for video_id, entry_fmt, path, problem in broken:
+            if entry_fmt != fmt:
+                continue
+            if problem != 'missing':
+                Path(path).unlink(missing_ok=True)
+            urls.append(f"https://www.youtube.com/watch?v={video_id}")
+        return urls
+    
+    def connections_for(self, audio_only=False):
+        """Parallel connections for one download at the current quality
+        
+        --connections overrides the per-tier parallel_connections config;
+        tiers that are not listed (and audio) use a single connection.
+        """
+        if self.connections:
+            return max(1, int(self.connections))
+        tier = 'audio' if audio_only else self.quality
+        return max(1, int(self.parallel_connections.get(tier, 1)))
+    
+    def preflight(self, urls, audio_only=False, log=print):
+        """Resolve metadata for all urls concurrently and check they fit on disk
+        
+        Unavailable videos and, in list order, videos that would overflow the
+        free space of the output folder are rejected. Returns the list of
+        PreflightItems; rejected ones carry the reason in .error.
+        """
+        def check(url):
+            try:
+                info = self.extract_info(url)
+            except Exception as e:
+                return PreflightItem(url, error=str(e) or 'Unavailable')
+            return PreflightItem(url, info, estimate_download_size(info, self.quality, audio_only))
+        
+        workers = max(1, self.preflight_workers)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            items = list(pool.map(check, urls))
+        
+        # Files need room in the staging area first and in output_dir in the end
+        free = min(shutil.disk_usage(self.output_dir).free, shutil.disk_usage(self.work_dir).free)
+        planned = 0
+        for item in items:
+            if item.error or item.size is None:
+                continue
+            if planned + item.size > free:
+                item.error = f"Not enough disk space ({format_size(item.size)} needed)"
+            else:
+                planned += item.size
+        
+        available = [item for item in items if item.info is not None]
+        unknown = sum(1 for item in available if item.size is None)
+        duration = sum(item.info.get('duration') or 0 for item in available)
+        log(f"\n🔎 PRE-FLIGHT CHECK")
+        log(f"Videos available: {len(available)}/{len(items)}")
+        log(f"Total size: {format_size(planned)}" + (f" (+{unknown} of unknown size)" if unknown else ""))
+        log(f"Total duration: {format_duration(duration)}")
+        log(f"Free disk space: {format_size(free)}")
+        for item in items:
+            if item.rejected:
+                log(f"  ⛔ {item.url}: {item.error}")
+        return items
+    
+    def download_single(self, url, audio_only=False, quiet=False, defer_postprocess=False):
+        """Download a single video
+        
+        With quiet=True yt-dlp output is captured instead of streamed, so
+        several downloads can run side by side without garbling the terminal.
+        Returns the DownloadResult, which is truthy on success; see
+        download() for defer_postprocess. Playlist and channel URLs are
+        expanded and their videos downloaded like a bulk list.
+        """
+        if is_collection_url(url):
+            summary = self.download_bulk(url, audio_only, lines=[url])
+            ok = bool(summary and summary.total) and not summary.failed_urls
+            return DownloadResult(url, ok, None if ok else 'Some videos of the list failed')
+        
+        path = self.archived_path(url, audio_only)
+        if path:
+            if not quiet:
+                print(f"📚 Already downloaded: {path}")
+            return DownloadResult(url, True, path=path)
+        
+        if not quiet:
+            print(f"\n📥 Downloading: {url}")
+            print(f"Quality: {self.quality if not audio_only else 'Audio Only'}")
+            print(f"Output: {self.output_dir}")
+        
+        on_progress = None
+        if quiet:
+            # Parallel downloads only announce their post-processing steps
+            def on_progress(event):
+                if event.phase in (ProgressEvent.PHASE_MERGE, ProgressEvent.PHASE_EXTRACT_AUDIO):
+                    print(f"⚙️  {event.phase.replace('_', ' ').capitalize()}: {url}")
+        
+        if self.engine:
+            try:
+                result = asyncio.run(self.engine.download(url, audio_only, on_line=(lambda line: None) if quiet else None,
+                                                          on_progress=on_progress))
+            except KeyboardInterrupt:
+                print("\n⚠️  Download cancelled by user")
+                result = DownloadResult(url, False, 'Cancelled by user')
+        else:
+            result = self.download(url, audio_only, on_line=(lambda line: None) if quiet else None,
+                                   on_progress=on_progress, defer_postprocess=defer_postprocess)
+        if result:
+            if result.postprocess:
+                if not quiet:
+                    print("⏳ Downloaded, waiting for post-processing")
+            elif not quiet:
+                print("✅ Download completed!")
+        else:
+            print(f"❌ Download failed: {result.error}")
+        return result
+    
+    def download(self, url, audio_only=False, on_line=None, should_stop=None, on_progress=None,
+                 defer_postprocess=False):
+        """Download url with the selected backend and return a DownloadResult
+        
+        on_progress receives ProgressEvents, throttled to progress_interval
+        seconds. Metadata already in the cache is handed to the backend so
+        the video is not extracted a second time; freshly extracted metadata
+        is stored. Phase times, bytes and retries are added to self.metrics
+        and finished files to the download archive, after moving them out
+        of the staging area when one is configured.
+        With defer_postprocess=True the ffmpeg step is not run: the raw
+        streams are downloaded and result.postprocess holds the
+        PostProcessJob that finishes the file.
+        """
+        video_id = video_id_from_url(url)
+        info_file = None
+        if self.metadata_cache and video_id:
+            info_file = self.metadata_cache.lookup(video_id)
+        timer = DownloadTimer(self.metrics, on_progress)
+        reporter = ProgressReporter(url, timer, self.progress_interval)
+        on_line = on_line or print
+        paths = []
+        
+        def forward_line(line):
+            timer.on_line(line)
+            path = output_path(line)
+            if path:
+                paths.append(path)
+            on_line(line)
+        
+        self.metrics.inc('downloads_started_total')
+        self.metrics.inc('active_downloads')
+        self.governor.start()
+        result = DownloadResult(url, False, 'Cancelled by user')
+        try:
+            streams = None
+            streams_checked = (defer_postprocess or self.connections_for(audio_only) > 1
+                               or (audio_only and self.lossless_audio))
+            if streams_checked:
+                streams = self.download_streams(url, audio_only, forward_line, should_stop, reporter,
+                                                defer_postprocess=defer_postprocess)
+            if streams is not None:
+                result = streams
+            else:
+                if streams_checked and not info_file and self.metadata_cache and video_id:
+                    # download_streams already fetched the metadata
+                    info_file = self.metadata_cache.lookup(video_id, count=False)
+                result = self.backend.download(
+                    url, audio_only, on_line=forward_line, should_stop=should_stop, info_file=info_file,
+                    reporter=reporter
+                )
+        except KeyboardInterrupt:
+            print("\n⚠️  Download cancelled by user")
+            return result
+        finally:
+            self.governor.finish()
+            self.metrics.inc('active_downloads', -1)
+            self.metrics.inc('downloads_succeeded_total' if result else 'downloads_failed_total')
+            timer.finish()
+        if result and not result.postprocess:
+            reporter.finish()
+            if not result.path and paths:
+                result.path = Path(paths[-1])
+            result = self.finalize_result(result)
+            if result:
+                self.archive_download(url, audio_only, result.path, result.info)
+        elif result:
+            result.postprocess.on_success = lambda path: self.archive_download(url, audio_only, path)
+        
+        if self.metadata_cache and not info_file:
+            if result.info and result.info.get('id'):
+                self.metadata_cache.put(result.info['id'], result.info)
+            elif video_id:
+                self.metadata_cache.register(video_id)
+        return result
+    
+    def part_path(self, info, fmt):
+        """Where the raw stream of one format is kept until post-processing"""
+        return self.work_dir / '.parts' / f"{info['id']}.f{fmt['format_id']}.{fmt['ext']}"
+    
+    def audio_plan(self, fmt):
+        """(extension, copy) for turning audio format fmt into the final file
+        
+        copy is true when the source codec can be kept and only the
+        container changes: it already is the codec of audio_format, or
+        lossless_audio (or audio_format 'best') accepts it as it is.
+        """
+        codec = audio_codec(fmt)
+        if codec in AUDIO_CODEC_EXTENSIONS and (self.lossless_audio or self.audio_format == 'best'):
+            return AUDIO_CODEC_EXTENSIONS[codec], True
+        ext = {'aac': 'm4a', 'vorbis': 'ogg'}.get(self.audio_format, self.audio_format)
+        if self.audio_format == 'best':
+            return fmt.get('ext', 'm4a'), False
+        return ext, codec is not None and AUDIO_FORMAT_CODECS.get(self.audio_format) == codec
+    
+    def final_path(self, info, formats, audio_only=False):
+        """Where download_streams writes the finished file, before finalize()"""
+        if self.sharded:
+            title = sanitize_filename(info['id'])
+        else:
+            title = sanitize_filename(info.get('title') or info.get('id') or 'video')
+        if audio_only:
+            ext = self.audio_plan(formats[0])[0]
+        else:
+            ext = 'mp4' if len(formats) > 1 else formats[0].get('ext', 'mp4')
+        return self.work_dir / f"{title}.{ext}"
+    
+    def download_streams(self, url, audio_only, on_line, should_stop=None, reporter=None,
+                         defer_postprocess=False):
+        """Download the selected formats of url as separate raw streams
+        
+        Plain HTTP(S) formats of known size are fetched with RangeDownloader
+        over parallel byte-range connections; otherwise, when the ffmpeg
+        step is deferred, the backend downloads the formats without
+        post-processing. The merge or audio extraction then runs inline, or
+        is returned as result.postprocess with defer_postprocess=True.
+        Returns None when the backend should handle the whole download
+        (DASH/HLS fragments, unknown sizes, servers without range support).
+        """
+        try:
+            # download() has counted this video's cache lookup already
+            info = self.extract_info(url, count=False)
+        except (RuntimeError, subprocess.SubprocessError, OSError):
+            return None
+        formats = select_formats(info, self.quality, audio_only)
+        if not formats or not info.get('id') or any(not fmt.get('format_id') for fmt in formats):
+            return None
+        needs_ffmpeg = audio_only or len(formats) > 1
+        if needs_ffmpeg and not shutil.which('ffmpeg'):
+            return None
+        connections = self.connections_for(audio_only)
+        ranged = connections > 1 and all(
+            fmt.get('protocol') in ('http', 'https') and fmt.get('filesize') and fmt.get('url')
+            for fmt in formats
+        )
+        if not ranged and not ((defer_postprocess or self.lossless_audio) and needs_ffmpeg):
+            return None
+        
+        target = self.final_path(info, formats, audio_only)
+        # A staged file that exists is complete, only its move was interrupted
+        for path in dict.fromkeys((self.library_path(target.name), target)):
+            if path.exists():
+                on_line(f"[download] {path} has already been downloaded")
+                return DownloadResult(url, True, path=path)
+        parts = [self.part_path(info, fmt) if needs_ffmpeg else target for fmt in formats]
+        
+        if ranged:
+            for fmt, part in zip(formats, parts):
+                part.parent.mkdir(parents=True, exist_ok=True)
+                on_line(f"[download] Destination: {part}")
+                last_line = [0.0]
+                
+                def on_progress(received, size, part=part, last_line=last_line):
+                    if reporter:
+                        reporter.feed_hook({
+                            'status': 'downloading', 'downloaded_bytes': received,
+                            'total_bytes': size, 'filename': str(part),
+                        })
+                    now = time.monotonic()
+                    if now - last_line[0] >= 1:
+                        last_line[0] = now
+                        on_line(f"[download] {received * 100 / size:5.1f}% of {format_size(size)} ({connections} connections)")
+                
+                fetcher = RangeDownloader(
+                    fmt['url'], part, fmt['filesize'],
+                    connections=connections,
+                    chunk_size=int(self.range_chunk_mb * 1024 * 1024),
+                    headers=fmt.get('http_headers'),
+                    governor=self.governor,
+                    should_stop=should_stop,
+                    on_progress=on_progress,
+                    retries=self.max_retries,
+                )
+                try:
+                    if not part.exists() and not fetcher.run():
+                        return DownloadResult(url, False, 'Stopped by user')
+                except RangeNotSupported:
+                    if part == parts[0]:
+                        return None
+                    return DownloadResult(url, False, 'Server stopped accepting range requests')
+                except OSError as e:
+                    return DownloadResult(url, False, f"ERROR: {e}")
+                on_line(f"[download] 100% of {format_size(fmt['filesize'])} in {connections} connections")
+                if reporter:
+                    reporter.feed_hook({'status': 'finished', 'downloaded_bytes': fmt['filesize'],
+                                        'total_bytes': fmt['filesize'], 'filename': str(part)})
+        else:
+            info_file = self.metadata_cache.lookup(info['id'], count=False) if self.metadata_cache else None
+            result = self.backend.download(
+                url, audio_only, on_line=on_line, should_stop=should_stop, info_file=info_file,
+                reporter=reporter, raw_formats=[fmt['format_id'] for fmt in formats]
+            )
+            if not result:
+                return result
+            missing = [part for part in parts if not part.exists()]
+            if missing:
+                return DownloadResult(url, False, f"ERROR: Stream not found after download: {missing[0]}")
+        
+        if not needs_ffmpeg:
+            return DownloadResult(url, True, path=target)
+        job = PostProcessJob(url, parts, target,
+                             audio_format=self.audio_format if audio_only else None,
+                             audio_quality=self.audio_quality,
+                             copy_audio=audio_only and self.audio_plan(formats[0])[1],
+                             duration=info.get('duration'),
+                             metrics=self.metrics)
+        job.finalize = self.finalize
+        if defer_postprocess:
+            return DownloadResult(url, True, postprocess=job)
+        on_line(job.describe())
+        if reporter:
+            reporter.feed_postprocessor_hook({'status': 'started', 'postprocessor': job.postprocessor})
+        return job.run()
+    
+    def iter_progress(self, url, audio_only=False, should_stop=None):
+        """Download url in the background, yielding its ProgressEvents
         
-        format_string = self.get_format_string(self.quality, audio_only)
+        The DownloadResult is yielded last.
+        """
+        events = queue.Queue()
+        
+        def run():
+            result = self.download(url, audio_only, on_line=lambda line: None,
+                                   should_stop=should_stop, on_progress=events.put)
+            events.put(result)
+        
+        threading.Thread(target=run, daemon=True).start()
+        while True:
+            event = events.get()
+            yield event
+            if isinstance(event, DownloadResult):
+                return
+    
+    def extract_info(self, url, timeout=30, count=True):
+        """Fetch the metadata of url without downloading it, using the cache when possible
+        
+        count=False keeps the lookup out of the cache statistics.
+        """
+        video_id = video_id_from_url(url)
+        if self.metadata_cache and video_id:
+            info = self.metadata_cache.get(video_id, count)
+            if info is not None:
+                return info
+        info = self.backend.extract_info(url, timeout=timeout)
+        if self.metadata_cache and info.get('id'):
+            self.metadata_cache.put(info['id'], info)
+        return info
+    
+    def build_command(self, url, audio_only=False, info_file=None, raw_formats=None, rate=None):
+        """yt-dlp command line used by the subprocess backend
+        
+        With raw_formats the listed format IDs are saved as separate files
+        under .parts for a later PostProcessJob, without merging or audio
+        extraction.
+        """
+        format_string = ','.join(raw_formats) if raw_formats else self.get_format_string(self.quality, audio_only)
         
         cmd = [
             'yt-dlp',
             '-f', format_string,
-            '-o', str(self.output_dir / '%(title)s.%(ext)s'),
+            '-o', str(self.output_template(raw=bool(raw_formats))),
             '--no-overwrites',
             '--continue',
             '--ignore-errors',
@@ -71,77 +3167,395 @@ class YouTubeDownloader:
             '--retries', str(self.max_retries),
         ]
         
-        if audio_only:
+        if rate:
+            cmd.extend(['--limit-rate', str(int(rate))])
+        
+        connections = self.connections_for(audio_only)
+        if connections > 1:
+            # DASH/HLS videos fetch this many fragments at once
+            cmd.extend(['--concurrent-fragments', str(connections)])
+        
+        if raw_formats:
+            cmd = [c for c in cmd if c not in ('--merge-output-format', 'mp4')]
+        elif audio_only:
             # Remove merge-output-format for audio
             cmd = [c for c in cmd if c not in ('--merge-output-format', 'mp4')]
             cmd.extend([
                 '-x',
-                '--audio-format', self.audio_format,
+                '--audio-format', 'best' if self.lossless_audio else self.audio_format,
                 '--audio-quality', self.audio_quality,
             ])
         
+        if info_file:
+            cmd.extend(['--load-info-json', str(info_file)])
+            return cmd
+        
+        if self.metadata_cache:
+            # Let yt-dlp drop the metadata it extracts straight into the cache
+            cmd.extend([
+                '--write-info-json',
+                '--no-write-playlist-metafiles',
+                '-o', f"infojson:{self.metadata_cache.cache_dir / '%(id)s.%(ext)s'}",
+            ])
+        
         cmd.append(url)
+        return cmd
+    
+    def output_template(self, raw=False):
+        if raw:
+            return self.work_dir / '.parts' / '%(id)s.f%(format_id)s.%(ext)s'
+        if self.sharded:
+            # Moved into its shard folder by finalize()
+            return self.work_dir / '%(id)s.%(ext)s'
+        return self.work_dir / '%(title)s.%(ext)s'
+    
+    def build_params(self, audio_only=False, logger=None, raw=False):
+        """YoutubeDL options equivalent to build_command, for the in-process backend"""
+        params = {
+            'format': self.get_format_string(self.quality, audio_only),
+            'outtmpl': str(self.output_template(raw)),
+            'overwrites': False,
+            'continuedl': True,
+            'no_warnings': True,
+            'progress_with_newline': True,
+            'retries': self.max_retries,
+            'socket_timeout': 30,
+            'logger': logger,
+            'concurrent_fragment_downloads': self.connections_for(audio_only),
+        }
+        if raw:
+            # Streams stay separate for a PostProcessJob
+            return params
+        if audio_only:
+            params['postprocessors'] = [{
+                'key': 'FFmpegExtractAudio',
+                'preferredcodec': 'best' if self.lossless_audio else self.audio_format,
+                'preferredquality': self.audio_quality,
+            }]
+        else:
+            params['merge_output_format'] = 'mp4'
+        return params
+    
+    def host_slot(self, url):
+        """Semaphore limiting concurrent downloads against the URL's host"""
+        host = host_key(url)
+        with self._host_slots_lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = threading.BoundedSemaphore(max(1, self.max_per_host))
+            return self._host_slots[host]
+    
+    def expand_urls(self, lines, on_error=None, depth=2, sync=None):
+        """Yield the lines of a URL list with playlists and channels replaced by their videos
         
+        Entries are yielded as soon as the backend lists them, so downloads
+        overlap with enumeration. Collections inside collections (channel
+        tabs) are expanded up to depth levels. When a collection cannot be
+        listed on_error(url, error) is called (default: print). With sync
+        (SyncWatermarks) only videos new since the last sync are yielded.
+        """
+        expanded = set()
+        for line in lines:
+            canonical = canonicalize_url(line)
+            if canonical is None or not is_collection_url(canonical[1]):
+                yield line
+                continue
+            key, url = canonical
+            if key in expanded:
+                continue
+            expanded.add(key)
+            yield from self._expand_collection(url, on_error, depth, sync)
+    
+    def _expand_collection(self, url, on_error, depth, sync=None):
+        entries = listing = self.backend.iter_entries(url)
+        if sync:
+            entries = sync.open(url).filter(listing)
         try:
-            subprocess.run(cmd, check=True)
-            print("✅ Download completed!")
-            return True
-        except subprocess.CalledProcessError as e:
-            print(f"❌ Download failed: {e}")
-            return False
-        except KeyboardInterrupt:
-            print("\n⚠️  Download cancelled by user")
-            return False
+            for entry in entries:
+                if depth > 0 and is_collection_url(entry):
+                    yield from self._expand_collection(entry, on_error, depth - 1, sync)
+                else:
+                    yield entry
+        except (RuntimeError, OSError) as e:
+            if on_error:
+                on_error(url, str(e))
+            else:
+                print(f"❌ Could not list {url}: {e}")
+        finally:
+            # Ends the listing right away when a sync stopped at a known video
+            listing.close()
+    
+    def start_metrics(self, port=None, snapshot_file=None):
+        """Expose self.metrics on a local port and/or in a JSON file that is rewritten periodically
+        
+        Returns the running MetricsServer, or None when neither is wanted.
+        """
+        port = port if port is not None else self.metrics_port
+        snapshot_file = snapshot_file or self.metrics_file
+        if port is None and not snapshot_file:
+            return None
+        return MetricsServer(self.metrics, port, snapshot_file, self.metrics_interval).start()
+    
+    def retry_queue(self):
+        """New RetryQueue configured from retry_attempts and retry_backoff"""
+        return RetryQueue(self.retry_attempts, self.retry_backoff, self.retry_backoff_max)
+    
+    def finish_download(self, url, ok, summary, retries, journal=None, log=print):
+        """Record the outcome of one attempt of a bulk download
+        
+        Transient failures go back to retries while attempts are left;
+        everything else is final and recorded with its reason code.
+        """
+        try:
+            reason = None
+            error = getattr(ok, 'error', None)
+            if not ok:
+                reason, kind = classify_failure(error)
+                delay = retries.defer(url) if kind == TRANSIENT else None
+                if delay is not None:
+                    if journal:
+                        journal.record(url, 'deferred', error)
+                    log(f"⏳ {url} ({reason}), retrying in {delay:.0f}s")
+                    return
+            if journal:
+                journal.record(url, 'done' if ok else 'failed', error)
+            done = summary.record(url, ok, reason)
+            log(f"[{summary.progress(done)}] {'✅' if ok else '❌'} {url}" + (f" ({reason})" if reason else ""))
+        finally:
+            retries.done()
+    
+    def run_bulk(self, urls, download_fn, should_stop=None, log=print, journal=None, summary=None,
+                 postprocessor=None):
+        """Run download_fn over urls with a pool of worker threads
+        
+        urls may be any iterable, including a generator over a huge file:
+        it is consumed into a bounded queue, so downloads start on the first
+        URL and memory stays flat. download_fn(url) returns True on success.
+        Results carrying a PostProcessJob are handed to postprocessor (a
+        PostProcessPool) and the worker moves on to the next download; they
+        count as done once post-processing finished. Transient failures
+        (throttling, server errors) are retried with backoff once every
+        URL has been queued. Every state change is recorded in journal
+        when one is given. Returns the BulkSummary once every URL has been
+        processed or should_stop() became true.
+        """
+        summary = summary or BulkSummary()
+        retries = self.retry_queue()
+        workers = max(1, self.concurrent_downloads)
+        work = queue.Queue(maxsize=workers * 2)
+        
+        def finish(url, ok):
+            self.finish_download(url, ok, summary, retries, journal, log)
+        
+        def worker():
+            while True:
+                url = work.get()
+                self.metrics.set('queue_depth', work.qsize())
+                if url is None:
+                    return
+                if should_stop and should_stop():
+                    retries.done()
+                    continue
+                with self.host_slot(url):
+                    if journal:
+                        journal.record(url, 'running')
+                    try:
+                        ok = download_fn(url)
+                    except Exception as e:
+                        log(f"❌ Error: {url}: {e}")
+                        ok = DownloadResult(url, False, f"ERROR: {e}")
+                job = getattr(ok, 'postprocess', None)
+                if ok and job and postprocessor:
+                    if journal:
+                        journal.record(url, 'postprocessing')
+                    postprocessor.submit(job, lambda result, url=url: finish(url, result))
+                    continue
+                finish(url, ok)
+        
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        try:
+            for url in urls:
+                if should_stop and should_stop():
+                    break
+                if journal:
+                    journal.record(url, 'queued')
+                summary.added()
+                retries.started()
+                work.put(url)
+                self.metrics.set('queue_depth', work.qsize())
+            summary.ingest_done = True
+            for url in retries.drain(should_stop):
+                log(f"🔁 Retrying {url}")
+                work.put(url)
+        finally:
+            summary.ingest_done = True
+            summary.retried = len(retries.failures)
+            for _ in threads:
+                work.put(None)
+            for thread in threads:
+                thread.join()
+            if postprocessor:
+                postprocessor.join()
+        return summary
     
-    def download_bulk(self, file_path, audio_only=False):
-        """Download multiple videos from a text file"""
-        file_path = Path(file_path)
+    def download_bulk(self, file_path, audio_only=False, resume=False, preflight=False, lines=None, sync=False):
+        """Download multiple videos from a text file
         
-        if not file_path.exists():
+        Progress is journaled in the output folder; with resume=True URLs
+        that completed in an earlier run are skipped without touching the
+        network and interrupted ones continue from their partial files.
+        With preflight=True the whole list is checked for availability and
+        disk space first, and rejected videos are not attempted. Videos
+        already in the download archive are skipped before any network
+        request. Playlists and channels are expanded into their videos
+        while downloading; with sync=True only their videos that are new
+        since the last sync are listed and downloaded (see
+        SyncWatermarks). lines replaces the contents of file_path when
+        given. Returns the BulkSummary.
+        """
+        if lines is None and str(file_path) != '-' and not Path(file_path).exists():
             print(f"❌ File not found: {file_path}")
-            return
+            return None
         
-        with open(file_path, 'r', encoding='utf-8') as f:
-            urls = [line.strip() for line in f if line.strip() and line.strip().startswith('http')]
+        dedupe = UrlDeduplicator()
+        journal = JobJournal(self.output_dir / '.download_journal.sqlite')
+        completed = set()
+        if resume:
+            completed = journal.completed()
+        else:
+            journal.reset()
+        resumed = 0
+        archived = 0
         
-        if not urls:
-            print("❌ No valid URLs found in file")
-            return
+        summary = BulkSummary()
+        watermarks = None
+        if sync:
+            watermarks = SyncWatermarks(self.output_dir / '.sync_watermarks.sqlite')
+            summary.on_record = watermarks.record
+        
+        def listing_failed(url, error):
+            print(f"❌ Could not list {url}: {error}")
+            summary.added()
+            summary.record(url, False, classify_failure(error)[0])
+            journal.record(url, 'failed', error)
+        
+        def skipped_archived(url):
+            nonlocal archived
+            archived += 1
+            if watermarks:
+                watermarks.record(url, True)
+        
+        def pending_urls():
+            nonlocal resumed
+            source = iter_url_lines(file_path) if lines is None else lines
+            urls = dedupe.filter(self.expand_urls(source, on_error=listing_failed, sync=watermarks))
+            for url in self.skip_archived(urls, audio_only, on_skip=skipped_archived):
+                if url in completed:
+                    resumed += 1
+                    continue
+                yield url
         
-        print(f"\n📋 Found {len(urls)} URLs to download")
+        workers = max(1, self.concurrent_downloads)
+        if lines is not None:
+            print(f"\n📋 Listing videos of {file_path}")
+        else:
+            print(f"\n📋 Reading URLs from {'stdin' if str(file_path) == '-' else file_path}")
         print(f"Quality: {self.quality if not audio_only else 'Audio Only'}")
-        print(f"Output: {self.output_dir}\n")
+        print(f"Output: {self.output_dir}")
+        print(f"Parallel downloads: {workers} (max {self.max_per_host} per host)")
+        if self.schedule_policy != 'fifo':
+            print(f"Scheduling: {self.schedule_policy}" + ("" if preflight else f" (windows of {self.schedule_window})"))
+        print()
         
-        success_count = 0
-        failed_urls = []
+        if lines is None:
+            summary.count_in_background(file_path)
+        urls = pending_urls()
+        window = None
+        if preflight:
+            items = self.preflight(list(urls), audio_only)
+            for item in items:
+                if item.rejected:
+                    summary.added()
+                    summary.record(item.url, False, classify_failure(item.error)[0])
+                    journal.record(item.url, 'failed', item.error)
+            urls = [item.url for item in items if not item.rejected]
+            # The whole list is known now, order it at once
+            window = len(urls)
+        urls = self.schedule(urls, audio_only, dedupe.priorities, window)
         
-        for i, url in enumerate(urls, 1):
-            print(f"\n{'='*60}")
-            print(f"Progress: {i}/{len(urls)}")
-            print(f"{'='*60}")
-            
-            if self.download_single(url, audio_only):
-                success_count += 1
+        # A single worker keeps the familiar live yt-dlp output
+        quiet = workers > 1
+        postprocessor = None
+        if self.engine:
+            print(f"⚡ Engine: asyncio, all downloads on one event loop\n")
+        elif self.pipeline_postprocessing and shutil.which('ffmpeg'):
+            postprocessor = PostProcessPool(self.postprocess_workers, self.postprocess_queue, self.metrics)
+            print(f"⚙️  Post-processing: {postprocessor.workers} ffmpeg workers alongside the downloads\n")
+        try:
+            if self.engine:
+                try:
+                    asyncio.run(self.engine.run_bulk(urls, audio_only, journal=journal, summary=summary, quiet=quiet))
+                except KeyboardInterrupt:
+                    # Every running yt-dlp process has been terminated already
+                    print("\n⚠️  Bulk download cancelled by user")
             else:
-                failed_urls.append(url)
+                self.run_bulk(
+                    urls,
+                    lambda url: self.download_single(url, audio_only, quiet=quiet,
+                                                     defer_postprocess=postprocessor is not None),
+                    journal=journal,
+                    summary=summary,
+                    postprocessor=postprocessor,
+                )
+        finally:
+            if postprocessor:
+                postprocessor.close()
+            journal.close()
+            if watermarks:
+                watermarks.save(lambda video_id: self.cached_info(video_id).get('upload_date'))
+                watermarks.close()
+        
+        if resumed:
+            print(f"\n⏩ Resumed: {resumed} URLs already completed in an earlier run")
+        if archived:
+            print(f"\n📚 Already in the download archive: {archived} videos")
+        if watermarks:
+            print(f"\n🔖 Sync: {watermarks.new} new videos listed, "
+                  f"{watermarks.avoided} extraction calls avoided for videos known from earlier syncs")
+        if not summary.total:
+            print("✅ Nothing left to download" if resumed or archived or watermarks else "❌ No valid URLs found in file")
+            return summary
         
         # Summary
         print(f"\n{'='*60}")
         print(f"📊 DOWNLOAD SUMMARY")
         print(f"{'='*60}")
-        print(f"✅ Successful: {success_count}/{len(urls)}")
-        print(f"❌ Failed: {len(failed_urls)}/{len(urls)}")
+        print(f"✅ Successful: {summary.success_count}/{summary.total}")
+        print(f"❌ Failed: {len(summary.failed_urls)}/{summary.total}")
+        if summary.retried:
+            print(f"🔁 Retried after transient errors: {summary.retried}")
+        if dedupe.duplicates:
+            print(f"♻️  Duplicate downloads saved: {dedupe.duplicates}")
+        if self.metadata_cache:
+            stats = self.metadata_cache.stats()
+            print(f"🗂️  Metadata cache: {stats['hits']} hits, {stats['misses']} misses")
+        fast_path = self.metrics.values['audio_fast_path_total']
+        if fast_path:
+            print(f"🎵 Audio kept without re-encoding: {fast_path} "
+                  f"(transcoded: {self.metrics.values['audio_transcoded_total']}, "
+                  f"~{self.metrics.audio_cpu_saved():.1f}s CPU time saved)")
         
-        if failed_urls:
+        if summary.failed_urls:
             print(f"\n❌ Failed URLs:")
-            for url in failed_urls:
-                print(f"  - {url}")
+            for url in summary.failed_urls:
+                print(f"  - {summary.describe_failed(url)}")
             
             # Save failed URLs to file
             failed_file = self.output_dir / 'failed_urls.txt'
-            with open(failed_file, 'w', encoding='utf-8') as f:
-                f.write('\n'.join(failed_urls))
+            summary.save_failed(failed_file)
             print(f"\n💾 Failed URLs saved to: {failed_file}")
+        return summary
 
 def main():
     parser = argparse.ArgumentParser(
@@ -160,38 +3574,161 @@ Examples:
   
   Specify quality:
     python downloader.py --url "VIDEO_URL" --quality 720p
+  
+  Bulk download from another program's output:
+    cat urls.txt | python downloader.py --file -
+  
+  Bulk download with 8 parallel downloads:
+    python downloader.py --file urls.txt --workers 8
+  
+  Download short videos first so results arrive early:
+    python downloader.py --file urls.txt --schedule shortest
+  
+  Re-download archived files that went missing or got corrupted:
+    python downloader.py --verify-archive
+  
+  Fetch only the videos a channel uploaded since the last sync:
+    python downloader.py --url "https://www.youtube.com/@channel" --sync
+  
+  Find downloaded files by video ID or title without scanning the folder:
+    python downloader.py --find "never gonna"
+  
+  Downloads are handed to daemon.py when it is running; force a local run:
+    python downloader.py --url "VIDEO_URL" --no-daemon
         """
     )
     
     parser.add_argument('--url', help='YouTube video URL')
-    parser.add_argument('--file', help='Text file with multiple URLs (one per line)')
+    parser.add_argument('--file', help='Text file with multiple URLs (one per line), or - to read stdin')
     parser.add_argument('--quality', choices=['360p', '480p', '720p', '1080p', '1440p', '2160p'], 
                        default='1080p', help='Video quality (default: 1080p, supports up to 4K)')
     parser.add_argument('--audio-only', action='store_true', help='Download audio only (MP3)')
     parser.add_argument('--output', default='./downloads', help='Output directory (default: ./downloads)')
+    parser.add_argument('--backend', choices=['auto', *BACKENDS],
+                       help='Download engine: in-process yt_dlp API or one yt-dlp process per URL (default: auto)')
+    parser.add_argument('--engine', choices=ENGINES,
+                       help='Run downloads on worker threads or as asyncio tasks that stop instantly on Ctrl+C (default: engine in config.json)')
+    parser.add_argument('--resume', action='store_true',
+                       help='Continue an interrupted bulk download, skipping URLs that already finished')
+    parser.add_argument('--preflight', action='store_true',
+                       help='Check availability, total size and free disk space of a bulk list before downloading')
+    parser.add_argument('--limit-rate', help='Total bandwidth for all downloads, e.g. 500K or 5M (default: bandwidth_limit in config.json)')
+    parser.add_argument('--no-cache', action='store_true', help='Bypass the metadata cache for this run')
+    parser.add_argument('--purge-cache', action='store_true', help='Delete all cached video metadata')
+    parser.add_argument('--workers', type=int, help='Parallel downloads for bulk mode (default: concurrent_downloads in config.json)')
+    parser.add_argument('--connections', type=int,
+                       help='Parallel connections for each video: byte ranges or DASH/HLS fragments (default: parallel_connections in config.json)')
+    parser.add_argument('--lossless-audio', action='store_true',
+                       help='With --audio-only, keep AAC/Opus/Vorbis/MP3/FLAC sources as they are instead of converting to MP3')
+    parser.add_argument('--no-pipeline', action='store_true',
+                       help='Merge/convert inside each download instead of in a separate post-processing stage')
+    parser.add_argument('--metrics-port', type=int, help='Serve Prometheus metrics on http://127.0.0.1:PORT/metrics')
+    parser.add_argument('--metrics-file', help='Periodically write a JSON snapshot of the metrics to this file')
+    parser.add_argument('--schedule', choices=SCHEDULE_POLICIES,
+                       help='Order of bulk downloads: list order, shortest or largest first, priority:N tags, '
+                            'or large and small mixed (default: schedule_policy in config.json)')
+    parser.add_argument('--verify-archive', action='store_true',
+                       help='Check the size and hash of every archived download and download missing or corrupt files again')
+    parser.add_argument('--sync', action='store_true',
+                       help='Only list and download playlist/channel videos that are new since the last --sync run')
+    parser.add_argument('--find', nargs='?', const='', metavar='QUERY',
+                       help='List archived downloads whose video ID or title matches QUERY (all without QUERY)')
+    parser.add_argument('--no-daemon', action='store_true',
+                       help='Download in this process even when the downloader daemon is running')
     
     args = parser.parse_args()
     
-    # Check if yt-dlp is installed
-    try:
-        subprocess.run(['yt-dlp', '--version'], capture_output=True, check=True)
-    except (subprocess.CalledProcessError, FileNotFoundError):
-        print("❌ yt-dlp is not installed!")
-        print("Please run the installer script first:")
-        print("  Windows: install.bat")
-        print("  Linux/Mac: ./install.sh")
-        sys.exit(1)
-    
-    if not args.url and not args.file:
+    if not args.url and not args.file and not args.purge_cache and not args.verify_archive and args.find is None:
         parser.print_help()
         sys.exit(1)
     
+    # Hand plain downloads to a running daemon instead of starting cold;
+    # options that change how this process downloads keep the run local
+    local_only = any([
+        args.no_daemon, args.backend, args.engine, args.resume, args.verify_archive, args.find is not None,
+        args.sync, args.schedule, args.preflight, args.limit_rate, args.no_cache,
+        args.purge_cache, args.workers, args.connections, args.lossless_audio, args.no_pipeline,
+        args.metrics_port, args.metrics_file,
+    ])
+    if not local_only:
+        from daemon import DaemonClient, run_client
+        client = DaemonClient.connect()
+        if client:
+            run_client(client, args.url, args.file, args.audio_only, args.quality, args.output)
+            return
+    
     downloader = YouTubeDownloader(output_dir=args.output, quality=args.quality)
+    if args.purge_cache:
+        downloader.metadata_cache.purge()
+        print(f"🧹 Metadata cache purged: {downloader.metadata_cache.cache_dir}")
+        if not args.url and not args.file and not args.verify_archive:
+            return
+    if args.find is not None:
+        downloader.find_downloads(args.find)
+        return
+    if args.no_cache:
+        downloader.metadata_cache = None
+    if args.backend:
+        try:
+            downloader.select_backend(args.backend)
+        except ImportError:
+            print("❌ The yt_dlp Python module is not installed!")
+            sys.exit(1)
+    if args.engine:
+        downloader.select_engine(args.engine)
+    
+    # Check if yt-dlp is installed
+    if downloader.backend.name == SubprocessBackend.name or downloader.engine:
+        try:
+            subprocess.run(['yt-dlp', '--version'], capture_output=True, check=True)
+        except (subprocess.CalledProcessError, FileNotFoundError):
+            print("❌ yt-dlp is not installed!")
+            print("Please run the installer script first:")
+            print("  Windows: install.bat")
+            print("  Linux/Mac: ./install.sh")
+            sys.exit(1)
+    
+    if args.workers:
+        downloader.concurrent_downloads = args.workers
+    if args.schedule:
+        downloader.schedule_policy = args.schedule
+    if args.connections:
+        downloader.connections = args.connections
+    if args.no_pipeline:
+        downloader.pipeline_postprocessing = False
+    if args.lossless_audio:
+        downloader.lossless_audio = True
+    if args.limit_rate:
+        try:
+            downloader.governor.set_limit(args.limit_rate)
+        except ValueError as e:
+            print(f"❌ {e}")
+            sys.exit(1)
     
-    if args.url:
-        downloader.download_single(args.url, args.audio_only)
-    elif args.file:
-        downloader.download_bulk(args.file, args.audio_only)
+    try:
+        metrics_server = downloader.start_metrics(args.metrics_port, args.metrics_file)
+    except OSError as e:
+        print(f"❌ Could not start the metrics endpoint: {e}")
+        sys.exit(1)
+    if metrics_server and metrics_server.httpd:
+        host, port = metrics_server.httpd.server_address[:2]
+        print(f"📈 Metrics: http://{host}:{port}/metrics")
+    
+    try:
+        if args.verify_archive:
+            broken = downloader.verify_archive(args.audio_only)
+            if broken:
+                downloader.download_bulk(downloader.archive.path, args.audio_only, lines=broken)
+        if args.url and args.sync:
+            downloader.download_bulk(args.url, args.audio_only, lines=[args.url], sync=True)
+        elif args.url:
+            downloader.download_single(args.url, args.audio_only)
+        elif args.file:
+            downloader.download_bulk(args.file, args.audio_only, resume=args.resume, preflight=args.preflight,
+                                     sync=args.sync)
+    finally:
+        if metrics_server:
+            metrics_server.stop()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
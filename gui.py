@@ -8,11 +8,24 @@ import tkinter as tk
 from tkinter import ttk, filedialog, scrolledtext, messagebox
 from pathlib import Path
 import threading
+import concurrent.futures
+import collections
+import itertools
 import sys
 import os
 
 # Import downloader
-from downloader import YouTubeDownloader
+from downloader import (
+    YouTubeDownloader, UrlDeduplicator, BulkSummary, ProgressEvent, EventLoopThread, iter_url_lines,
+    is_collection_url, estimate_download_size, format_size, format_duration, parse_rate, classify_failure,
+)
+from daemon import DaemonClient
+
+# Log lines are rendered in batches on a fixed timer and the widget keeps
+# only the most recent ones
+LOG_FRAME_MS = 100
+MAX_LOG_LINES = 2000
+
 
 class DownloaderGUI:
     def __init__(self, root):
@@ -28,9 +41,29 @@ class DownloaderGUI:
         self.audio_only_var = tk.BooleanVar(value=False)
         self.output_var = tk.StringVar(value="./downloads")
         self.video_size_var = tk.StringVar(value="Size: N/A")
+        self.limit_var = tk.StringVar(value="")
+        self.active_downloader = None
+        # Set while a download runs on the daemon; the speed limit goes there
+        self.active_client = None
+        # Kept for "Get Video Size", so its backend and metadata cache stay warm
+        self.info_downloader = None
+        self.info_lock = threading.Lock()
         self.is_downloading = False
+        # Shared by every download when the asyncio engine is configured
+        self.event_loop = None
+        self.active_future = None
+        
+        # Pending log lines as (key, message); key is set for progress lines
+        # that should overwrite the previous line of the same download. Lines
+        # beyond what the widget keeps would be trimmed anyway, so the oldest
+        # are dropped when the GUI falls behind
+        self.log_buffer = collections.deque(maxlen=MAX_LOG_LINES)
+        self.progress_marks = {}
+        self.mark_ids = itertools.count()
+        self.latest_progress = None
         
         self.setup_ui()
+        self.root.after(LOG_FRAME_MS, self.drain_log)
         
     def setup_ui(self):
         """Setup the user interface"""
@@ -160,6 +193,13 @@ class DownloaderGUI:
         )
         get_size_btn.grid(row=3, column=0, columnspan=2, sticky=tk.W, pady=5)
         
+        # Bandwidth limit, adjustable while downloading
+        limit_frame = ttk.Frame(settings_frame)
+        limit_frame.grid(row=3, column=2, columnspan=2, sticky=tk.E, pady=5)
+        ttk.Label(limit_frame, text="Speed Limit (e.g. 5M):").pack(side=tk.LEFT)
+        ttk.Entry(limit_frame, textvariable=self.limit_var, width=8).pack(side=tk.LEFT, padx=5)
+        ttk.Button(limit_frame, text="Apply", command=self.apply_limit).pack(side=tk.LEFT)
+        
         settings_frame.columnconfigure(1, weight=1)
         
         # Log section
@@ -181,15 +221,89 @@ class DownloaderGUI:
         )
         status_bar.pack(side=tk.BOTTOM, fill=tk.X)
         
-    def log(self, message):
-        """Add message to log"""
-        self.log_text.insert(tk.END, message + "\n")
+    def log(self, message, key=None):
+        """Add message to log; safe to call from any thread
+        
+        Messages sharing a key replace each other's line instead of adding
+        new ones, which keeps per-download progress to a single line.
+        """
+        self.log_buffer.append((key, message))
+    
+    def drain_log(self):
+        """Render buffered log lines and progress, then schedule the next frame"""
+        try:
+            self.render_log()
+            if self.latest_progress is not None:
+                self.show_progress(self.latest_progress)
+                self.latest_progress = None
+        finally:
+            self.root.after(LOG_FRAME_MS, self.drain_log)
+    
+    def render_log(self):
+        """Write the buffered lines to the widget in one pass"""
+        if not self.log_buffer:
+            return
+        
+        # Coalesce the batch first: only the last progress line per key matters
+        lines = []
+        keyed = {}
+        # Only what is buffered now: lines still arriving wait for the next frame
+        for _ in range(len(self.log_buffer)):
+            key, message = self.log_buffer.popleft()
+            if key is None:
+                lines.append(message)
+                continue
+            if key in keyed:
+                lines[keyed[key]] = None
+            keyed[key] = len(lines)
+            lines.append((key, message))
+        
+        text = []
+        for line in lines:
+            if line is None:
+                continue
+            if isinstance(line, str):
+                text.append(line + "\n")
+                continue
+            key, message = line
+            mark = self.progress_marks.get(key)
+            if mark:
+                # Overwrite the download's existing progress line in place
+                self.log_text.delete(mark, f"{mark} lineend")
+                self.log_text.insert(mark, message)
+                continue
+            if text:
+                self.log_text.insert(tk.END, "".join(text))
+                text = []
+            mark = f"progress{next(self.mark_ids)}"
+            self.progress_marks[key] = mark
+            self.log_text.mark_set(mark, "end-1c linestart")
+            self.log_text.mark_gravity(mark, tk.LEFT)
+            self.log_text.insert(tk.END, message + "\n")
+        if text:
+            self.log_text.insert(tk.END, "".join(text))
+        
+        self.trim_log()
         self.log_text.see(tk.END)
-        self.root.update()
+    
+    def trim_log(self):
+        """Drop the oldest lines beyond MAX_LOG_LINES"""
+        line_count = int(self.log_text.index("end-1c").split(".")[0])
+        excess = line_count - MAX_LOG_LINES
+        if excess <= 0:
+            return
+        for key, mark in list(self.progress_marks.items()):
+            if int(self.log_text.index(mark).split(".")[0]) <= excess:
+                self.log_text.mark_unset(mark)
+                del self.progress_marks[key]
+        self.log_text.delete("1.0", f"{excess + 1}.0")
         
     def clear_log(self):
         """Clear the log"""
         self.log_text.delete(1.0, tk.END)
+        for mark in self.progress_marks.values():
+            self.log_text.mark_unset(mark)
+        self.progress_marks.clear()
     
     def clear_file(self):
         """Clear the selected file"""
@@ -200,7 +314,33 @@ class DownloaderGUI:
         if self.is_downloading:
             self.is_downloading = False
             self.status_var.set("Stopping...")
-            self.log("⚠️ Stop requested - will stop after current download")
+            future = self.active_future
+            if future:
+                # asyncio engine: running transfers are terminated right away
+                future.cancel()
+                self.log("⚠️ Stop requested - cancelling the running downloads")
+            else:
+                self.log("⚠️ Stop requested - will stop after the running downloads")
+    
+    def apply_limit(self):
+        """Apply the speed limit, including to downloads already running"""
+        limit = self.limit_var.get().strip()
+        try:
+            parse_rate(limit)
+        except ValueError as e:
+            messagebox.showerror("Invalid Limit", str(e))
+            return
+        downloader = self.active_downloader
+        if downloader:
+            downloader.governor.set_limit(limit)
+        client = self.active_client
+        if client:
+            try:
+                client.set_limit(limit or None)
+            except (OSError, RuntimeError) as e:
+                self.log(f"❌ Could not change the daemon's speed limit: {e}")
+                return
+        self.log(f"🚦 Speed limit set to {limit or 'unlimited'}")
     
     def get_video_size(self):
         """Get video size information"""
@@ -218,10 +358,9 @@ class DownloaderGUI:
     
     def fetch_video_size(self, url):
         """Fetch video size in a separate thread"""
+        import subprocess
+        
         try:
-            import subprocess
-            import json
-            
             # Get quality (handle 2K/4K labels)
             quality = self.quality_var.get()
             if "2K" in quality:
@@ -229,46 +368,26 @@ class DownloaderGUI:
             elif "4K" in quality:
                 quality = "2160p"
             
-            # Get video info using yt-dlp
-            cmd = ['yt-dlp', '--dump-json', '--no-warnings', url]
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
+            # Get video info through the downloader's backend
+            downloader = self.active_downloader or self.get_info_downloader()
+            try:
+                info = downloader.extract_info(url, timeout=30)
+            except RuntimeError:
+                info = None
             
-            if result.returncode == 0:
-                info = json.loads(result.stdout)
+            if info:
                 title = info.get('title', 'Unknown')
                 duration = info.get('duration', 0)
                 
-                # Find the best format matching quality
-                formats = info.get('formats', [])
-                target_height = int(quality.replace('p', ''))
-                
-                best_format = None
-                for fmt in formats:
-                    if fmt.get('height') == target_height and fmt.get('filesize'):
-                        best_format = fmt
-                        break
+                # Same format selection the download will use
+                filesize = estimate_download_size(info, quality, self.audio_only_var.get())
+                duration_str = format_duration(duration)
                 
-                if not best_format:
-                    # Try to find closest format with size
-                    for fmt in sorted(formats, key=lambda x: abs((x.get('height', 0) or 0) - target_height)):
-                        if fmt.get('filesize'):
-                            best_format = fmt
-                            break
-                
-                if best_format and best_format.get('filesize'):
-                    filesize = best_format['filesize']
-                    size_mb = filesize / (1024 * 1024)
-                    size_gb = size_mb / 1024
-                    
-                    if size_gb >= 1:
-                        size_str = f"{size_gb:.2f} GB"
-                    else:
-                        size_str = f"{size_mb:.2f} MB"
-                    
-                    duration_str = f"{int(duration // 60)}:{int(duration % 60):02d}"
+                if filesize:
+                    size_str = format_size(filesize)
                     self.video_size_var.set(f"📊 Size: {size_str} | Duration: {duration_str} | Title: {title[:50]}...")
                 else:
-                    self.video_size_var.set(f"📊 Size: Unavailable | Duration: {int(duration // 60)}:{int(duration % 60):02d}")
+                    self.video_size_var.set(f"📊 Size: Unavailable | Duration: {duration_str}")
             else:
                 self.video_size_var.set("❌ Failed to fetch video info")
                 
@@ -277,6 +396,13 @@ class DownloaderGUI:
         except Exception as e:
             self.video_size_var.set(f"❌ Error: {str(e)}")
         
+    def get_info_downloader(self):
+        """The window's downloader for metadata lookups, created on first use"""
+        with self.info_lock:
+            if self.info_downloader is None:
+                self.info_downloader = YouTubeDownloader(output_dir=self.output_var.get())
+            return self.info_downloader
+    
     def browse_file(self):
         """Browse for input file"""
         filename = filedialog.askopenfilename(
@@ -286,13 +412,22 @@ class DownloaderGUI:
         if filename:
             self.file_var.set(filename)
             self.url_var.set("")  # Clear URL if file is selected
-            # Show how many URLs are in the file
-            try:
-                with open(filename, 'r', encoding='utf-8') as f:
-                    urls = [line.strip() for line in f if line.strip() and line.strip().startswith('http')]
-                self.log(f"📋 Loaded {len(urls)} URLs from file")
-            except Exception as e:
-                self.log(f"❌ Error reading file: {e}")
+            # Count the URLs in the background so huge files don't freeze the window
+            thread = threading.Thread(target=self.count_file_urls, args=(filename,))
+            thread.daemon = True
+            thread.start()
+    
+    def count_file_urls(self, filename):
+        """Log how many unique URLs a file holds"""
+        try:
+            dedupe = UrlDeduplicator()
+            count = sum(1 for _ in dedupe.filter(iter_url_lines(filename)))
+            self.log(f"📋 Loaded {count} URLs from file")
+            if dedupe.duplicates:
+                self.log(f"♻️ {dedupe.duplicates} duplicate URLs will be skipped")
+        except Exception as e:
+            err_msg = str(e)
+            self.log(f"❌ Error reading file: {err_msg}")
             
     def browse_output(self):
         """Browse for output folder"""
@@ -332,19 +467,31 @@ class DownloaderGUI:
             elif "4K" in quality:
                 quality = "2160p"
             
-            downloader = YouTubeDownloader(
-                output_dir=self.output_var.get(),
-                quality=quality
-            )
-            
-            if url:
-                self.log(f"🎬 Starting download: {url}")
-                self.log(f"📊 Quality: {quality}")
-                self.download_with_logging(downloader, url, self.audio_only_var.get())
-            elif file:
-                self.log(f"📋 Starting bulk download from: {file}")
-                self.log(f"📊 Quality: {quality}")
-                self.bulk_download_with_logging(downloader, file, self.audio_only_var.get())
+            # A running daemon already has a warm downloader and takes the job
+            client = DaemonClient.connect()
+            if client:
+                self.daemon_download(client, url, file, quality)
+            else:
+                downloader = YouTubeDownloader(
+                    output_dir=self.output_var.get(),
+                    quality=quality
+                )
+                if self.limit_var.get().strip():
+                    downloader.governor.set_limit(self.limit_var.get().strip())
+                self.active_downloader = downloader
+                
+                if url and is_collection_url(url):
+                    self.log(f"📃 Starting playlist/channel download: {url}")
+                    self.log(f"📊 Quality: {quality}")
+                    self.bulk_download_with_logging(downloader, url, self.audio_only_var.get(), lines=[url])
+                elif url:
+                    self.log(f"🎬 Starting download: {url}")
+                    self.log(f"📊 Quality: {quality}")
+                    self.download_with_logging(downloader, url, self.audio_only_var.get())
+                elif file:
+                    self.log(f"📋 Starting bulk download from: {file}")
+                    self.log(f"📊 Quality: {quality}")
+                    self.bulk_download_with_logging(downloader, file, self.audio_only_var.get())
             
             if self.is_downloading:
                 self.status_var.set("Download completed!")
@@ -360,118 +507,204 @@ class DownloaderGUI:
             
         finally:
             self.is_downloading = False
+            self.active_downloader = None
+            self.active_client = None
             self.root.after(0, lambda: self.download_btn.config(state="normal"))
             self.root.after(0, lambda: self.status_var.set("Ready"))
     
-    def download_with_logging(self, downloader, url, audio_only):
-        """Download single video with GUI logging"""
-        import subprocess
-        
-        format_string = downloader.get_format_string(downloader.quality, audio_only)
-        
-        cmd = [
-            'yt-dlp',
-            '-f', format_string,
-            '-o', str(downloader.output_dir / '%(title)s.%(ext)s'),
-            '--no-overwrites',
-            '--continue',
-            '--ignore-errors',
-            '--newline',
-            '--progress',
-        ]
-        
-        if audio_only:
-            cmd.extend([
-                '-x',
-                '--audio-format', downloader.audio_format,
-                '--audio-quality', downloader.audio_quality,
-            ])
+    def daemon_download(self, client, url, file, quality):
+        """Run the download on the downloader daemon and mirror its output here"""
+        audio_only = self.audio_only_var.get()
+        if url:
+            self.log(f"🛰️ Sending to the downloader daemon: {url}")
         else:
-            cmd.extend([
-                '--merge-output-format', 'mp4',
-            ])
+            self.log(f"🛰️ Sending to the downloader daemon: {file}")
+        self.log(f"📊 Quality: {quality}")
+        if self.limit_var.get().strip():
+            # The daemon's limit is shared by all of its jobs
+            client.set_limit(self.limit_var.get().strip())
+            self.log(f"🚦 Daemon speed limit set to {self.limit_var.get().strip()}")
+        self.active_client = client
+        
+        job = client.submit(
+            url=url or None,
+            file=None if url else str(Path(file).resolve()),
+            audio_only=audio_only,
+            quality=quality,
+            output=str(Path(self.output_var.get()).expanduser().resolve()),
+        )
+        summary = BulkSummary()
+        job = client.follow(
+            job,
+            log=lambda line: self.log(line, key=job['id'] if line.startswith('[download]') and '%' in line else None),
+            should_stop=lambda: not self.is_downloading,
+            on_progress=lambda progress: setattr(self, 'latest_progress', ProgressEvent(**progress)),
+            summary=summary,
+        )
         
-        cmd.append(url)
+        if job['kind'] == 'video':
+            if job['state'] == 'done':
+                self.log("✅ Download completed!")
+            else:
+                self.log(f"❌ Download failed: {job['error'] or job['state']}")
+            return
         
+        if not self.is_downloading:
+            self.log("\n⚠️ Download stopped by user")
+        self.log(f"\n{'='*50}")
+        self.log(f"📊 DOWNLOAD SUMMARY")
+        self.log(f"{'='*50}")
+        self.log(f"✅ Successful: {summary.success_count}/{summary.total}")
+        self.log(f"❌ Failed: {len(summary.failed_urls)}/{summary.total}")
+        if summary.failed_urls:
+            failed_file = Path(job['output']) / 'failed_urls.txt'
+            summary.save_failed(failed_file)
+            self.log(f"\n💾 Failed URLs saved to: {failed_file}")
+    
+    def run_async(self, coro):
+        """Run coro on the shared event loop and wait; Stop cancels it at once
+        
+        Returns None when it was cancelled.
+        """
+        if self.event_loop is None:
+            self.event_loop = EventLoopThread()
+        self.active_future = self.event_loop.submit(coro)
         try:
-            process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                text=True,
-                bufsize=1
-            )
-            
-            for line in process.stdout:
-                if not self.is_downloading:
-                    process.terminate()
-                    break
-                line = line.strip()
-                if line:
-                    self.root.after(0, lambda l=line: self.log(l))
-            
-            process.wait()
+            if not self.is_downloading:
+                self.active_future.cancel()
+            return self.active_future.result()
+        except concurrent.futures.CancelledError:
+            return None
+        finally:
+            self.active_future = None
+    
+    def download_with_logging(self, downloader, url, audio_only):
+        """Download single video with GUI logging"""
+        try:
+            on_line = lambda line: self.log(line, key=url if line.startswith('[download]') and '%' in line else None)
+            on_progress = lambda event: setattr(self, 'latest_progress', event)
+            if downloader.engine:
+                result = self.run_async(downloader.engine.download(
+                    url, audio_only, on_line=on_line, on_progress=on_progress
+                ))
+                if result is None:
+                    self.log("⚠️ Download cancelled")
+                    return False
+            else:
+                result = downloader.download(
+                    url,
+                    audio_only,
+                    on_line=on_line,
+                    should_stop=lambda: not self.is_downloading,
+                    on_progress=on_progress,
+                )
             
-            if process.returncode == 0:
-                self.root.after(0, lambda: self.log("✅ Download completed!"))
+            if result:
+                self.log("✅ Download completed!")
                 return True
             else:
-                self.root.after(0, lambda: self.log("❌ Download failed"))
-                return False
+                self.log("❌ Download failed")
+                # Falsy, and carries the error the bulk retry logic classifies
+                return result
                 
         except Exception as e:
             err_msg = str(e)
-            self.root.after(0, lambda msg=err_msg: self.log(f"❌ Error: {msg}"))
+            self.log(f"❌ Error: {err_msg}")
             return False
     
-    def bulk_download_with_logging(self, downloader, file_path, audio_only):
-        """Download multiple videos with GUI logging"""
-        from pathlib import Path
-        
-        file_path = Path(file_path)
-        
-        if not file_path.exists():
-            self.root.after(0, lambda: self.log(f"❌ File not found: {file_path}"))
+    def show_progress(self, event):
+        """Show a download progress event in the status bar"""
+        if event.phase != ProgressEvent.PHASE_DOWNLOAD:
+            self.status_var.set(f"{event.phase.replace('_', ' ').capitalize()}...")
             return
+        status = f"Downloading {event.percent:.1f}%" if event.percent is not None else "Downloading..."
+        if event.speed:
+            status += f" at {event.speed / (1024 * 1024):.2f} MB/s"
+        if event.eta is not None:
+            status += f" | ETA {int(event.eta // 60)}:{int(event.eta % 60):02d}"
+        self.status_var.set(status)
+    
+    def bulk_download_with_logging(self, downloader, file_path, audio_only, lines=None):
+        """Download multiple videos with GUI logging
         
-        with open(file_path, 'r', encoding='utf-8') as f:
-            urls = [line.strip() for line in f if line.strip() and line.strip().startswith('http')]
-        
-        if not urls:
-            self.root.after(0, lambda: self.log("❌ No valid URLs found in file"))
-            return
+        Playlists and channels are expanded as they are listed; lines
+        replaces the contents of file_path when given.
+        """
+        from pathlib import Path
         
-        self.root.after(0, lambda: self.log(f"\n📋 Found {len(urls)} URLs to download"))
+        if lines is None:
+            file_path = Path(file_path)
+            if not file_path.exists():
+                self.log(f"❌ File not found: {file_path}")
+                return
+        
+        dedupe = UrlDeduplicator()
+        summary = BulkSummary()
+        if lines is None:
+            summary.count_in_background(file_path)
+            self.log(f"\n📋 Reading URLs from {file_path.name}")
+        else:
+            self.log(f"\n📋 Listing videos of {file_path}")
+        self.log(f"⚡ Parallel downloads: {downloader.concurrent_downloads}")
+        
+        def listing_failed(url, error):
+            self.log(f"❌ Could not list {url}: {error}")
+            summary.added()
+            summary.record(url, False, classify_failure(error)[0])
+        
+        def download(url):
+            self.log(f"\n📥 Downloading: {url}")
+            return self.download_with_logging(downloader, url, audio_only)
+        
+        source = iter_url_lines(file_path) if lines is None else lines
+        archived = []
+        urls = downloader.skip_archived(
+            dedupe.filter(downloader.expand_urls(source, on_error=listing_failed)),
+            audio_only,
+            on_skip=archived.append,
+        )
+        if downloader.schedule_policy != 'fifo':
+            self.log(f"🗂️ Scheduling: {downloader.schedule_policy}")
+        urls = downloader.schedule(urls, audio_only, dedupe.priorities)
+        if downloader.engine:
+            self.run_async(downloader.engine.run_bulk(urls, audio_only, log=self.log, summary=summary))
+        else:
+            downloader.run_bulk(
+                urls,
+                download,
+                should_stop=lambda: not self.is_downloading,
+                log=self.log,
+                summary=summary,
+            )
         
-        success_count = 0
-        failed_urls = []
+        if archived:
+            self.log(f"📚 Skipped {len(archived)} videos already in the download archive")
+        if not summary.total:
+            if not archived:
+                self.log("❌ No valid URLs found in file")
+            return
+        if dedupe.duplicates:
+            self.log(f"♻️ Skipped {dedupe.duplicates} duplicate URLs")
         
-        for i, url in enumerate(urls, 1):
-            if not self.is_downloading:
-                self.root.after(0, lambda: self.log("\n⚠️ Download stopped by user"))
-                break
-                
-            self.root.after(0, lambda i=i, total=len(urls): self.log(f"\n{'='*50}"))
-            self.root.after(0, lambda i=i, total=len(urls): self.log(f"📥 Downloading {i}/{total}"))
-            self.root.after(0, lambda u=url: self.log(f"URL: {u}"))
-            self.root.after(0, lambda: self.status_var.set(f"Downloading {i}/{len(urls)}..."))
-            
-            if self.download_with_logging(downloader, url, audio_only):
-                success_count += 1
-            else:
-                failed_urls.append(url)
+        if not self.is_downloading:
+            self.log("\n⚠️ Download stopped by user")
         
         # Summary
-        self.root.after(0, lambda: self.log(f"\n{'='*50}"))
-        self.root.after(0, lambda: self.log(f"📊 DOWNLOAD SUMMARY"))
-        self.root.after(0, lambda: self.log(f"{'='*50}"))
-        self.root.after(0, lambda s=success_count, t=len(urls): self.log(f"✅ Successful: {s}/{t}"))
-        self.root.after(0, lambda f=len(failed_urls), t=len(urls): self.log(f"❌ Failed: {f}/{t}"))
-        
-        if failed_urls:
-            self.root.after(0, lambda: self.log(f"\n❌ Failed URLs:"))
-            for url in failed_urls:
-                self.root.after(0, lambda u=url: self.log(f"  - {u}"))
+        self.log(f"\n{'='*50}")
+        self.log(f"📊 DOWNLOAD SUMMARY")
+        self.log(f"{'='*50}")
+        self.log(f"✅ Successful: {summary.success_count}/{summary.total}")
+        self.log(f"❌ Failed: {len(summary.failed_urls)}/{summary.total}")
+        if summary.retried:
+            self.log(f"🔁 Retried after transient errors: {summary.retried}")
+        
+        if summary.failed_urls:
+            self.log(f"\n❌ Failed URLs:")
+            for url in summary.failed_urls:
+                self.log(f"  - {summary.describe_failed(url)}")
+            failed_file = downloader.output_dir / 'failed_urls.txt'
+            summary.save_failed(failed_file)
+            self.log(f"\n💾 Failed URLs saved to: {failed_file}")
 
 class TextRedirector:
     """Redirect text output to tkinter widget"""
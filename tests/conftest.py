@@ -0,0 +1,20 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from benchmark import BenchEnvironment
+
+
+@pytest.fixture
+def bench_env(monkeypatch):
+    """Local media server, fake yt-dlp executable and module; nothing leaves the machine"""
+    env = BenchEnvironment(64 * 1024, 0)
+    # Downloaders created without a config file read the benchmark's one
+    monkeypatch.chdir(env.tmp)
+    yield env
+    env.close()
\ No newline at end of file
@@ -0,0 +1,83 @@
+from pathlib import Path
+
+import pytest
+
+from benchmark import bench_urls
+from downloader import DownloadArchive, video_id_from_url
+
+
+@pytest.fixture
+def archive(tmp_path):
+    archive = DownloadArchive(tmp_path / 'archive.sqlite')
+    yield archive
+    archive.close()
+
+
+def write(path, data):
+    path.write_bytes(data)
+    return path
+
+
+def test_add_and_contains(tmp_path, archive):
+    path = write(tmp_path / 'a.mp4', b'video')
+    archive.add('aaaaaaaaaaa', '1080p', path, 'A video')
+    assert archive.contains('aaaaaaaaaaa', '1080p')
+    assert not archive.contains('aaaaaaaaaaa', 'audio-mp3')
+    assert archive.get('aaaaaaaaaaa', '1080p')[0] == str(path)
+    assert archive.find('a vid') == [('aaaaaaaaaaa', '1080p', 'A video', str(path))]
+    
+    reopened = DownloadArchive(tmp_path / 'archive.sqlite')
+    assert reopened.contains('aaaaaaaaaaa', '1080p')
+    reopened.close()
+
+
+def test_verify_drops_broken_files(tmp_path, archive):
+    intact = write(tmp_path / 'intact.mp4', b'x' * 100)
+    truncated = write(tmp_path / 'truncated.mp4', b'x' * 100)
+    corrupt = write(tmp_path / 'corrupt.mp4', b'x' * 100)
+    missing = write(tmp_path / 'missing.mp4', b'x' * 100)
+    for video_id, path in (('intact00000', intact), ('truncated00', truncated),
+                           ('corrupt0000', corrupt), ('missing0000', missing)):
+        archive.add(video_id, '1080p', path)
+    write(truncated, b'x' * 50)
+    write(corrupt, b'y' * 100)
+    missing.unlink()
+    
+    broken = {video_id: problem for video_id, fmt, path, problem in archive.verify()}
+    assert broken == {'truncated00': 'truncated', 'corrupt0000': 'corrupt', 'missing0000': 'missing'}
+    assert archive.count() == 1
+    assert archive.contains('intact00000', '1080p')
+
+
+@pytest.mark.parametrize('backend', ['subprocess', 'inprocess'])
+def test_second_run_skips_archived_videos(bench_env, backend):
+    downloader = bench_env.downloader(backend)
+    urls = bench_urls(3)
+    for url in urls:
+        result = downloader.download(url, on_line=lambda line: None)
+        assert result, result.error
+    assert downloader.archive.count() == 3
+    for url in urls:
+        assert downloader.archived_path(url).exists()
+    
+    skipped = []
+    extra = 'https://www.youtube.com/watch?v=bench999999'
+    assert list(downloader.skip_archived(urls + [extra], on_skip=skipped.append)) == [extra]
+    assert skipped == urls
+    # Audio is a different format, so nothing is skipped for it
+    assert list(downloader.skip_archived(urls, audio_only=True)) == urls
+
+
+def test_verify_archive_returns_broken_downloads(bench_env):
+    downloader = bench_env.downloader('subprocess')
+    urls = bench_urls(2)
+    for url in urls:
+        assert downloader.download(url, on_line=lambda line: None)
+    broken = downloader.archived_path(urls[0])
+    with open(broken, 'r+b') as f:
+        f.truncate(10)
+    
+    assert downloader.verify_archive() == [urls[0]]
+    assert not Path(broken).exists()
+    assert list(downloader.skip_archived(urls)) == [urls[0]]
+    assert video_id_from_url(urls[1]) in {row[0] for row in downloader.archive.find()}
\ No newline at end of file
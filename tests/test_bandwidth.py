@@ -0,0 +1,67 @@
+import time
+
+import pytest
+
+from downloader import BandwidthGovernor, parse_rate
+
+MB = 1024 * 1024
+
+
+def test_parse_rate():
+    assert parse_rate('500K') == 500 * 1024
+    assert parse_rate('2.5MB/s') == 2.5 * MB
+    assert parse_rate('0') is None
+    assert parse_rate(None) is None
+    with pytest.raises(ValueError):
+        parse_rate('fast')
+
+
+def test_unlimited_reserves_no_cap():
+    governor = BandwidthGovernor()
+    assert governor.reserve(4) is None
+    assert governor.try_reserve(4) == (True, None)
+    assert governor.reserved == 0
+
+
+def test_caps_never_add_up_to_more_than_the_limit():
+    governor = BandwidthGovernor('10M')
+    caps = [governor.reserve(4) for _ in range(4)]
+    assert caps == [2.5 * MB] * 4
+    assert governor.reserved == pytest.approx(10 * MB)
+    assert governor.try_reserve(4) == (False, None)
+    
+    governor.release(caps.pop())
+    assert governor.try_reserve(4) == (True, 2.5 * MB)
+
+
+def test_lowered_limit_waits_for_running_caps():
+    governor = BandwidthGovernor('10M')
+    caps = [governor.reserve(4) for _ in range(4)]
+    governor.set_limit('4M')
+    governor.release(caps.pop())
+    # 7.5M still reserved against a 4M budget
+    assert governor.try_reserve(4) == (False, None)
+    governor.release(caps.pop())
+    governor.release(caps.pop())
+    reserved, rate = governor.try_reserve(4)
+    assert reserved and rate == pytest.approx(1 * MB)
+    assert governor.reserved <= 4 * MB
+
+
+def test_partial_share_is_clamped_to_what_is_free():
+    governor = BandwidthGovernor('10M')
+    governor.reserve(1)
+    governor.set_limit('12M')
+    governor.release(0)
+    # 2M left of a 3M share: more than half, so it is handed out
+    assert governor.try_reserve(4) == (True, 2 * MB)
+    assert governor.reserved == pytest.approx(12 * MB)
+
+
+def test_consume_keeps_to_the_budget():
+    governor = BandwidthGovernor('1M')
+    start = time.monotonic()
+    for _ in range(4):
+        governor.consume(MB // 4)
+    # Half a second of burst, the rest at 1M/s
+    assert time.monotonic() - start >= 0.4
\ No newline at end of file
@@ -0,0 +1,113 @@
+import time
+import threading
+
+import pytest
+
+from benchmark import bench_urls
+from daemon import DownloadDaemon, DaemonServer, DaemonClient, Job
+
+
+@pytest.fixture
+def daemon(bench_env):
+    return DownloadDaemon(bench_env.downloader('subprocess'), workers=2)
+
+
+@pytest.fixture
+def client(daemon):
+    server = DaemonServer(('127.0.0.1', 0), daemon)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield DaemonClient(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+
+def wait_for(client, job_id, timeout=20):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = client.job(job_id)
+        if job['state'] in Job.FINISHED:
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"Job {job_id} still {job['state']}")
+
+
+def test_video_job_runs_to_done(client, tmp_path):
+    job = client.submit(url=bench_urls(1)[0], output=str(tmp_path / 'out'))
+    assert job['state'] == Job.QUEUED
+    job = wait_for(client, job['id'])
+    assert job['state'] == Job.DONE, job['error']
+    assert [path.name for path in (tmp_path / 'out').glob('*.mp4')] == ['Benchmark bench000000.mp4']
+    
+    # Archived now, so the same video finishes without another download
+    job = wait_for(client, client.submit(url=bench_urls(1)[0], output=str(tmp_path / 'out'))['id'])
+    assert job['state'] == Job.DONE
+    assert client.job(job['id'], lines=0)['lines'][0].startswith('📚 Already downloaded')
+
+
+def test_list_job_finishes_with_its_children(client, tmp_path):
+    urls = bench_urls(4) + bench_urls(1)
+    job = wait_for(client, client.submit(urls=urls, output=str(tmp_path))['id'])
+    assert job['state'] == Job.DONE
+    assert (job['total'], job['succeeded'], job['failed']) == (4, 4, 0)
+    assert len(client.job(job['id'], since=0)['children']) == 4
+
+
+def test_streamed_list_takes_urls_until_done(client, tmp_path):
+    job = client.submit(stream=True, output=str(tmp_path))
+    client.add_urls(job['id'], bench_urls(2))
+    client.add_urls(job['id'], bench_urls(1, offset=2), done=True)
+    job = wait_for(client, job['id'])
+    assert job['state'] == Job.DONE
+    assert job['succeeded'] == 3
+
+
+def test_bad_output_path_is_rejected(client, tmp_path):
+    blocker = tmp_path / 'a-file'
+    blocker.write_text('not a folder')
+    with pytest.raises(RuntimeError, match='Cannot use output folder'):
+        client.submit(url=bench_urls(1)[0], output=str(blocker / 'sub'))
+    assert client.jobs() == []
+    # Nested folders that do not exist yet are created
+    job = wait_for(client, client.submit(url=bench_urls(1)[0], output=str(tmp_path / 'new' / 'sub'))['id'])
+    assert job['state'] == Job.DONE
+
+
+def test_failing_job_does_not_kill_workers(daemon, client, tmp_path, monkeypatch):
+    downloader_for = daemon.downloader_for
+    calls = []
+    
+    def broken_once(output, quality):
+        calls.append(output)
+        if len(calls) <= daemon.workers:
+            raise OSError('disk went away')
+        return downloader_for(output, quality)
+    
+    monkeypatch.setattr(daemon, 'downloader_for', broken_once)
+    failed = [client.submit(url=url, output=str(tmp_path))['id'] for url in bench_urls(daemon.workers)]
+    for job_id in failed:
+        job = wait_for(client, job_id)
+        assert job['state'] == Job.FAILED
+        assert job['error'] == 'disk went away'
+    
+    assert all(thread.is_alive() for thread in daemon.threads)
+    jobs = [client.submit(url=url, output=str(tmp_path))['id'] for url in bench_urls(4, offset=10)]
+    assert [wait_for(client, job_id)['state'] for job_id in jobs] == [Job.DONE] * 4
+
+
+def test_cancel_queued_job(bench_env, daemon, client, tmp_path):
+    bench_env.configure(64 * 1024, 500)
+    running = [client.submit(url=url, output=str(tmp_path))['id'] for url in bench_urls(daemon.workers)]
+    queued = client.submit(url=bench_urls(1, offset=50)[0], output=str(tmp_path))
+    assert client.cancel(queued['id'])['state'] == Job.CANCELLED
+    assert [wait_for(client, job_id)['state'] for job_id in running] == [Job.DONE] * daemon.workers
+    assert client.job(queued['id'])['state'] == Job.CANCELLED
+    assert not (tmp_path / 'Benchmark bench000050.mp4').exists()
+
+
+def test_limit_endpoint(daemon, client):
+    assert client.request('GET', '/limit') == {'limit': None}
+    assert client.set_limit('2M') == {'limit': 2 * 1024 * 1024}
+    assert daemon.base.governor.current_limit() == 2 * 1024 * 1024
+    assert client.set_limit(None) == {'limit': None}
+    with pytest.raises(RuntimeError, match='Invalid rate'):
+        client.set_limit('fast')
\ No newline at end of file
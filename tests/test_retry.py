@@ -0,0 +1,60 @@
+import pytest
+
+from downloader import classify_failure, retry_delay, RetryQueue, PERMANENT, TRANSIENT
+
+
+@pytest.mark.parametrize('error, reason, kind', [
+    ('ERROR: [youtube] abc: Private video. Sign in if you have access', 'private', PERMANENT),
+    ('ERROR: Video unavailable. This video has been removed by the uploader', 'removed', PERMANENT),
+    ('ERROR: The uploader has not made this video available in your country', 'geo_blocked', PERMANENT),
+    ('ERROR: unable to download video data: HTTP Error 429: Too Many Requests', 'throttled', TRANSIENT),
+    ('ERROR: HTTP Error 503: Service Unavailable', 'server_error', TRANSIENT),
+    ('ERROR: Read timed out.', 'network', TRANSIENT),
+    ('ERROR: Requested format is not available', 'format_unavailable', PERMANENT),
+    ('Cancelled by user', 'cancelled', PERMANENT),
+    ('yt-dlp exited with status 1', 'error', PERMANENT),
+    (None, 'error', PERMANENT),
+])
+def test_classify_failure(error, reason, kind):
+    assert classify_failure(error) == (reason, kind)
+
+
+def test_retry_delay_grows_and_is_capped():
+    for failures, delay in ((1, 5), (2, 10), (3, 20), (10, 300)):
+        for _ in range(20):
+            assert delay / 2 <= retry_delay(failures, 5, 300) <= delay
+
+
+def test_queue_backs_off_then_gives_up():
+    retries = RetryQueue(attempts=2, backoff=10, backoff_max=300)
+    first = retries.defer('u')
+    second = retries.defer('u')
+    assert 5 <= first <= 10
+    assert 10 <= second <= 20
+    assert retries.defer('u') is None
+    url, wait = retries.poll()
+    assert url is None and 0 < wait <= 10
+
+
+def test_queue_drains_due_urls_once_nothing_runs():
+    retries = RetryQueue(attempts=3, backoff=0)
+    retries.started()
+    assert retries.defer('a') == 0
+    assert retries.poll() == ('a', None)
+    retries.done()
+    # 'a' is running again until done(); nothing else is due
+    assert retries.poll() == (None, float('inf'))
+    retries.done()
+    assert retries.poll() == (None, None)
+    assert list(retries.drain()) == []
+
+
+def test_drain_yields_deferred_urls():
+    retries = RetryQueue(attempts=1, backoff=0.01)
+    retries.defer('a')
+    retries.defer('b')
+    drained = []
+    for url in retries.drain():
+        drained.append(url)
+        retries.done()
+    assert sorted(drained) == ['a', 'b']
\ No newline at end of file
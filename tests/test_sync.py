@@ -0,0 +1,94 @@
+from downloader import SourceSync, SyncWatermarks
+
+CHANNEL = 'https://www.youtube.com/@chan/videos'
+PLAYLIST = 'https://www.youtube.com/playlist?list=PL123'
+
+
+def ids(*numbers):
+    return [f'vid{n:08d}' for n in numbers]
+
+
+def urls(video_ids):
+    return [f'https://www.youtube.com/watch?v={video_id}' for video_id in video_ids]
+
+
+def run(watermarks, source, listing, failed=()):
+    """One sync of source: list it, 'download' what is new and save"""
+    sync = watermarks.open(source)
+    wanted = list(sync.filter(urls(listing)))
+    for url in wanted:
+        failed_reason = 'throttled' if url.rsplit('=', 1)[1] in failed else None
+        watermarks.record(url, not failed_reason, failed_reason)
+    watermarks.save()
+    return sync, wanted
+
+
+def test_playlist_drops_known_videos_but_lists_in_full(tmp_path):
+    watermarks = SyncWatermarks(tmp_path / 'sync.sqlite')
+    run(watermarks, PLAYLIST, ids(1, 2, 3))
+    watermarks.close()
+    
+    watermarks = SyncWatermarks(tmp_path / 'sync.sqlite')
+    sync, wanted = run(watermarks, PLAYLIST, ids(1, 2, 3, 4))
+    assert wanted == urls(ids(4))
+    assert not sync.stopped
+    assert sync.avoided == 3
+    assert watermarks.open(PLAYLIST).entries == 4
+
+
+def test_channel_stops_at_first_known_video(tmp_path):
+    watermarks = SyncWatermarks(tmp_path / 'sync.sqlite')
+    run(watermarks, CHANNEL, ids(5, 4, 3, 2, 1))
+    watermarks.close()
+    
+    watermarks = SyncWatermarks(tmp_path / 'sync.sqlite')
+    sync, wanted = run(watermarks, CHANNEL, ids(7, 6, 5, 4, 3, 2, 1))
+    assert wanted == urls(ids(7, 6))
+    assert sync.stopped and sync.stop_index == 0
+    assert sync.avoided == 5
+    assert sync.listed_entries == 7
+    
+    stored = watermarks.open(CHANNEL)
+    assert stored.ids == ids(7, 6, 5, 4, 3, 2, 1)
+    assert stored.entries == 7
+
+
+def test_transient_failures_stay_pending(tmp_path):
+    watermarks = SyncWatermarks(tmp_path / 'sync.sqlite')
+    run(watermarks, CHANNEL, ids(3, 2, 1), failed=ids(2))
+    stored = watermarks.open(CHANNEL)
+    assert stored.pending == ids(2)
+    assert ids(2)[0] not in stored.known
+    watermarks.close()
+    
+    # The next listing stops at video 3, so the pending video is added after it
+    watermarks = SyncWatermarks(tmp_path / 'sync.sqlite')
+    sync, wanted = run(watermarks, CHANNEL, ids(4, 3, 2, 1))
+    assert wanted == urls(ids(4, 2))
+    # Videos 3 and 1 of the last listing; 2 is looked up again
+    assert sync.avoided == 2
+    stored = watermarks.open(CHANNEL)
+    assert stored.pending == []
+    assert set(ids(4, 3, 2, 1)) <= stored.known
+
+
+def test_interrupted_listing_keeps_new_videos_pending():
+    sync = SourceSync(CHANNEL, ids(2, 1), entries=2)
+    listing = sync.filter(urls(ids(4, 3, 2, 1)))
+    assert next(listing) == urls(ids(4))[0]
+    # Stopped before the listing reached the known videos
+    assert not sync.complete and not sync.stopped
+    assert sync.new == ids(4)
+
+
+def test_interrupted_listing_is_not_saved_as_known(tmp_path):
+    watermarks = SyncWatermarks(tmp_path / 'sync.sqlite')
+    run(watermarks, CHANNEL, ids(2, 1))
+    sync = watermarks.open(CHANNEL)
+    listing = sync.filter(urls(ids(4, 3, 2, 1)))
+    watermarks.record(next(listing), True)
+    watermarks.save()
+    stored = watermarks.open(CHANNEL)
+    # Knowing video 4 would stop the next listing before video 3
+    assert stored.ids == ids(2, 1)
+    assert stored.pending == ids(4)
\ No newline at end of file
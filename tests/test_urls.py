@@ -0,0 +1,52 @@
+from downloader import canonicalize_url, UrlDeduplicator, is_newest_first
+
+WATCH = 'https://www.youtube.com/watch?v=dQw4w9WgXcQ'
+
+
+def test_video_spellings_share_one_key():
+    spellings = [
+        'https://www.youtube.com/watch?v=dQw4w9WgXcQ',
+        'https://youtu.be/dQw4w9WgXcQ?si=abc',
+        'https://m.youtube.com/watch?v=dQw4w9WgXcQ&t=42s',
+        'https://music.youtube.com/watch?v=dQw4w9WgXcQ&feature=share',
+        'https://www.youtube.com/shorts/dQw4w9WgXcQ',
+        'https://www.youtube.com/embed/dQw4w9WgXcQ',
+        '  https://www.youtube.com/watch?v=dQw4w9WgXcQ  priority:5\n',
+    ]
+    for line in spellings:
+        assert canonicalize_url(line) == ('dQw4w9WgXcQ', WATCH)
+
+
+def test_non_urls_are_skipped():
+    assert canonicalize_url('') is None
+    assert canonicalize_url('# comment') is None
+    assert canonicalize_url('not a url') is None
+
+
+def test_playlists_and_other_sites():
+    key, url = canonicalize_url('https://m.youtube.com/playlist?list=PL123&si=x')
+    assert key == 'list:PL123'
+    assert url == 'https://www.youtube.com/playlist?list=PL123'
+    
+    key, url = canonicalize_url('https://Example.com/a?b=1&utm_source=x&fbclid=y#top')
+    assert url == 'https://example.com/a?b=1'
+    assert key == url
+
+
+def test_deduplicator_counts_duplicates_and_keeps_highest_priority():
+    dedupe = UrlDeduplicator()
+    lines = [
+        'https://youtu.be/dQw4w9WgXcQ priority:2',
+        '# a comment',
+        'https://www.youtube.com/watch?v=dQw4w9WgXcQ&t=1 priority:7',
+        'https://www.youtube.com/watch?v=aaaaaaaaaaa',
+        'https://www.youtube.com/shorts/dQw4w9WgXcQ',
+    ]
+    assert list(dedupe.filter(lines)) == [WATCH, 'https://www.youtube.com/watch?v=aaaaaaaaaaa']
+    assert dedupe.duplicates == 2
+    assert dedupe.priorities == {WATCH: 7}
+
+
+def test_newest_first_sources():
+    assert is_newest_first('https://www.youtube.com/@chan/videos')
+    assert not is_newest_first('https://www.youtube.com/playlist?list=PL123')
\ No newline at end of file